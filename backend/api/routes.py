@@ -1,76 +1,91 @@
 import os
 import json
+import time
 import logging
 import threading
-from flask import Blueprint, jsonify, send_from_directory, request
+from flask import Blueprint, Response, jsonify, send_file, send_from_directory, request
 from dotenv import set_key, load_dotenv
 
 import database
-from tasks import TASK_PROGRESS, scan_replays_task, sync_local_beatmaps_task
+import parser
+import mod_utils
+import rate_curves
+import scoring
+import jobs
+import maintenance
+import metrics
+import notifier
+import profiling
+import startup
+import thumbnails
+from tasks import TASK_PROGRESS, request_mod_cache_warm
 from config import env_path
+from utils import get_safe_join
 
 # Create a Blueprint for API routes
 api_blueprint = Blueprint('api', __name__, url_prefix='/api')
 
-def _add_rank_to_replay(replay):
+# Minimum time between two progress events on /progress-stream.
+PROGRESS_STREAM_INTERVAL_MS = int(os.getenv('PROGRESS_STREAM_INTERVAL_MS', '250'))
+PROGRESS_STREAM_KEEPALIVE = 15.0
+# Every open event stream holds a server thread. Streams end after this many
+# seconds (EventSource reconnects on its own), and at most MAX_OPEN_STREAMS are
+# served at once, half of the default SERVER_THREADS; service.py sizes it from --threads.
+STREAM_MAX_SECONDS = float(os.getenv('STREAM_MAX_SECONDS', '300'))
+MAX_OPEN_STREAMS = int(os.getenv('MAX_OPEN_STREAMS', '4'))
+# Milliseconds an EventSource waits before reconnecting.
+STREAM_RETRY_MS = 1000
+# Browser cache lifetime of song files (audio previews); after it, they are revalidated by ETag.
+SONG_FILE_MAX_AGE = 24 * 3600
+# Browser cache lifetime of thumbnails; their content only changes if the background image is replaced.
+THUMBNAIL_MAX_AGE = 30 * 24 * 3600
+# How long a request waits for the startup migration before it gets a 503.
+STARTUP_WAIT_SECONDS = float(os.getenv('STARTUP_WAIT_SECONDS', '30'))
+
+_open_streams = 0
+_streams_lock = threading.Lock()
+
+def _keepalive_timeout(deadline):
+    """Seconds an event stream waits for news before a keepalive, without passing its deadline."""
+    return max(0.0, min(PROGRESS_STREAM_KEEPALIVE, deadline - time.monotonic()))
+
+def _event_stream_response(generate):
     """
-    Calculates and adds the rank to a replay dictionary in-place.
-    For osu!standard, it calculates from score stats. For other modes, it uses the grade from osu!.db.
+    Serves an SSE generator, called with the monotonic time at which it must
+    end. Returns a 503 while MAX_OPEN_STREAMS streams are already open.
     """
-    beatmap_info = replay.get('beatmap', {})
-    game_mode = replay.get('game_mode')
-
-    # --- Live Rank Calculation for osu!standard (mode 0) ---
-    if game_mode == 0:
-        n300 = replay.get('num_300s', 0)
-        n100 = replay.get('num_100s', 0)
-        n50 = replay.get('num_50s', 0)
-        n_miss = replay.get('num_misses', 0)
-
-        num_circles = beatmap_info.get('num_hitcircles')
-        num_sliders = beatmap_info.get('num_sliders')
-        num_spinners = beatmap_info.get('num_spinners')
-        
-        if num_circles is not None and num_sliders is not None and num_spinners is not None:
-            total_objects = num_circles + num_sliders + num_spinners
-            if total_objects > 0 and (n300 + n100 + n50 + n_miss) == total_objects:
-                ratio_300 = n300 / total_objects
-                ratio_50 = n50 / total_objects
-                accuracy = (n300 * 300 + n100 * 100 + n50 * 50) / (total_objects * 300)
-
-                if accuracy == 1.0: replay['rank'] = "SS"
-                elif ratio_300 > 0.9 and ratio_50 < 0.01 and n_miss == 0: replay['rank'] = "S"
-                elif (ratio_300 > 0.8 and n_miss == 0) or (ratio_300 > 0.9): replay['rank'] = "A"
-                elif (ratio_300 > 0.7 and n_miss == 0) or (ratio_300 > 0.8): replay['rank'] = "B"
-                elif ratio_300 > 0.6: replay['rank'] = "C"
-                else: replay['rank'] = "D"
-                return
-
-    # --- Fallback to osu!.db grade for other modes or if live calc fails ---
-    def get_rank_from_grade(grade_val):
-        ranks = {0: "SS", 1: "S", 2: "SS", 3: "S", 4: "A", 5: "B", 6: "C", 7: "D"}
-        return ranks.get(grade_val, "N/A")
+    global _open_streams
+    with _streams_lock:
+        if _open_streams >= MAX_OPEN_STREAMS:
+            return jsonify({"error": "Too many open event streams."}), 503, {'Retry-After': '5'}
+        _open_streams += 1
 
-    try:
-        grades = json.loads(beatmap_info.get('grades', '{}'))
-    except (json.JSONDecodeError, TypeError):
-        grades = {}
-
-    grade_val = -1
-    if game_mode == 0: grade_val = grades.get('osu')
-    elif game_mode == 1: grade_val = grades.get('taiko')
-    elif game_mode == 2: grade_val = grades.get('ctb')
-    elif game_mode == 3: grade_val = grades.get('mania')
-    
-    replay['rank'] = get_rank_from_grade(grade_val)
+    def release():
+        global _open_streams
+        with _streams_lock:
+            _open_streams -= 1
+
+    response = Response(generate(time.monotonic() + STREAM_MAX_SECONDS), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(release)
+    return response
+
+@api_blueprint.before_request
+def wait_for_database():
+    """Holds requests that arrive while the database is still being initialized (see startup.py)."""
+    if request.endpoint == 'api.get_startup_report':
+        return None
+    state = startup.wait_for_database(STARTUP_WAIT_SECONDS)
+    if state['status'] == 'error':
+        return jsonify({"error": f"Database initialization failed: {state['error']}"}), 500
+    if state['status'] != 'ready':
+        return jsonify({"error": "The database is still being prepared.", "startup": state}), 503
+    return None
 
-def _calculate_accuracy(replay):
-    """Helper to calculate osu!standard accuracy from a replay dict."""
-    if replay.get('game_mode') == 0:
-        total_hits = replay.get('num_300s', 0) + replay.get('num_100s', 0) + replay.get('num_50s', 0) + replay.get('num_misses', 0)
-        if total_hits == 0: return 0.0
-        return ((replay.get('num_300s', 0) * 300 + replay.get('num_100s', 0) * 100 + replay.get('num_50s', 0) * 50) / (total_hits * 300)) * 100
-    return 0.0
+@api_blueprint.route('/startup', methods=['GET'])
+def get_startup_report():
+    """Startup phase timings (ms since launch) and the state of the database initialization."""
+    return jsonify(startup.report())
 
 @api_blueprint.route('/beatmaps', methods=['GET'])
 def get_beatmaps():
@@ -87,7 +102,7 @@ def get_replays():
     search_term = request.args.get('search')
     replays_data = database.get_all_replays(player_name=player_name, page=page, limit=limit, search_term=search_term)
     for replay in replays_data['replays']:
-        _add_rank_to_replay(replay)
+        scoring.add_rank_to_replay(replay)
     return jsonify(replays_data)
 
 @api_blueprint.route('/replays/latest', methods=['GET'])
@@ -98,7 +113,7 @@ def get_latest_replay():
     replays_data = database.get_all_replays(player_name=player_name, page=1, limit=1)
     if replays_data and replays_data['replays']:
         latest_replay = replays_data['replays'][0]
-        _add_rank_to_replay(latest_replay)
+        scoring.add_rank_to_replay(latest_replay)
         return jsonify(latest_replay)
     return jsonify({"message": "No replays found for this player."}), 404
 
@@ -108,17 +123,7 @@ def get_players():
 
 @api_blueprint.route('/players/<player_name>/stats', methods=['GET'])
 def get_player_stats(player_name):
-    replays = database.get_all_replays(player_name=player_name, limit=100000)['replays']
-    if not replays:
-        return jsonify({"total_pp": 0, "play_count": 0, "top_play_pp": 0})
-    pp_plays = sorted([r for r in replays if r.get('pp', 0) > 0], key=lambda r: r['pp'], reverse=True)
-    total_pp = sum(r['pp'] * (0.95 ** i) for i, r in enumerate(pp_plays))
-    top_play_pp = pp_plays[0]['pp'] if pp_plays else 0
-    return jsonify({
-        "total_pp": round(total_pp, 2),
-        "play_count": len(replays),
-        "top_play_pp": round(top_play_pp, 2)
-    })
+    return jsonify(database.get_player_stats(player_name))
 
 @api_blueprint.route('/players/<player_name>/suggest-sr', methods=['GET'])
 def suggest_sr(player_name):
@@ -126,13 +131,12 @@ def suggest_sr(player_name):
     focus = request.args.get('focus')
     
     replays = database.get_all_replays(player_name=player_name, limit=100000)['replays']
-    CORE_MOD_MASK = 2 | 8 | 16 | 64 | 256 | 1024 # EZ, HD, HR, DT, HT, FL
-    
-    # First, filter by selected mod combination
+
+    # First, filter by selected mod combination (EZ, HD, HR, DT/NC, HT, FL)
     mod_plays = []
     for r in replays:
         if r.get('stars') and r.get('game_mode') == 0:
-            if (r.get('mods_used', 0) & CORE_MOD_MASK) == (mods & CORE_MOD_MASK):
+            if mod_utils.normalize_mods(r.get('mods_used', 0)) == mod_utils.normalize_mods(mods):
                 mod_plays.append(r)
     
     if not mod_plays:
@@ -188,16 +192,91 @@ def get_recommendation():
         return jsonify({"error": "Missing 'sr' or 'bpm' parameters."}), 400
         
     beatmap = database.get_recommendation(target_sr, max_bpm, mods, excluded_ids, focus)
+
+    # Fill the difficulty cache for this combination in the background if it is not fully indexed yet.
+    difficulty_mods = mod_utils.normalize_mods(mods)
+    cache_complete = True
+    if difficulty_mods:
+        cache_complete = database.get_mod_cache_coverage([difficulty_mods])[difficulty_mods]['complete']
+        if not cache_complete:
+            request_mod_cache_warm(difficulty_mods)
+
     if beatmap:
         return jsonify(beatmap)
+    if not cache_complete:
+        return jsonify({"message": "No new map found. The difficulty cache for these mods is still being built, try again shortly."}), 404
     return jsonify({"message": "No new map found. Try adjusting the values."}), 404
 
+@api_blueprint.route('/recommend/rate', methods=['GET'])
+def get_rate_recommendation():
+    target_sr = request.args.get('sr', type=float)
+    max_bpm = request.args.get('bpm', type=int)
+    min_rate = request.args.get('min_rate', rate_curves.RATE_GRID[0], type=float)
+    max_rate = request.args.get('max_rate', rate_curves.RATE_GRID[-1], type=float)
+    excluded_ids = request.args.get('exclude', '').split(',') if request.args.get('exclude') else []
+
+    if target_sr is None or max_bpm is None:
+        return jsonify({"error": "Missing 'sr' or 'bpm' parameters."}), 400
+
+    beatmap = rate_curves.recommend_with_rate(target_sr, max_bpm, min_rate, max_rate, excluded_ids)
+    if beatmap:
+        return jsonify(beatmap)
+    return jsonify({"message": "No map and rate combination found. Try adjusting the values."}), 404
+
+@api_blueprint.route('/beatmaps/<md5_hash>/rate-curve', methods=['GET'])
+def get_beatmap_rate_curve(md5_hash):
+    index = rate_curves.get_index()
+    rate = request.args.get('rate', type=float)
+    if rate is not None:
+        stars = index.value_at(md5_hash, rate)
+        if stars is None:
+            return jsonify({"error": "No rate curve stored for this beatmap."}), 404
+        return jsonify({"rate": rate, "stars": round(stars, 2)})
+    curve = {attr: index.curve(md5_hash, attr) for attr in rate_curves.CURVE_ATTRIBUTES}
+    if curve['stars'] is None:
+        return jsonify({"error": "No rate curve stored for this beatmap."}), 404
+    return jsonify({"rates": list(rate_curves.RATE_GRID), **{attr: [round(v, 2) for v in values] for attr, values in curve.items()}})
+
+@api_blueprint.route('/mod-cache/coverage', methods=['GET'])
+def get_mod_cache_coverage():
+    coverage = database.get_mod_cache_coverage()
+    return jsonify({
+        "coverage": {str(mods): stats for mods, stats in coverage.items()},
+        "replay_mods": [{"mods": mods, "plays": plays} for mods, plays in database.get_replay_mod_frequencies()],
+        "warm": TASK_PROGRESS['warm'].snapshot()
+    })
+
 @api_blueprint.route('/songs/<path:file_path>')
 def serve_song_file(file_path):
+    """
+    Serves a file from the Songs folder. Range requests get 206 partial
+    responses, so audio previews only download the part they play; ETag and
+    Last-Modified let the browser revalidate cached files cheaply.
+    """
     osu_folder = os.getenv('OSU_FOLDER')
     if not osu_folder:
         return jsonify({"error": "OSU_FOLDER path not set"}), 500
-    return send_from_directory(os.path.join(osu_folder, 'Songs'), file_path)
+    return send_from_directory(os.path.join(osu_folder, 'Songs'), file_path,
+                               conditional=True, max_age=SONG_FILE_MAX_AGE)
+
+@api_blueprint.route('/thumbnails/<folder_name>/<path:file_name>')
+def serve_thumbnail(folder_name, file_name):
+    """A card-sized thumbnail of a beatmap background, or the original image when none can be made."""
+    osu_folder = os.getenv('OSU_FOLDER')
+    if not osu_folder:
+        return jsonify({"error": "OSU_FOLDER path not set"}), 500
+    songs_path = os.path.join(osu_folder, 'Songs')
+    source_path = get_safe_join(songs_path, folder_name, file_name)
+    if not source_path or not os.path.isfile(source_path):
+        return jsonify({"error": "Image not found."}), 404
+    thumbnail_path = thumbnails.ensure_thumbnail(source_path)
+    if thumbnail_path is None:
+        return send_file(source_path, max_age=THUMBNAIL_MAX_AGE)
+    return send_file(thumbnail_path, mimetype=thumbnails.mimetype(), max_age=THUMBNAIL_MAX_AGE)
+
+@api_blueprint.route('/thumbnails', methods=['GET'])
+def get_thumbnail_stats():
+    return jsonify(thumbnails.get_cache_stats())
 
 @api_blueprint.route('/config', methods=['GET'])
 def get_config():
@@ -224,24 +303,165 @@ def save_config():
         logging.error(f"Failed to save configuration: {e}", exc_info=True)
         return jsonify({"error": "Failed to write to .env file."}), 500
 
+def _submit_user_job(job_type):
+    """Submits a unique job; {"profile": true} in the request body profiles this run."""
+    profile = (request.get_json(silent=True) or {}).get('profile')
+    if profile:
+        profiling.profile_next(job_type)
+    job = jobs.scheduler.submit(job_type, unique=True)
+    if job is None and profile:
+        profiling.disarm(job_type)
+    return job
+
 @api_blueprint.route('/scan', methods=['POST'])
 def scan_replays_folder_endpoint():
-    if TASK_PROGRESS['scan']['status'] == 'running':
+    job = _submit_user_job('scan')
+    if job is None:
         return jsonify({"error": "Scan already in progress."}), 409
-    thread = threading.Thread(target=scan_replays_task)
-    thread.daemon = True
-    thread.start()
     return jsonify({"status": "Scan process started."}), 202
 
 @api_blueprint.route('/sync-beatmaps', methods=['POST'])
 def sync_beatmaps_endpoint():
-    if TASK_PROGRESS['sync']['status'] == 'running':
+    job = _submit_user_job('sync')
+    if job is None:
         return jsonify({"error": "Sync already in progress."}), 409
-    thread = threading.Thread(target=sync_local_beatmaps_task)
-    thread.daemon = True
-    thread.start()
     return jsonify({"status": "Sync process started."}), 202
 
+@api_blueprint.route('/recompute', methods=['GET'])
+def get_recompute_status():
+    return jsonify({"calc_version": parser.CALC_VERSION, "stale": database.count_stale_rows()})
+
+@api_blueprint.route('/recompute', methods=['POST'])
+def recompute_endpoint():
+    job = _submit_user_job('recompute')
+    if job is None:
+        return jsonify({"error": "Recompute already in progress."}), 409
+    return jsonify({"status": "Recompute process started."}), 202
+
+@api_blueprint.route('/maintenance', methods=['GET'])
+def get_maintenance_status():
+    """Reports database storage statistics and whether the hot queries use their indexes."""
+    return jsonify({
+        "storage": database.get_storage_stats(),
+        "query_plans": maintenance.check_query_plans(),
+        "last_run": TASK_PROGRESS['maintenance'].snapshot()
+    })
+
+@api_blueprint.route('/maintenance', methods=['POST'])
+def maintenance_endpoint():
+    job = jobs.scheduler.submit('maintenance', unique=True)
+    if job is None:
+        return jsonify({"error": "Database maintenance already in progress."}), 409
+    return jsonify({"status": "Database maintenance started."}), 202
+
+@api_blueprint.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Latency histograms and counters, in Prometheus text format or as JSON (?format=json)."""
+    if request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json':
+        return jsonify(metrics.snapshot())
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@api_blueprint.route('/metrics', methods=['DELETE'])
+def reset_metrics():
+    metrics.reset()
+    return jsonify({"status": "Metrics reset."})
+
+@api_blueprint.route('/profiles', methods=['GET'])
+def get_profiles():
+    return jsonify({"settings": profiling.get_settings(), "folder": profiling.get_profile_dir(),
+                    "profiles": profiling.list_profiles()})
+
+@api_blueprint.route('/profiles', methods=['POST'])
+def update_profiling():
+    """Turns profiling on or off at runtime, e.g. {"enabled": true, "targets": ["sync", "/api/recommend"]}."""
+    data = request.get_json(silent=True) or {}
+    try:
+        profiling.update_settings(data.get('enabled'), data.get('mode'), data.get('targets'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(profiling.get_settings())
+
+@api_blueprint.route('/profiles/<path:name>', methods=['GET'])
+def download_profile(name):
+    return send_from_directory(profiling.get_profile_dir(), name, as_attachment=True)
+
+@api_blueprint.route('/jobs', methods=['GET'])
+def get_jobs():
+    return jsonify(jobs.scheduler.list_jobs())
+
+@api_blueprint.route('/jobs/cancel', methods=['POST'])
+def cancel_jobs():
+    """Cancels jobs by id or by type, e.g. {"type": "sync"}."""
+    data = request.get_json(silent=True) or {}
+    if 'id' not in data and 'type' not in data:
+        return jsonify({"error": "Provide a job 'id' or 'type'."}), 400
+    cancelled = jobs.scheduler.cancel(job_id=data.get('id'), job_type=data.get('type'))
+    if not cancelled:
+        return jsonify({"error": "No matching job is queued or running."}), 404
+    return jsonify({"cancelled": cancelled})
+
 @api_blueprint.route('/progress-status', methods=['GET'])
 def get_progress_status():
-    return jsonify(TASK_PROGRESS)
\ No newline at end of file
+    return jsonify(TASK_PROGRESS.snapshot())
+
+@api_blueprint.route('/task-runs', methods=['GET'])
+def get_task_runs():
+    """History of finished task runs with their stage timings and queue depths, newest first."""
+    task = request.args.get('task')
+    limit = min(max(request.args.get('limit', 20, type=int), 1), database.TASK_RUNS_KEPT)
+    return jsonify(database.get_task_runs(task, limit))
+
+@api_blueprint.route('/progress-stream', methods=['GET'])
+def progress_stream():
+    """
+    Server-Sent Events stream of task progress. A snapshot of every task is
+    sent on connect and then whenever something changes, at most once per
+    `interval` ms; a comment line keeps idle connections open.
+    """
+    interval = max(50, request.args.get('interval', PROGRESS_STREAM_INTERVAL_MS, type=int)) / 1000.0
+
+    def generate(deadline):
+        version = None
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+        while time.monotonic() < deadline:
+            new_version = TASK_PROGRESS.wait_for_change(version, timeout=_keepalive_timeout(deadline))
+            if new_version == version:
+                yield ": keepalive\n\n"
+                continue
+            version = new_version
+            yield f"data: {json.dumps(TASK_PROGRESS.snapshot())}\n\n"
+            # Changes made while sleeping are folded into the next snapshot.
+            time.sleep(interval)
+
+    return _event_stream_response(generate)
+
+@api_blueprint.route('/events', methods=['GET'])
+def event_stream():
+    """
+    Server-Sent Events stream of watcher events ('replaysadded') for browsers
+    using a headless server (see notifier.build_dispatcher). A reconnecting
+    EventSource sends Last-Event-ID (a client that opens a new EventSource
+    passes ?last_event_id=) and receives the events it missed, as far as
+    they are still kept. Each stream starts with a 'streamstart' event that
+    carries the id to resume from.
+    """
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('last_event_id', type=int)
+    if since is None:
+        since = notifier.broadcaster.sequence
+
+    def generate(deadline):
+        last_seen = since
+        # Tells the client where this stream starts, so that a reconnect resumes from here.
+        yield f"retry: {STREAM_RETRY_MS}\nid: {last_seen}\nevent: streamstart\ndata: {{}}\n\n"
+        while time.monotonic() < deadline:
+            events = notifier.broadcaster.wait_for_events(last_seen, timeout=_keepalive_timeout(deadline))
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            for sequence, event_name, payload in events:
+                yield f"id: {sequence}\nevent: {event_name}\ndata: {json.dumps(payload)}\n\n"
+                last_seen = sequence
+
+    return _event_stream_response(generate)
\ No newline at end of file
@@ -1,28 +1,45 @@
+# Imported first: startup phases are timed from here.
+import startup
+
 import os
 import sys
+import time
 import logging
 import threading
-import webview
 import signal
-import shutil
-import sqlite3
 from flask import Flask, send_from_directory, abort
 from flask_cors import CORS
 
 # Import configurations and modular components
-from config import IS_BUNDLED, static_folder_path, BASE_DIR
+from config import IS_BUNDLED, static_folder_path, BASE_DIR, configure_logging, ensure_env_file
 from api.routes import api_blueprint
 import database
-import watcher
+import jobs
+import backup
+import maintenance
+import metrics
+import notifier
+import profiling
+
+# pywebview, watchdog and rosu-pp are imported where they are first needed,
+# so the server can start serving the frontend while they load.
+
+# Worker threads of the waitress server (one per concurrent request).
+SERVER_THREADS = int(os.getenv('SERVER_THREADS', '8'))
+# How long shutting down waits for replay ingests to drain and bulk jobs to stop.
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', '30'))
 
 # --- Globals ---
 # This will hold the pywebview window instance, accessible by the Api class.
+# It stays None in headless mode (service.py).
 window = None
+watcher_thread = None
 
 # --- pywebview API for native functionality ---
 class Api:
     def export_database_dialog(self):
-        """Opens a native 'Save As' dialog to export the database."""
+        """Opens a native 'Save As' dialog and exports the database in the background."""
+        import webview
         try:
             db_path = os.path.join(BASE_DIR, database.DATABASE_FILE)
             if not os.path.exists(db_path):
@@ -35,21 +52,22 @@ class Api:
                 file_types=('Database Files (*.db)',)
             )
 
-            if result:
-                # create_file_dialog returns a tuple, even for single files
-                save_path = result[0]
-                shutil.copy(db_path, save_path)
-                logging.info(f"Database exported successfully to {save_path}")
-                return {"status": "success", "message": "Database exported successfully."}
-            else:
+            if not result:
                 return {"status": "info", "message": "Export cancelled by user."}
 
+            # create_file_dialog returns a tuple, even for single files
+            save_path = result[0] if isinstance(result, (list, tuple)) else result
+            if jobs.scheduler.submit('backup', 'export', save_path, unique=True) is None:
+                return {"status": "error", "message": "An export or import is already running."}
+            return {"status": "info", "message": "Export started..."}
+
         except Exception as e:
             logging.error(f"Failed to export database via dialog: {e}", exc_info=True)
             return {"status": "error", "message": f"An error occurred: {e}"}
 
     def import_database_dialog(self):
-        """Opens a native 'Open' dialog to import a database."""
+        """Opens a native 'Open' dialog and imports the chosen database in the background."""
+        import webview
         try:
             result = window.create_file_dialog(
                 webview.OPEN_DIALOG,
@@ -61,24 +79,17 @@ class Api:
                 return {"status": "info", "message": "Import cancelled by user."}
 
             import_path = result[0]
-            db_path = os.path.join(BASE_DIR, database.DATABASE_FILE)
-            
-            # Validation Step
+
+            # Validate up front so an obviously wrong file is reported right away
             try:
-                conn = sqlite3.connect(import_path)
-                cursor = conn.cursor()
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='replays';")
-                if cursor.fetchone() is None:
-                    raise sqlite3.DatabaseError("Database is missing 'replays' table.")
-                conn.close()
-            except sqlite3.Error as e:
+                backup.validate_database(import_path)
+            except ValueError as e:
                 logging.warning(f"Invalid database file selected for import: {e}")
-                return {"status": "error", "message": f"Invalid database file: {e}"}
+                return {"status": "error", "message": str(e)}
 
-            # Replacement Step (app must be restarted to release file lock on Windows)
-            shutil.copy(import_path, db_path)
-            logging.info(f"Database imported from {import_path}. Restart is required.")
-            return {"status": "success", "message": "Database imported. Please restart the application."}
+            if jobs.scheduler.submit('backup', 'import', import_path, unique=True) is None:
+                return {"status": "error", "message": "An export or import is already running."}
+            return {"status": "info", "message": "Import started..."}
 
         except Exception as e:
             logging.error(f"Failed to import database via dialog: {e}", exc_info=True)
@@ -88,13 +99,22 @@ class Api:
 app = Flask(__name__, static_folder=static_folder_path, static_url_path='')
 CORS(app)
 app.register_blueprint(api_blueprint)
+# Latency metrics for /api/metrics (a no-op unless METRICS_ENABLED=1)
+metrics.install(app)
+# Opt-in cProfile of /api requests (see profiling.py)
+profiling.install(app)
 
 # --- Frontend Serving ---
+_index_served = threading.Event()
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve_index(path):
     """Serves the frontend application."""
     if path == "":
+        if not _index_served.is_set():
+            _index_served.set()
+            startup.mark('index served')
         return send_from_directory(app.static_folder, 'index.html')
 
     # Prevent directory traversal.
@@ -118,22 +138,75 @@ def run_server():
     """Runs the Flask server using waitress for production bundles."""
     if IS_BUNDLED:
         from waitress import serve
-        serve(app, host="127.0.0.1", port=5000)
+        serve(app, host="127.0.0.1", port=5000, threads=SERVER_THREADS)
     else:
         # Use Flask's built-in server for development (with debug=False to avoid reloader issues)
         app.run(host="127.0.0.1", port=5000, debug=False)
 
+def start_watcher():
+    """
+    Starts the watchdog service that monitors for new replays, if the osu!
+    folder is set. New replays go to the window, or to /api/events without one.
+    """
+    global watcher_thread
+    osu_folder = os.getenv("OSU_FOLDER")
+    if not osu_folder:
+        logging.warning("OSU_FOLDER not set. Automatic replay detection is disabled.")
+        return
+    import watcher
+    watcher_thread = threading.Thread(target=watcher.start_watching,
+                                      args=(osu_folder, notifier.build_dispatcher(window)), name='watcher')
+    watcher_thread.daemon = True
+    watcher_thread.start()
+
+def start_background_init():
+    """
+    Migrates the database, then picks up background jobs that were interrupted
+    when the app last closed, refreshes statistics and checks query plans while
+    the app is idle, and starts watching the osu! folder.
+    """
+    startup.start_background_init(database.init_db, steps=[
+        ('jobs resumed', jobs.scheduler.resume_interrupted),
+        ('maintenance queued', maintenance.request_maintenance),
+        ('watcher started', start_watcher),
+    ])
+
+def stop_background_work(timeout=SHUTDOWN_TIMEOUT):
+    """
+    Stops the watcher once the replays it already detected are stored and
+    pushed, then interrupts the remaining jobs; resumable ones continue from
+    their checkpoint on the next start. Returns False if that took longer than
+    timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    drained = True
+    if watcher_thread is not None:
+        import watcher
+        logging.info("Stopping the watcher and ingesting replays already detected...")
+        drained = watcher.stop_watching(drain=True, timeout=timeout)
+    drained = jobs.scheduler.shutdown(timeout=max(0.0, deadline - time.monotonic())) and drained
+    if drained:
+        logging.info("Background work stopped.")
+    else:
+        logging.warning(f"Background work did not stop within {timeout:.0f} s; exiting anyway.")
+    return drained
+
 # --- Main Application Entry Point ---
 if __name__ == '__main__':
-    # Initialize the database on startup
-    database.init_db()
+    configure_logging()
+    startup.mark('imports')
+    ensure_env_file()
 
-    # Start the backend server in a separate thread
+    # Start the backend server in a separate thread. The frontend is served
+    # right away; /api requests wait until the database is ready.
     server_thread = threading.Thread(target=run_server)
     server_thread.daemon = True
     server_thread.start()
     logging.info("Backend server started in a background thread.")
-    
+
+    import webview
+    startup.mark('webview imported')
+
     # Create an instance of the API class that will be exposed to Javascript
     api = Api()
 
@@ -147,19 +220,15 @@ if __name__ == '__main__':
         min_size=(960, 600),
         js_api=api
     )
-    
-    # Start the watchdog service to monitor for new replays
-    osu_folder = os.getenv("OSU_FOLDER")
-    if osu_folder:
-        watcher_thread = threading.Thread(target=watcher.start_watching, args=(osu_folder, window))
-        watcher_thread.daemon = True
-        watcher_thread.start()
-    else:
-        logging.warning("OSU_FOLDER not set. Automatic replay detection is disabled.")
+    window.events.shown += lambda: startup.mark('window shown')
+    window.events.loaded += lambda: startup.mark('window loaded')
+
+    start_background_init()
 
     def on_closing():
         """Handle window closing event to gracefully shut down the app."""
         logging.info("Webview window is closing. Shutting down application.")
+        stop_background_work()
         if not IS_BUNDLED:
             # In development, a SIGINT is needed to stop the Flask server
             os.kill(os.getpid(), signal.SIGINT)
@@ -167,4 +236,4 @@ if __name__ == '__main__':
     window.events.closing += on_closing
 
     # Start the pywebview event loop
-    webview.start(debug=not IS_BUNDLED)
\ No newline at end of file
+    webview.start(debug=not IS_BUNDLED)
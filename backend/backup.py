@@ -0,0 +1,119 @@
+"""
+Online export and import of the tracker database.
+
+Both directions use the SQLite backup API and copy BACKUP_PAGES_PER_STEP
+pages per step, so a large database never blocks the app for the whole copy.
+Progress is reported per step. An export always produces a consistent
+snapshot: if the app writes to the database mid-copy, SQLite restarts the
+copy. It is written to a temporary file next to the target and renamed
+into place once complete.
+
+An import copies the chosen file over the live database in one transaction.
+Bulk jobs are cancelled first, since the copy locks the database for
+writing until it finishes. Every database function opens its own
+connection, so the imported data is live as soon as the copy completes and
+no restart is needed.
+"""
+import os
+import sqlite3
+import logging
+
+import database
+import rate_curves
+import maintenance
+import jobs
+from tasks import TASK_PROGRESS, request_mod_cache_warm
+
+BACKUP_PAGES_PER_STEP = int(os.getenv('DB_BACKUP_PAGES_PER_STEP', '1024'))
+# Wait between retries while another connection holds a lock the copy needs.
+BACKUP_BUSY_SLEEP = 0.05
+
+def validate_database(path):
+    """Raises ValueError unless path is an osu! tracker database."""
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            row = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='replays'").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        raise ValueError(f"Invalid database file: {e}")
+    if row is None:
+        raise ValueError("Invalid database file: it has no 'replays' table.")
+
+def _copy(source, target, progress, job):
+    """Copies source into target step by step, reporting pages copied and honouring cancellation."""
+    def on_step(status, remaining, total):
+        progress.update(current=total - remaining, total=total)
+        # Not job.check(): pausing for higher-priority work here would keep the
+        # import's write lock while e.g. a replay ingest waits on it.
+        if job.cancelled:
+            raise jobs.JobCancelled()
+
+    source.backup(target, pages=BACKUP_PAGES_PER_STEP, progress=on_step, sleep=BACKUP_BUSY_SLEEP)
+
+def _export(target_path, progress, job):
+    partial_path = target_path + '.part'
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+
+    source = database.get_db_connection()
+    target = sqlite3.connect(partial_path)
+    try:
+        _copy(source, target, progress, job)
+    except BaseException:
+        target.close()
+        os.remove(partial_path)
+        raise
+    finally:
+        source.close()
+    target.close()
+    os.replace(partial_path, target_path)
+    logging.info(f"Database exported successfully to {target_path}")
+
+def _import(source_path, progress, job):
+    validate_database(source_path)
+    if os.path.exists(database.DATABASE_FILE) and os.path.samefile(source_path, database.DATABASE_FILE):
+        raise ValueError("The selected file is the database that is already in use.")
+
+    progress.update(message='Stopping background tasks before importing...')
+    jobs.scheduler.cancel_all(exclude_id=job.id)
+
+    progress.update(message='Importing database...')
+    source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+    target = database.get_db_connection()
+    try:
+        _copy(source, target, progress, job)
+    finally:
+        source.close()
+        target.close()
+
+    # The imported file may come from an older version of the app.
+    database.init_db()
+    rate_curves.invalidate_index()
+    request_mod_cache_warm()
+    maintenance.request_maintenance()
+    logging.info(f"Database imported from {source_path}.")
+
+def database_backup_task(operation, path, job=None):
+    """The background task for exporting the database to path ('export') or replacing it with path ('import')."""
+    job = job or jobs.detached()
+    progress = TASK_PROGRESS['backup']
+    progress.start('Exporting database...' if operation == 'export' else 'Importing database...', operation=operation)
+    progress.begin_stage('copy', 0)
+
+    try:
+        if operation == 'export':
+            _export(path, progress, job)
+            progress.finish(f"Database exported to {os.path.basename(path)}.")
+        else:
+            _import(path, progress, job)
+            progress.finish('Database imported. Your data has been replaced.')
+    except jobs.JobCancelled:
+        progress.finish(f'{operation.capitalize()} cancelled. Nothing was changed.', status='cancelled')
+        raise
+    except Exception as e:
+        logging.error(f"Database {operation} failed: {e}", exc_info=True)
+        progress.fail(e, f'{operation.capitalize()} failed: {e}')
+
+jobs.scheduler.register('backup', database_backup_task, priority=jobs.PRIORITY_USER)
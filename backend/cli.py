@@ -0,0 +1,376 @@
+"""
+Command line runs of the library tasks, for large libraries and cron jobs:
+
+    python -m backend.cli --osu-folder /srv/osu sync --jobs 16 --batch-size 2000
+    python -m backend.cli scan
+    python -m backend.cli recompute --profile
+    python -m backend.cli analyze --output focus_lists
+
+sync, scan and recompute run the same tasks as the app through the job
+scheduler, followed by the background work they queue (pp backfill, mod
+cache warming, ...); with --no-follow-ups that work is not queued at all. analyze writes the
+skill focus lists (see focus.py).
+
+The analysis of a sync can also be split into shards by md5 range (see
+shards.py): `shard --index I --count N` analyzes one shard into a result
+file, on this or another machine, and `merge FILE...` loads result files
+into the database. `sync --shards N` does both locally, with one worker
+process per shard.
+
+Progress is written to stdout as one JSON object per line ({"event":
+"progress", "task", "status", "stage", "current", "total", ...}), ending
+with an {"event": "result", ...} line; --progress text prints it for
+people instead. Logs go to stderr.
+
+Exit codes:
+    0    completed
+    1    the task failed
+    2    bad arguments or configuration (e.g. no osu! folder)
+    3    completed, but some items could not be processed
+    130  interrupted by SIGINT or SIGTERM; an interrupted sync continues
+         from its checkpoint on the next run
+"""
+import os
+import sys
+
+# backend/ uses flat imports, also when started as `python -m backend.cli`.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import json
+import time
+import signal
+import logging
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+import config  # Loads .env, which provides OSU_FOLDER unless --osu-folder is given.
+import database
+import jobs
+import profiling
+import shards
+from tasks import TASK_PROGRESS
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_PARTIAL = 3
+EXIT_INTERRUPTED = 130
+
+# Commands that run a scheduler job, with the task options each accepts.
+JOB_COMMANDS = {
+    'sync': ('workers', 'batch_size'),
+    'scan': ('batch_size',),
+    'recompute': ('workers', 'batch_size'),
+    'shard': ('workers',),
+    'merge': ('batch_size',),
+}
+PROGRESS_INTERVAL = 1.0
+SHUTDOWN_TIMEOUT = 30.0
+
+def parse_args(argv=None):
+    arg_parser = argparse.ArgumentParser(prog='python -m backend.cli', description=__doc__,
+                                         formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--db', default=os.getenv('OSU_TRACKER_DB', database.DATABASE_FILE),
+                            help='database file (default: osu_tracker.db in the working directory)')
+    arg_parser.add_argument('--osu-folder', default=os.getenv('OSU_FOLDER'), help='osu! folder (default: OSU_FOLDER)')
+    arg_parser.add_argument('--progress', choices=('json', 'text', 'none'), default='json',
+                            help='progress output on stdout (default json)')
+    arg_parser.add_argument('--progress-interval', type=float, default=PROGRESS_INTERVAL,
+                            help='seconds between progress lines (default %(default)s)')
+    arg_parser.add_argument('--log-level', default='WARNING', help='log level of stderr output (default WARNING)')
+
+    # Options shared by the commands, accepted after the command name.
+    run_options = argparse.ArgumentParser(add_help=False)
+    run_options.add_argument('--profile', nargs='?', const='sampling', choices=('sampling', 'deterministic'),
+                             help='profile the run into the profiles folder (default mode: sampling)')
+    task_options = argparse.ArgumentParser(add_help=False)
+    task_options.add_argument('--jobs', type=int, dest='workers', help='analysis threads (default: CPU count + 4, at most 32)')
+    task_options.add_argument('--batch-size', type=int, help='rows saved per database write')
+    task_options.add_argument('--no-follow-ups', action='store_true',
+                              help='do not queue the background work that builds on the result')
+
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+    sync = commands.add_parser('sync', parents=[run_options, task_options], help='sync beatmaps from osu!.db and Songs')
+    sync.add_argument('--incremental', action='store_true', help='only add beatmaps that are not stored yet')
+    sync.add_argument('--shards', type=int, help='analyze in this many worker processes (each with --jobs threads)')
+    commands.add_parser('scan', parents=[run_options, task_options],
+                        help='store new replays (replays are read one by one, so --jobs has no effect)')
+    commands.add_parser('recompute', parents=[run_options, task_options],
+                        help='recalculate values from older rosu-pp versions')
+    analyze = commands.add_parser('analyze', parents=[run_options], help='write skill focus lists of analyzed beatmaps')
+    analyze.add_argument('--output', help='output folder (default: focus_lists next to the database)')
+    shard = commands.add_parser('shard', parents=[run_options],
+                                help='analyze one md5 range of the library into a result file (no database needed)')
+    shard.add_argument('--index', type=int, required=True, help='shard to analyze, from 0 to --count - 1')
+    shard.add_argument('--count', type=int, required=True, help='number of shards')
+    shard.add_argument('--output', help='result file (default: shard-III-of-NNN.jsonl.gz in the working directory)')
+    shard.add_argument('--jobs', type=int, dest='workers', help='analysis threads (default: CPU count + 4, at most 32)')
+    shard.add_argument('--only-new', action='store_true', help='skip beatmaps the database (--db) already analyzed')
+    merge = commands.add_parser('merge', parents=[run_options, task_options], help='load shard result files into the database')
+    merge.add_argument('files', nargs='+', help='result files written by the shard command')
+
+    args = arg_parser.parse_args(argv)
+    for option, flag in (('workers', '--jobs'), ('batch_size', '--batch-size')):
+        if getattr(args, option, None) is not None and getattr(args, option) < 1:
+            arg_parser.error(f"{flag} must be at least 1")
+    if args.command in ('sync', 'scan', 'recompute', 'shard') and not args.osu_folder:
+        arg_parser.error("the osu! folder is not set (use --osu-folder or OSU_FOLDER)")
+    needs_database = args.command == 'analyze' or (args.command == 'shard' and args.only_new)
+    if needs_database and not os.path.exists(args.db):
+        arg_parser.error(f"database {args.db} not found (run a sync first)")
+    if args.command == 'shard':
+        try:
+            shards.shard_range(args.index, args.count)
+        except ValueError as e:
+            arg_parser.error(str(e))
+    if getattr(args, 'shards', None) is not None and args.shards < 1:
+        arg_parser.error("--shards must be at least 1")
+    if args.command == 'merge':
+        missing = [path for path in args.files if not os.path.isfile(path)]
+        if missing:
+            arg_parser.error(f"result file not found: {', '.join(missing)}")
+    return args
+
+class ProgressPrinter:
+    """Writes the progress of tasks that changed since the last call, as JSON lines or text."""
+    def __init__(self, mode):
+        self.mode = mode
+        self._last = {}  # task name -> fields of the last line printed
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        with self._lock:
+            self._write(record)
+
+    def _write(self, record):
+        if self.mode == 'json':
+            print(json.dumps(record), flush=True)
+        elif self.mode == 'text':
+            if record['event'] == 'result':
+                print(f"{record['command']}: {record['status']} in {record['seconds']:.1f} s, "
+                      f"{record['errors']} error(s). {record['message']}", flush=True)
+            else:
+                percent = f" ({record['current'] / record['total']:.0%})" if record['total'] else ''
+                eta = f", ETA {record['eta']:.0f} s" if record['eta'] else ''
+                task = f"{record['task']} {record['shard']}" if 'shard' in record else record['task']
+                print(f"[{task}] {record['stage'] or record['status']} "
+                      f"{record['current']}/{record['total']}{percent}{eta} - {record['message']}", flush=True)
+
+    def print_changes(self, snapshot):
+        for task, progress in snapshot.items():
+            if progress['status'] == 'idle':
+                continue
+            fields = {key: progress[key] for key in
+                      ('status', 'stage', 'current', 'total', 'errors', 'message', 'eta', 'throughput', 'elapsed')}
+            last = self._last.get(task)
+            if last and all(last[key] == fields[key] for key in ('status', 'stage', 'current', 'message')):
+                continue
+            self._last[task] = fields
+            self.write({"event": "progress", "task": task, **fields})
+
+    def print_result(self, record):
+        self.write({"event": "result", **record})
+
+def _exit_code(status, errors):
+    if status == 'complete':
+        return EXIT_PARTIAL if errors else EXIT_OK
+    if status in ('cancelled', 'interrupted'):
+        return EXIT_INTERRUPTED
+    return EXIT_FAILED
+
+def _job_arguments(args):
+    """Returns the positional and keyword arguments of the job a command submits."""
+    options = {name: getattr(args, name) for name in JOB_COMMANDS[args.command] if getattr(args, name) is not None}
+    if args.command == 'sync' and args.incremental:
+        options['incremental'] = True
+    if args.command in ('sync', 'recompute'):
+        options['follow_ups'] = not args.no_follow_ups
+    if args.command == 'shard':
+        output_path = os.path.abspath(args.output or shards.shard_file_name(args.index, args.count))
+        return (args.index, args.count, output_path), {**options, 'only_new': args.only_new}
+    if args.command == 'merge':
+        return ([os.path.abspath(path) for path in args.files],), {**options, 'follow_ups': not args.no_follow_ups}
+    return (), options
+
+def run_job_command(args, printer, command=None, job_args=None, options=None):
+    """
+    Runs a task through the scheduler and prints its progress. Returns the
+    result record. command, job_args and options default to those of the
+    command line.
+    """
+    if command is None:
+        command = args.command
+        job_args, options = _job_arguments(args)
+    if args.profile:
+        profiling.update_settings(mode=args.profile)
+        profiling.profile_next(command)
+
+    started = time.monotonic()
+    job = jobs.scheduler.submit(command, *job_args, **options)
+    interrupted = False
+    try:
+        while not job.wait(args.progress_interval):
+            printer.print_changes(TASK_PROGRESS.snapshot())
+        # The background work the task queued, e.g. the pp backfill after a sync.
+        while not getattr(args, 'no_follow_ups', False) and not jobs.scheduler.wait_idle(args.progress_interval):
+            printer.print_changes(TASK_PROGRESS.snapshot())
+    except KeyboardInterrupt:
+        interrupted = True
+        logging.warning("Interrupted, stopping the running tasks...")
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # Queued follow-ups are dropped; running ones stop at their next check and keep their checkpoint.
+    jobs.scheduler.shutdown(timeout=SHUTDOWN_TIMEOUT)
+    snapshot = TASK_PROGRESS.snapshot()
+    printer.print_changes(snapshot)
+
+    progress = snapshot[command]
+    status = 'error' if job.status == 'error' else progress['status']
+    if interrupted and status in ('running', 'cancelled'):
+        status = 'interrupted'
+    follow_ups = {task: state['status'] for task, state in snapshot.items()
+                  if task != command and state['status'] != 'idle'}
+    return {"command": command, "status": status, "seconds": round(time.monotonic() - started, 1),
+            "items": progress['current'], "errors": progress['errors'],
+            "message": progress['message'] or job.error or '', "follow_ups": follow_ups}
+
+def run_sharded_sync(args, printer):
+    """
+    Runs the analysis of a sync in args.shards worker processes (the shard
+    command, skipping beatmaps that are already analyzed) and merges their
+    result files. Progress lines of the workers are passed on with a "shard"
+    field. Returns the result record.
+    """
+    started = time.monotonic()
+    shard_dir = tempfile.mkdtemp(prefix='shards-', dir=os.path.dirname(os.path.abspath(args.db)))
+    base_command = [sys.executable, os.path.abspath(__file__), '--db', os.path.abspath(args.db),
+                    '--osu-folder', args.osu_folder, '--progress', 'json',
+                    '--progress-interval', str(args.progress_interval), '--log-level', args.log_level]
+    workers = []
+    for index in range(args.shards):
+        command = base_command + ['shard', '--index', str(index), '--count', str(args.shards), '--only-new',
+                                  '--output', os.path.join(shard_dir, shards.shard_file_name(index, args.shards))]
+        if args.workers:
+            command += ['--jobs', str(args.workers)]
+        if args.profile:
+            command += ['--profile', args.profile]
+        workers.append(subprocess.Popen(command, stdout=subprocess.PIPE, text=True))
+
+    results = {}
+
+    def forward(index, process):
+        for line in process.stdout:
+            record = json.loads(line)
+            if record['event'] == 'result':
+                results[index] = record
+            else:
+                printer.write({**record, "shard": index})
+
+    readers = [threading.Thread(target=forward, args=(index, process), daemon=True)
+               for index, process in enumerate(workers)]
+    for reader in readers:
+        reader.start()
+    try:
+        for process in workers:
+            process.wait()
+    except KeyboardInterrupt:
+        # A SIGTERM sent to this process only does not reach the workers.
+        for process in workers:
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+        for process in workers:
+            process.wait()
+        shutil.rmtree(shard_dir, ignore_errors=True)
+        raise
+    for reader in readers:
+        reader.join()
+
+    failed = [index for index, process in enumerate(workers) if process.returncode not in (EXIT_OK, EXIT_PARTIAL)]
+    paths = [os.path.join(shard_dir, shards.shard_file_name(index, args.shards))
+             for index in range(args.shards) if index not in failed]
+    record = {"command": "sync", "status": "complete", "items": 0, "errors": 0, "message": "", "follow_ups": {}}
+    if paths:
+        record = run_job_command(args, printer, 'merge', (paths,),
+                                 {'batch_size': args.batch_size, 'follow_ups': not args.no_follow_ups})
+        record["command"] = "sync"
+    record["shards"] = {index: results.get(index, {}).get('status', 'error') for index in range(args.shards)}
+    record["seconds"] = round(time.monotonic() - started, 1)
+    if failed:
+        record["status"] = 'error'
+        record["message"] = (f"Shards {', '.join(map(str, failed))} failed; run the sync again to retry them. "
+                             f"{record['message']}").strip()
+    else:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+    return record
+
+def run_analyze_command(args, printer):
+    """Writes the focus lists. Returns the result record."""
+    import focus
+
+    if args.profile:
+        profiling.update_settings(mode=args.profile)
+        profiling.profile_next('analyze')
+    started = time.monotonic()
+    output_dir = os.path.abspath(args.output or focus.get_default_output_dir())
+    with profiling.profile_job('analyze'):
+        beatmaps = focus.get_tagged_beatmaps()
+        counts = focus.write_focus_lists(beatmaps, output_dir)
+    record = {"command": "analyze", "status": "complete", "seconds": round(time.monotonic() - started, 1),
+              "items": len(beatmaps), "errors": 0, "output_dir": output_dir, "focus": counts}
+    if not beatmaps:
+        record["message"] = "No analyzed beatmaps found; run a sync first."
+    else:
+        record["message"] = f"Exported {len(beatmaps)} beatmaps into skill focus lists in {output_dir}."
+    if printer.mode == 'text':
+        for beatmap in beatmaps[:100]:
+            print(f"[{beatmap['focus']:<10}] {beatmap['stars']:.2f}* | "
+                  f"{beatmap['artist']} - {beatmap['title']} [{beatmap['difficulty']}]")
+        if len(beatmaps) > 100:
+            print(f"... (and {len(beatmaps) - 100} more)")
+        for tag, count in counts.items():
+            print(f"{tag:<15}: {count:>5} maps ({count / max(1, len(beatmaps)):.2%})")
+    return record
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), stream=sys.stderr,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    database.DATABASE_FILE = args.db
+    if args.osu_folder:
+        os.environ['OSU_FOLDER'] = args.osu_folder
+    # SIGTERM (e.g. from a cron timeout) stops the run like Ctrl+C.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    printer = ProgressPrinter(args.progress)
+    try:
+        # Shard workers may run on a machine without the database and never
+        # write to it, not even the run history; the result file is their record.
+        if args.command == 'shard':
+            TASK_PROGRESS.on_finish = None
+        else:
+            database.init_db()
+        if args.command == 'analyze':
+            record = run_analyze_command(args, printer)
+        elif args.command == 'sync' and args.shards:
+            record = run_sharded_sync(args, printer)
+        else:
+            record = run_job_command(args, printer)
+    except KeyboardInterrupt:
+        record = {"command": args.command, "status": "interrupted", "seconds": 0.0, "items": 0, "errors": 0,
+                  "message": "Interrupted."}
+    except Exception as e:
+        logging.error(f"{args.command} failed: {e}", exc_info=True)
+        record = {"command": args.command, "status": "error", "seconds": 0.0, "items": 0, "errors": 1,
+                  "message": str(e)}
+
+    if args.profile:
+        profiles = profiling.list_profiles()
+        if profiles:
+            record["profile"] = os.path.join(profiling.get_profile_dir(), profiles[0]['name'])
+    record["exit_code"] = _exit_code(record['status'], record['errors'])
+    printer.print_result(record)
+    return record["exit_code"]
+
+if __name__ == '__main__':
+    sys.exit(main())
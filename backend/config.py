@@ -13,27 +13,31 @@ if IS_BUNDLED:
 else:
     BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 
-# Configure logging, use INFO for bundled app, DEBUG for dev
-logging.basicConfig(
-    level=logging.INFO if IS_BUNDLED else logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
-
 # Find the .env file using BASE_DIR
 env_path = os.path.join(BASE_DIR, '.env')
 
-# Create a dummy .env if it doesn't exist, then load it.
-if not os.path.exists(env_path):
-    logging.info(f"No .env file found. Creating one at: {env_path}")
-    with open(env_path, 'w') as f:
-        f.write("# .env file created by osu! Tracker\n")
-        f.write("OSU_FOLDER=\n")
-        f.write("DEFAULT_PLAYER=\n")
-
+# Loading only reads the file; it is created by ensure_env_file at startup.
 load_dotenv(dotenv_path=env_path)
 
 # Set up the path to the static frontend folder.
 if IS_BUNDLED:
     static_folder_path = os.path.join(sys._MEIPASS, 'frontend')
 else:
-    static_folder_path = os.path.join(BASE_DIR, 'frontend')
\ No newline at end of file
+    static_folder_path = os.path.join(BASE_DIR, 'frontend')
+
+def configure_logging():
+    """Configures logging, use INFO for bundled app, DEBUG for dev."""
+    logging.basicConfig(
+        level=logging.INFO if IS_BUNDLED else logging.DEBUG,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+def ensure_env_file():
+    """Creates a .env file with empty settings if there is none yet."""
+    if os.path.exists(env_path):
+        return
+    logging.info(f"No .env file found. Creating one at: {env_path}")
+    with open(env_path, 'w') as f:
+        f.write("# .env file created by osu! Tracker\n")
+        f.write("OSU_FOLDER=\n")
+        f.write("DEFAULT_PLAYER=\n")
@@ -3,8 +3,9 @@ import logging
 import json
 import os
 from dotenv import load_dotenv
-import rosu_pp_py
 from utils import get_safe_join
+import mod_utils
+import parser
 
 DATABASE_FILE = 'osu_tracker.db'
 
@@ -14,77 +15,24 @@ def get_db_connection():
     conn.row_factory = sqlite3.Row  # This allows accessing columns by name
     return conn
 
-def init_db():
-    """Initializes the database, creates tables, and applies schema migrations."""
-    
-    def _migrate_db(conn):
-        """Applies necessary schema migrations to an existing database."""
-        cursor = conn.cursor()
-        
-        # --- Migration for replays table ---
-        cursor.execute("PRAGMA table_info(replays)")
-        replay_columns = [row['name'] for row in cursor.fetchall()]
-        if 'speed_note_count' not in replay_columns:
-            logging.info("Applying migration: Adding 'speed_note_count' to 'replays' table.")
-            cursor.execute("ALTER TABLE replays ADD COLUMN speed_note_count REAL")
-        if 'aim_difficult_strain_count' not in replay_columns:
-            logging.info("Applying migration: Adding 'aim_difficult_strain_count' to 'replays' table.")
-            cursor.execute("ALTER TABLE replays ADD COLUMN aim_difficult_strain_count REAL")
-        if 'speed_difficult_strain_count' not in replay_columns:
-            logging.info("Applying migration: Adding 'speed_difficult_strain_count' to 'replays' table.")
-            cursor.execute("ALTER TABLE replays ADD COLUMN speed_difficult_strain_count REAL")
-        if 'aim_difficult_slider_count' not in replay_columns:
-            logging.info("Applying migration: Adding 'aim_difficult_slider_count' to 'replays' table.")
-            cursor.execute("ALTER TABLE replays ADD COLUMN aim_difficult_slider_count REAL")
-
-
-        # --- Migration for beatmaps table ---
-        cursor.execute("PRAGMA table_info(beatmaps)")
-        beatmap_columns = [row['name'] for row in cursor.fetchall()]
-        if 'speed_note_count' not in beatmap_columns:
-            logging.info("Applying migration: Adding 'speed_note_count' to 'beatmaps' table.")
-            cursor.execute("ALTER TABLE beatmaps ADD COLUMN speed_note_count REAL")
-        if 'aim_difficult_strain_count' not in beatmap_columns:
-            logging.info("Applying migration: Adding 'aim_difficult_strain_count' to 'beatmaps' table.")
-            cursor.execute("ALTER TABLE beatmaps ADD COLUMN aim_difficult_strain_count REAL")
-        if 'speed_difficult_strain_count' not in beatmap_columns:
-            logging.info("Applying migration: Adding 'speed_difficult_strain_count' to 'beatmaps' table.")
-            cursor.execute("ALTER TABLE beatmaps ADD COLUMN speed_difficult_strain_count REAL")
-        if 'aim_difficult_slider_count' not in beatmap_columns:
-            logging.info("Applying migration: Adding 'aim_difficult_slider_count' to 'beatmaps' table.")
-            cursor.execute("ALTER TABLE beatmaps ADD COLUMN aim_difficult_slider_count REAL")
-        if 'aim' not in beatmap_columns:
-            logging.info("Applying migration: Adding 'aim' to 'beatmaps' table.")
-            cursor.execute("ALTER TABLE beatmaps ADD COLUMN aim REAL")
-        if 'speed' not in beatmap_columns:
-            logging.info("Applying migration: Adding 'speed' to 'beatmaps' table.")
-            cursor.execute("ALTER TABLE beatmaps ADD COLUMN speed REAL")
-        if 'slider_factor' not in beatmap_columns:
-            logging.info("Applying migration: Adding 'slider_factor' to 'beatmaps' table.")
-            cursor.execute("ALTER TABLE beatmaps ADD COLUMN slider_factor REAL")
-
-
-        # --- Migration for beatmap_mod_cache table ---
-        cursor.execute("PRAGMA table_info(beatmap_mod_cache)")
-        cache_columns = [row['name'] for row in cursor.fetchall()]
-        if 'speed_note_count' not in cache_columns:
-            logging.info("Applying migration: Adding 'speed_note_count' to 'beatmap_mod_cache' table.")
-            cursor.execute("ALTER TABLE beatmap_mod_cache ADD COLUMN speed_note_count REAL")
-        if 'aim_difficult_strain_count' not in cache_columns:
-            logging.info("Applying migration: Adding 'aim_difficult_strain_count' to 'beatmap_mod_cache' table.")
-            cursor.execute("ALTER TABLE beatmap_mod_cache ADD COLUMN aim_difficult_strain_count REAL")
-        if 'speed_difficult_strain_count' not in cache_columns:
-            logging.info("Applying migration: Adding 'speed_difficult_strain_count' to 'beatmap_mod_cache' table.")
-            cursor.execute("ALTER TABLE beatmap_mod_cache ADD COLUMN speed_difficult_strain_count REAL")
-        if 'aim_difficult_slider_count' not in cache_columns:
-            logging.info("Applying migration: Adding 'aim_difficult_slider_count' to 'beatmap_mod_cache' table.")
-            cursor.execute("ALTER TABLE beatmap_mod_cache ADD COLUMN aim_difficult_slider_count REAL")
-
-        conn.commit()
+def _table_columns(cursor, table):
+    """Returns the set of column names for a table."""
+    cursor.execute(f"PRAGMA table_info({table})")
+    return {row['name'] for row in cursor.fetchall()}
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
+def _add_missing_columns(cursor, table, columns):
+    """Adds each (name, type) column that is not yet present on the table."""
+    existing = _table_columns(cursor, table)
+    for name, col_type in columns:
+        if name not in existing:
+            logging.info(f"Applying migration: Adding '{name}' to '{table}' table.")
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {col_type}")
+
+def _migration_001_base_schema(cursor):
+    """
+    Creates the base schema. Databases created before versioned migrations
+    existed are brought up to the same layout by adding any missing columns.
+    """
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS replays (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -176,10 +124,203 @@ def init_db():
         )
     ''')
 
-    conn.commit()
-    _migrate_db(conn)
-    conn.close()
-    print("Database initialized and migrated successfully.")
+    skill_columns = [
+        ('speed_note_count', 'REAL'),
+        ('aim_difficult_strain_count', 'REAL'),
+        ('speed_difficult_strain_count', 'REAL'),
+        ('aim_difficult_slider_count', 'REAL'),
+    ]
+    _add_missing_columns(cursor, 'replays', skill_columns)
+    _add_missing_columns(cursor, 'beatmaps', skill_columns + [
+        ('aim', 'REAL'), ('speed', 'REAL'), ('slider_factor', 'REAL'),
+    ])
+    _add_missing_columns(cursor, 'beatmap_mod_cache', skill_columns)
+
+def _migration_002_mod_cache_skill_only(cursor):
+    """
+    Drops the ar/od/cs/hp/bpm columns from beatmap_mod_cache. Those values are
+    now derived analytically from the base beatmap, so the cache only keeps
+    star and skill attributes.
+    """
+    cursor.execute('''
+        CREATE TABLE beatmap_mod_cache_new (
+            md5_hash TEXT NOT NULL,
+            mods INTEGER NOT NULL,
+            stars REAL,
+            aim REAL,
+            speed REAL,
+            slider_factor REAL,
+            speed_note_count REAL,
+            aim_difficult_strain_count REAL,
+            speed_difficult_strain_count REAL,
+            aim_difficult_slider_count REAL,
+            PRIMARY KEY (md5_hash, mods)
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO beatmap_mod_cache_new
+        SELECT md5_hash, mods, stars, aim, speed, slider_factor, speed_note_count,
+               aim_difficult_strain_count, speed_difficult_strain_count, aim_difficult_slider_count
+        FROM beatmap_mod_cache
+    ''')
+    cursor.execute("DROP TABLE beatmap_mod_cache")
+    cursor.execute("ALTER TABLE beatmap_mod_cache_new RENAME TO beatmap_mod_cache")
+
+def _migration_003_rate_curves(cursor):
+    """Adds the table holding per-map star/aim/speed curves over playback rates."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS beatmap_rate_curves (
+            md5_hash TEXT PRIMARY KEY,
+            stars BLOB NOT NULL,
+            aim BLOB NOT NULL,
+            speed BLOB NOT NULL
+        )
+    ''')
+
+def _migration_004_calc_version(cursor):
+    """Adds a calc_version column to every table holding rosu-pp results."""
+    for table in ('replays', 'beatmaps', 'beatmap_mod_cache', 'beatmap_rate_curves'):
+        _add_missing_columns(cursor, table, [('calc_version', 'TEXT')])
+
+def _migration_005_job_checkpoints(cursor):
+    """Adds the table where long-running jobs persist their resume state."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS job_checkpoints (
+            job_type TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+
+def _migration_006_osu_file_index(cursor):
+    """Adds the md5 index of .osu files under Songs (see osu_file_index)."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS osu_folder_index (
+            folder_name TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS osu_file_index (
+            folder_name TEXT NOT NULL,
+            osu_file_name TEXT NOT NULL,
+            md5_hash TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            PRIMARY KEY (folder_name, osu_file_name)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_osu_file_index_md5 ON osu_file_index (md5_hash)")
+
+# Secondary indexes for the hot read paths, as (name, table, columns). Each
+# one lets the query it serves seek and read rows in order instead of
+# scanning and sorting the whole table:
+HOT_PATH_INDEXES = [
+    # get_all_replays(player_name) and get_player_stats play count; also DISTINCT player_name.
+    ("idx_replays_player_played_at", "replays", "player_name, played_at"),
+    # get_all_replays() without a player, newest first.
+    ("idx_replays_played_at", "replays", "played_at"),
+    # get_player_stats pp ranking, read from the index alone.
+    ("idx_replays_player_pp", "replays", "player_name, pp"),
+    # get_replay_mod_frequencies, grouped within the index.
+    ("idx_replays_mode_mods", "replays", "game_mode, mods_used"),
+    # get_stale_replays / get_replays_missing_pp, ordered by (beatmap_md5, mods_used).
+    ("idx_replays_beatmap_mods", "replays", "beatmap_md5, mods_used"),
+    # Modded recommendations (range on stars) and the mod cache coverage counts.
+    ("idx_mod_cache_mods_stars", "beatmap_mod_cache", "mods, stars"),
+    # NoMod recommendations; bpm is checked in the index before reading the row.
+    ("idx_beatmaps_mode_stars_bpm", "beatmaps", "game_mode, stars, bpm"),
+    # get_all_beatmaps, ordered by artist and title.
+    ("idx_beatmaps_artist_title", "beatmaps", "artist, title"),
+]
+
+def _migration_007_hot_path_indexes(cursor):
+    """Adds the secondary indexes in HOT_PATH_INDEXES."""
+    for name, table, columns in HOT_PATH_INDEXES:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+def _migration_008_task_runs(cursor):
+    """Adds the history of background task runs with their per-stage timings."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task TEXT NOT NULL,
+            status TEXT NOT NULL,
+            finished_at TEXT NOT NULL,
+            seconds REAL,
+            items INTEGER,
+            errors INTEGER,
+            calc_version TEXT,
+            library_beatmaps INTEGER,
+            details TEXT
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_task_runs_task ON task_runs (task, id)")
+
+def _migration_009_preview_time(cursor):
+    """Adds the audio preview point (ms) that osu!.db and .osu files provide."""
+    _add_missing_columns(cursor, 'beatmaps', [('preview_time', 'INTEGER')])
+
+# Ordered list of (version, description, function). Each function receives a
+# cursor inside the migration transaction. Append new steps with the next
+# version number; never edit or reorder steps that have already shipped.
+MIGRATIONS = [
+    (1, "Create base schema", _migration_001_base_schema),
+    (2, "Store only star and skill attributes in beatmap_mod_cache", _migration_002_mod_cache_skill_only),
+    (3, "Add beatmap_rate_curves table", _migration_003_rate_curves),
+    (4, "Track the rosu-pp version of calculated values", _migration_004_calc_version),
+    (5, "Add job_checkpoints table", _migration_005_job_checkpoints),
+    (6, "Add .osu file index", _migration_006_osu_file_index),
+    (7, "Add indexes for hot query paths", _migration_007_hot_path_indexes),
+    (8, "Add task_runs history table", _migration_008_task_runs),
+    (9, "Store the audio preview time of beatmaps", _migration_009_preview_time),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn):
+    """Reads the schema version stored in the database header."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def init_db(progress_callback=None):
+    """
+    Initializes the database by applying any pending schema migrations.
+    The current version is tracked with PRAGMA user_version, so an up-to-date
+    database costs a single pragma read. Pending steps run inside one
+    transaction; progress_callback(step, total, description) is called
+    before each step.
+    """
+    conn = get_db_connection()
+    try:
+        current_version = get_schema_version(conn)
+        if current_version >= SCHEMA_VERSION:
+            return
+
+        pending = [m for m in MIGRATIONS if m[0] > current_version]
+        logging.info(f"Migrating database from schema version {current_version} to {SCHEMA_VERSION} "
+                     f"({len(pending)} step(s)).")
+
+        # Manage the transaction explicitly so DDL and the version bump commit atomically.
+        conn.isolation_level = None
+        cursor = conn.cursor()
+        if current_version == 0 and cursor.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0:
+            # Only takes effect before the first table exists; older files are converted by maintenance.
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            for step, (version, description, migrate) in enumerate(pending, start=1):
+                logging.info(f"Applying migration {version}: {description}")
+                if progress_callback:
+                    progress_callback(step, len(pending), description)
+                migrate(cursor)
+                cursor.execute(f"PRAGMA user_version = {int(version)}")
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    logging.info("Database initialized and migrated successfully.")
 
 def add_replay(replay_data):
     """Adds a new replay or updates it if calculated data was missing."""
@@ -214,7 +355,8 @@ def add_replay(replay_data):
         'bpm': replay_data.get('bpm'),
         'bpm_min': replay_data.get('bpm_min'),
         'bpm_max': replay_data.get('bpm_max'),
-        'played_at': replay_data.get('played_at')
+        'played_at': replay_data.get('played_at'),
+        'calc_version': parser.CALC_VERSION if replay_data.get('pp') is not None else None
     }
 
     cursor.execute('''
@@ -223,13 +365,13 @@ def add_replay(replay_data):
             num_300s, num_100s, num_50s, num_gekis, num_katus, num_misses,
             total_score, max_combo, mods_used, pp, stars, aim, speed, slider_factor, 
             speed_note_count, aim_difficult_strain_count, speed_difficult_strain_count, aim_difficult_slider_count,
-            map_max_combo, bpm, bpm_min, bpm_max, played_at
+            map_max_combo, bpm, bpm_min, bpm_max, played_at, calc_version
         ) VALUES (
             :game_mode, :game_version, :beatmap_md5, :player_name, :replay_md5,
             :num_300s, :num_100s, :num_50s, :num_gekis, :num_katus, :num_misses,
             :total_score, :max_combo, :mods_used, :pp, :stars, :aim, :speed, :slider_factor,
             :speed_note_count, :aim_difficult_strain_count, :speed_difficult_strain_count, :aim_difficult_slider_count,
-            :map_max_combo, :bpm, :bpm_min, :bpm_max, :played_at
+            :map_max_combo, :bpm, :bpm_min, :bpm_max, :played_at, :calc_version
         )
         ON CONFLICT(replay_md5) DO UPDATE SET
             pp = excluded.pp,
@@ -244,7 +386,8 @@ def add_replay(replay_data):
             map_max_combo = excluded.map_max_combo,
             bpm = excluded.bpm,
             bpm_min = excluded.bpm_min,
-            bpm_max = excluded.bpm_max
+            bpm_max = excluded.bpm_max,
+            calc_version = excluded.calc_version
         WHERE replays.pp IS NULL AND excluded.pp IS NOT NULL
     ''', params)
     
@@ -252,9 +395,9 @@ def add_replay(replay_data):
     conn.close()
 
 def add_replays_batch(replays_data):
-    """Adds a batch of new replays or updates them if calculated data was missing."""
+    """Adds a batch of new replays, skipping ones already stored. Returns the md5s of the replays inserted."""
     if not replays_data:
-        return
+        return []
 
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -290,22 +433,57 @@ def add_replays_batch(replays_data):
             replay_data.get('bpm_min'),
             replay_data.get('bpm_max'),
             replay_data.get('played_at'),
+            parser.CALC_VERSION if replay_data.get('pp') is not None else None,
         ))
     
-    # 28 columns and 28 '?' placeholders
-    cursor.executemany('''
+    # 29 columns and 29 '?' placeholders
+    insert_sql = '''
         INSERT INTO replays (
             game_mode, game_version, beatmap_md5, player_name, replay_md5,
             num_300s, num_100s, num_50s, num_gekis, num_katus, num_misses,
             total_score, max_combo, mods_used, pp, stars, aim, speed, slider_factor, 
             speed_note_count, aim_difficult_strain_count, speed_difficult_strain_count, aim_difficult_slider_count,
-            map_max_combo, bpm, bpm_min, bpm_max, played_at
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            map_max_combo, bpm, bpm_min, bpm_max, played_at, calc_version
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ON CONFLICT(replay_md5) DO NOTHING
-    ''', replay_tuples)
-    
+    '''
+    # One statement per row (still one transaction) to learn which rows were new.
+    inserted = []
+    for replay_tuple in replay_tuples:
+        cursor.execute(insert_sql, replay_tuple)
+        if cursor.rowcount == 1:
+            inserted.append(replay_tuple[4])
+
     conn.commit()
     conn.close()
+    return inserted
+
+_REPLAY_SELECT = """
+        SELECT
+            r.*, b.artist, b.title, b.creator, b.difficulty, b.folder_name,
+            b.osu_file_name, b.grades, b.last_played_date, b.num_hitcircles,
+            b.num_sliders, b.num_spinners, b.ar, b.cs, b.hp, b.od,
+            b.audio_file, b.background_file, b.preview_time,
+            COALESCE(r.bpm, b.bpm) as bpm,
+            COALESCE(r.bpm_min, b.bpm_min) as bpm_min,
+            COALESCE(r.bpm_max, b.bpm_max) as bpm_max
+    """
+_REPLAY_FROM = " FROM replays r LEFT JOIN beatmaps b ON r.beatmap_md5 = b.md5_hash "
+
+def _attach_beatmap(replay):
+    """Nests the joined beatmap columns of a replay row under a 'beatmap' key."""
+    replay['beatmap'] = {
+        'artist': replay.get('artist'), 'title': replay.get('title'), 'creator': replay.get('creator'),
+        'difficulty': replay.get('difficulty'), 'folder_name': replay.get('folder_name'),
+        'osu_file_name': replay.get('osu_file_name'), 'grades': replay.get('grades'),
+        'last_played_date': replay.get('last_played_date'), 'num_hitcircles': replay.get('num_hitcircles'),
+        'num_sliders': replay.get('num_sliders'), 'num_spinners': replay.get('num_spinners'),
+        'ar': replay.get('ar'), 'cs': replay.get('cs'), 'hp': replay.get('hp'), 'od': replay.get('od'),
+        'bpm': replay.get('bpm'), 'audio_file': replay.get('audio_file'), 
+        'background_file': replay.get('background_file'), 'preview_time': replay.get('preview_time'),
+        'bpm_min': replay.get('bpm_min'), 'bpm_max': replay.get('bpm_max')
+    }
+    return replay
 
 def get_all_replays(player_name=None, page=1, limit=50, search_term=None):
     """
@@ -315,7 +493,7 @@ def get_all_replays(player_name=None, page=1, limit=50, search_term=None):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    base_query = " FROM replays r LEFT JOIN beatmaps b ON r.beatmap_md5 = b.md5_hash "
+    base_query = _REPLAY_FROM
     where_clauses = []
     params = []
 
@@ -332,45 +510,58 @@ def get_all_replays(player_name=None, page=1, limit=50, search_term=None):
     if where_clauses:
         where_sql = " WHERE " + " AND ".join(where_clauses)
     
-    count_query = "SELECT COUNT(r.id) " + base_query + where_sql
+    # The beatmap join only matters to the count when searching its columns; without it
+    # the count is served by the replay indexes alone.
+    count_from = base_query if search_term else " FROM replays r "
+    count_query = "SELECT COUNT(r.id) " + count_from + where_sql
     cursor.execute(count_query, params)
     total = cursor.fetchone()[0]
 
-    select_query = """
-        SELECT
-            r.*, b.artist, b.title, b.creator, b.difficulty, b.folder_name,
-            b.osu_file_name, b.grades, b.last_played_date, b.num_hitcircles,
-            b.num_sliders, b.num_spinners, b.ar, b.cs, b.hp, b.od,
-            b.audio_file, b.background_file,
-            COALESCE(r.bpm, b.bpm) as bpm,
-            COALESCE(r.bpm_min, b.bpm_min) as bpm_min,
-            COALESCE(r.bpm_max, b.bpm_max) as bpm_max
-    """ + base_query + where_sql + " ORDER BY r.played_at DESC LIMIT ? OFFSET ?"
+    select_query = _REPLAY_SELECT + base_query + where_sql + " ORDER BY r.played_at DESC LIMIT ? OFFSET ?"
     
     offset = (page - 1) * limit
     params.extend([limit, offset])
     
     cursor.execute(select_query, params)
 
-    replays = [dict(row) for row in cursor.fetchall()]
+    replays = [_attach_beatmap(dict(row)) for row in cursor.fetchall()]
     conn.close()
-    
-    # Enrich with beatmap object
-    for replay in replays:
-        replay['beatmap'] = {
-            'artist': replay.get('artist'), 'title': replay.get('title'), 'creator': replay.get('creator'),
-            'difficulty': replay.get('difficulty'), 'folder_name': replay.get('folder_name'),
-            'osu_file_name': replay.get('osu_file_name'), 'grades': replay.get('grades'),
-            'last_played_date': replay.get('last_played_date'), 'num_hitcircles': replay.get('num_hitcircles'),
-            'num_sliders': replay.get('num_sliders'), 'num_spinners': replay.get('num_spinners'),
-            'ar': replay.get('ar'), 'cs': replay.get('cs'), 'hp': replay.get('hp'), 'od': replay.get('od'),
-            'bpm': replay.get('bpm'), 'audio_file': replay.get('audio_file'), 
-            'background_file': replay.get('background_file'),
-            'bpm_min': replay.get('bpm_min'), 'bpm_max': replay.get('bpm_max')
-        }
 
     return {"replays": replays, "total": total}
 
+def get_replays_by_md5(replay_md5s):
+    """Retrieves specific replays, enriched with beatmap data like get_all_replays."""
+    if not replay_md5s:
+        return []
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    placeholders = ','.join('?' for _ in replay_md5s)
+    cursor.execute(
+        _REPLAY_SELECT + _REPLAY_FROM +
+        f"WHERE r.replay_md5 IN ({placeholders}) ORDER BY r.played_at DESC",
+        list(replay_md5s)
+    )
+    replays = [_attach_beatmap(dict(row)) for row in cursor.fetchall()]
+    conn.close()
+    return replays
+
+def get_player_stats(player_name):
+    """Calculates a player's weighted total pp, play count and top play."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM replays WHERE player_name = ?", (player_name,))
+    play_count = cursor.fetchone()[0]
+    cursor.execute("SELECT pp FROM replays WHERE player_name = ? AND pp > 0 ORDER BY pp DESC", (player_name,))
+    pp_values = [row['pp'] for row in cursor.fetchall()]
+    conn.close()
+
+    total_pp = sum(pp * (0.95 ** i) for i, pp in enumerate(pp_values))
+    return {
+        "total_pp": round(total_pp, 2),
+        "play_count": play_count,
+        "top_play_pp": round(pp_values[0], 2) if pp_values else 0
+    }
+
 def get_unique_players():
     """Retrieves a list of unique player names from the replays table."""
     conn = get_db_connection()
@@ -417,6 +608,15 @@ def get_processed_beatmap_hashes():
     conn.close()
     return hashes
 
+def get_beatmap_hashes():
+    """Retrieves a set of the MD5 hashes of every stored beatmap, analyzed or not."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT md5_hash FROM beatmaps")
+    hashes = {row['md5_hash'] for row in cursor.fetchall()}
+    conn.close()
+    return hashes
+
 def get_all_replay_md5s():
     """Retrieves a set of all replay MD5 hashes currently in the database."""
     conn = get_db_connection()
@@ -445,7 +645,9 @@ def add_or_update_beatmaps(beatmaps_data):
             data.get('bpm'), data.get('audio_file'), data.get('background_file'), 
             data.get('bpm_min'), data.get('bpm_max'),
             data.get('speed_note_count'), data.get('aim_difficult_strain_count'),
-            data.get('speed_difficult_strain_count'), data.get('aim_difficult_slider_count')
+            data.get('speed_difficult_strain_count'), data.get('aim_difficult_slider_count'),
+            parser.CALC_VERSION if data.get('stars') is not None else None,
+            data.get('preview_time')
         ))
 
     cursor.executemany('''
@@ -454,8 +656,9 @@ def add_or_update_beatmaps(beatmaps_data):
             grades, game_mode, last_played_date, num_hitcircles, num_sliders, num_spinners,
             ar, cs, hp, od, stars, aim, speed, slider_factor, bpm,
             audio_file, background_file, bpm_min, bpm_max,
-            speed_note_count, aim_difficult_strain_count, speed_difficult_strain_count, aim_difficult_slider_count
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            speed_note_count, aim_difficult_strain_count, speed_difficult_strain_count, aim_difficult_slider_count,
+            calc_version, preview_time
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ON CONFLICT(md5_hash) DO UPDATE SET
             artist=excluded.artist,
             title=excluded.title,
@@ -482,7 +685,10 @@ def add_or_update_beatmaps(beatmaps_data):
             speed_note_count=COALESCE(beatmaps.speed_note_count, excluded.speed_note_count),
             aim_difficult_strain_count=COALESCE(beatmaps.aim_difficult_strain_count, excluded.aim_difficult_strain_count),
             speed_difficult_strain_count=COALESCE(beatmaps.speed_difficult_strain_count, excluded.speed_difficult_strain_count),
-            aim_difficult_slider_count=COALESCE(beatmaps.aim_difficult_slider_count, excluded.aim_difficult_slider_count)
+            aim_difficult_slider_count=COALESCE(beatmaps.aim_difficult_slider_count, excluded.aim_difficult_slider_count),
+            -- The version belongs to the difficulty values, so it only changes when they are taken from excluded.
+            calc_version=CASE WHEN beatmaps.stars IS NULL THEN excluded.calc_version ELSE beatmaps.calc_version END,
+            preview_time=COALESCE(excluded.preview_time, beatmaps.preview_time)
     ''', beatmap_tuples)
     
     conn.commit()
@@ -496,36 +702,69 @@ def add_beatmap_mod_cache(cache_data):
     cursor = conn.cursor()
     
     params = [(
-        d['md5_hash'], d['mods'], d['stars'], d['ar'], d['od'], 
-        d['cs'], d['hp'], d['bpm'], d.get('aim'), d.get('speed'), d.get('slider_factor'),
+        d['md5_hash'], d['mods'], d['stars'], d.get('aim'), d.get('speed'), d.get('slider_factor'),
         d.get('speed_note_count'), d.get('aim_difficult_strain_count'),
-        d.get('speed_difficult_strain_count'), d.get('aim_difficult_slider_count')
+        d.get('speed_difficult_strain_count'), d.get('aim_difficult_slider_count'),
+        parser.CALC_VERSION
     ) for d in cache_data]
 
     cursor.executemany('''
-        INSERT INTO beatmap_mod_cache (md5_hash, mods, stars, ar, od, cs, hp, bpm, aim, speed, slider_factor,
-        speed_note_count, aim_difficult_strain_count, speed_difficult_strain_count, aim_difficult_slider_count)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO beatmap_mod_cache (md5_hash, mods, stars, aim, speed, slider_factor,
+        speed_note_count, aim_difficult_strain_count, speed_difficult_strain_count, aim_difficult_slider_count, calc_version)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ON CONFLICT(md5_hash, mods) DO UPDATE SET
             stars=excluded.stars,
-            ar=excluded.ar,
-            od=excluded.od,
-            cs=excluded.cs,
-            hp=excluded.hp,
-            bpm=excluded.bpm,
             aim=excluded.aim,
             speed=excluded.speed,
             slider_factor=excluded.slider_factor,
             speed_note_count=excluded.speed_note_count,
             aim_difficult_strain_count=excluded.aim_difficult_strain_count,
             speed_difficult_strain_count=excluded.speed_difficult_strain_count,
-            aim_difficult_slider_count=excluded.aim_difficult_slider_count
+            aim_difficult_slider_count=excluded.aim_difficult_slider_count,
+            calc_version=excluded.calc_version
     ''', params)
     
     conn.commit()
     logging.info(f"Saved {len(params)} entries to beatmap mod cache.")
     conn.close()
 
+def add_rate_curves(curves):
+    """Inserts or replaces a batch of packed rate curves."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.executemany('''
+        INSERT INTO beatmap_rate_curves (md5_hash, stars, aim, speed, calc_version)
+        VALUES (:md5_hash, :stars, :aim, :speed, :calc_version)
+        ON CONFLICT(md5_hash) DO UPDATE SET
+            stars=excluded.stars, aim=excluded.aim, speed=excluded.speed, calc_version=excluded.calc_version
+    ''', [{**curve, 'calc_version': parser.CALC_VERSION} for curve in curves])
+    conn.commit()
+    logging.info(f"Saved {len(curves)} rate curves.")
+    conn.close()
+
+def get_rate_curve_rows():
+    """Retrieves every stored rate curve for osu!standard maps, with the base BPM."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT c.md5_hash, c.stars, c.aim, c.speed, b.bpm
+        FROM beatmap_rate_curves c
+        JOIN beatmaps b ON c.md5_hash = b.md5_hash
+        WHERE b.game_mode = 0 AND length(c.stars) > 0
+    ''')
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+def get_rate_curve_hashes():
+    """Retrieves a set of MD5 hashes for beatmaps that already have a rate curve, including empty (failed) ones."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT md5_hash FROM beatmap_rate_curves")
+    hashes = {row['md5_hash'] for row in cursor.fetchall()}
+    conn.close()
+    return hashes
+
 def update_beatmap_details(md5_hash, details):
     """Updates a beatmap record with details parsed from the .osu file."""
     conn = get_db_connection()
@@ -538,19 +777,31 @@ def update_beatmap_details(md5_hash, details):
             audio_file = COALESCE(audio_file, ?),
             background_file = COALESCE(background_file, ?),
             bpm_min = COALESCE(bpm_min, ?),
-            bpm_max = COALESCE(bpm_max, ?)
+            bpm_max = COALESCE(bpm_max, ?),
+            preview_time = COALESCE(preview_time, ?)
         WHERE md5_hash = ?
     ''', (
         details.get('audio_file'),
         details.get('background_file'),
         details.get('bpm_min'),
         details.get('bpm_max'),
+        details.get('preview_time'),
         md5_hash
     ))
     
     conn.commit()
     conn.close()
 
+def get_background_files():
+    """Returns the distinct (folder_name, background_file) pairs of stored beatmaps."""
+    conn = get_db_connection()
+    rows = conn.execute('''
+        SELECT DISTINCT folder_name, background_file FROM beatmaps
+        WHERE folder_name IS NOT NULL AND background_file IS NOT NULL
+    ''').fetchall()
+    conn.close()
+    return [(row['folder_name'], row['background_file']) for row in rows]
+
 def get_beatmap_by_md5(md5_hash):
     """Retrieves a single beatmap by its MD5 hash."""
     if not md5_hash: return None
@@ -563,82 +814,165 @@ def get_beatmap_by_md5(md5_hash):
         return dict(beatmap_row)
     return None
     
+def _count_cache_rows(cursor, mods_list):
+    """Returns {mods: row count} from beatmap_mod_cache for the given mod keys."""
+    if not mods_list:
+        return {}
+    placeholders = ','.join('?' * len(mods_list))
+    cursor.execute(
+        f"SELECT mods, COUNT(*) AS cached FROM beatmap_mod_cache WHERE mods IN ({placeholders}) GROUP BY mods",
+        list(mods_list)
+    )
+    counts = {mods: 0 for mods in mods_list}
+    counts.update({row['mods']: row['cached'] for row in cursor.fetchall()})
+    return counts
+
+def _count_cacheable_beatmaps(cursor):
+    """Counts the analyzed osu!standard beatmaps that the mod cache can cover."""
+    cursor.execute("SELECT COUNT(*) FROM beatmaps WHERE game_mode = 0 AND stars IS NOT NULL")
+    return cursor.fetchone()[0]
+
+def get_mod_cache_coverage(mods_list=None):
+    """
+    Reports how much of the analyzed osu!standard library is cached for each
+    mod combination. Returns {mods: {"cached", "total", "complete"}}; without
+    an explicit list, every combination present in the cache is reported.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    if mods_list is None:
+        cursor.execute("SELECT DISTINCT mods FROM beatmap_mod_cache ORDER BY mods")
+        mods_list = [row['mods'] for row in cursor.fetchall()]
+    counts = _count_cache_rows(cursor, mods_list)
+    total = _count_cacheable_beatmaps(cursor)
+    conn.close()
+    return {
+        mods: {"cached": cached, "total": total, "complete": cached >= total}
+        for mods, cached in counts.items()
+    }
+
+def get_uncached_beatmaps(mods, limit=500):
+    """Returns analyzed osu!standard beatmaps that have no mod cache row for the given mods."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT b.md5_hash, b.folder_name, b.osu_file_name
+        FROM beatmaps b
+        WHERE b.game_mode = 0 AND b.stars IS NOT NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM beatmap_mod_cache c WHERE c.md5_hash = b.md5_hash AND c.mods = ?
+          )
+        LIMIT ?
+    ''', (mods, limit))
+    beatmaps = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return beatmaps
+
+def get_replay_mod_frequencies():
+    """
+    Returns [(mods, play_count)] for the difficulty-relevant mod combinations
+    in the replays table, most played first. NoMod is excluded.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT mods_used, COUNT(*) AS plays FROM replays WHERE game_mode = 0 GROUP BY mods_used")
+    frequencies = {}
+    for row in cursor.fetchall():
+        mods = mod_utils.normalize_mods(row['mods_used'])
+        if mods:
+            frequencies[mods] = frequencies.get(mods, 0) + row['plays']
+    conn.close()
+    return sorted(frequencies.items(), key=lambda item: item[1], reverse=True)
+
+def _select_cache_mods(cursor, difficulty_mods):
+    """
+    Picks the beatmap_mod_cache key used for star filtering. The exact mod
+    combination is used once it is fully cached. Until then, its dominant
+    single mod (DT > HT > HR > EZ) is used if that one is complete, otherwise
+    whichever candidate has the most rows. NoMod returns 0 (beatmaps table).
+    """
+    if difficulty_mods == 0:
+        return 0
+    candidates = [difficulty_mods] + [
+        base_mod for base_mod in (mod_utils.DOUBLE_TIME, mod_utils.HALF_TIME, mod_utils.HARD_ROCK, mod_utils.EASY)
+        if difficulty_mods & base_mod and base_mod != difficulty_mods
+    ]
+    counts = _count_cache_rows(cursor, candidates)
+    total = _count_cacheable_beatmaps(cursor)
+    for candidate in candidates:
+        if counts[candidate] >= total:
+            return candidate
+    return max(candidates, key=lambda candidate: counts[candidate])
+
+def _recommendation_query(mods, cache_mods, focus=None, excluded_count=0):
+    """
+    Builds the recommendation query. Its parameters are the cache mods (only
+    when cache_mods is not 0), the star range, the max BPM and the excluded
+    md5 hashes.
+    """
+    modded = mod_utils.modded_attributes_sql(mods, alias='b')
+
+    # Skill values come from the cache (alias c) for modded plays, else from the beatmap itself.
+    if cache_mods != 0:
+        source_sql = "beatmap_mod_cache c JOIN beatmaps b ON c.md5_hash = b.md5_hash"
+        skill = 'c'
+        mods_clause = "AND c.mods = ?"
+    else:
+        source_sql = "beatmaps b"
+        skill = 'b'
+        mods_clause = ""
+
+    total_objects_expr = "(b.num_hitcircles + b.num_sliders + b.num_spinners)"
+    focus_clause = ""
+    if focus == 'jumps':
+        focus_clause = f" AND {skill}.aim > {skill}.speed * 1.1 AND {skill}.slider_factor > 0.95 "
+    elif focus == 'flow':
+        focus_clause = f" AND ({skill}.aim_difficult_slider_count / NULLIF(b.num_sliders, 0)) > 0.5 AND b.num_sliders > {total_objects_expr} * 0.2 "
+    elif focus == 'speed':
+        focus_clause = f" AND {skill}.speed > {skill}.aim * 1.1 AND ({skill}.speed_note_count / {total_objects_expr}) < 0.4 "
+    elif focus == 'stamina':
+        focus_clause = f" AND ({skill}.speed_note_count / {total_objects_expr}) > 0.4 "
+
+    exclude_placeholders = '?' * excluded_count
+    return f"""
+        SELECT b.*,
+            {skill}.stars as modded_stars, {skill}.aim as modded_aim,
+            {skill}.speed as modded_speed, {skill}.slider_factor as modded_slider_factor,
+            {modded['ar']} as modded_ar, {modded['od']} as modded_od, {modded['cs']} as modded_cs,
+            {modded['hp']} as modded_hp, {modded['bpm']} as modded_bpm
+        FROM {source_sql}
+        WHERE b.game_mode = 0 AND {total_objects_expr} > 0
+          {mods_clause}
+          AND {skill}.stars >= ? AND {skill}.stars < ?
+          AND {modded['bpm']} <= ?
+          {focus_clause}
+          {f"AND b.md5_hash NOT IN ({','.join(exclude_placeholders)})" if excluded_count else ""}
+        ORDER BY RANDOM()
+        LIMIT 1
+    """
+
 def get_recommendation(target_sr, max_bpm, mods, excluded_ids=[], focus=None):
     """
-    Finds a single, random osu! standard beatmap matching the criteria
-    by using a pre-calculated cache of modded difficulties.
+    Finds a single, random osu! standard beatmap matching the criteria.
+    Stars and skill values come from the modded difficulty cache, while
+    AR/OD/CS/HP/BPM are derived from the base values for any mod combination.
     """
     load_dotenv()
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    base_mod = 0
-    if (mods & 64): base_mod = 64      # DoubleTime
-    elif (mods & 256): base_mod = 256   # HalfTime
-    elif (mods & 16): base_mod = 16     # HardRock
-    elif (mods & 2): base_mod = 2       # Easy
-    
+    difficulty_mods = mod_utils.normalize_mods(mods)
+    cache_mods = _select_cache_mods(cursor, difficulty_mods)
+
     sr_lower_bound = target_sr
     sr_upper_bound = target_sr + 0.15
-    
-    focus_clause = ""
-    # Use the cached modded values if a core mod is selected.
-    if base_mod != 0:
-        total_objects_expr = "(b.num_hitcircles + b.num_sliders + b.num_spinners)"
-        if focus == 'jumps':
-            focus_clause = " AND c.aim > c.speed * 1.1 AND c.slider_factor > 0.95 "
-        elif focus == 'flow':
-            focus_clause = f" AND (c.aim_difficult_slider_count / NULLIF(b.num_sliders, 0)) > 0.5 AND b.num_sliders > {total_objects_expr} * 0.2 "
-        elif focus == 'speed':
-            focus_clause = f" AND c.speed > c.aim * 1.1 AND (c.speed_note_count / {total_objects_expr}) < 0.4 "
-        elif focus == 'stamina':
-            focus_clause = f" AND (c.speed_note_count / {total_objects_expr}) > 0.4 "
-
-        exclude_placeholders = '?' * len(excluded_ids)
-        query = f"""
-            SELECT b.*, c.stars as modded_stars
-            FROM beatmap_mod_cache c
-            JOIN beatmaps b ON c.md5_hash = b.md5_hash
-            WHERE c.mods = ?
-              AND c.stars >= ? AND c.stars < ?
-              AND c.bpm <= ?
-              AND b.game_mode = 0 AND {total_objects_expr} > 0
-              {focus_clause}
-              {f"AND b.md5_hash NOT IN ({','.join(exclude_placeholders)})" if excluded_ids else ""}
-            ORDER BY RANDOM()
-            LIMIT 1
-        """
-        params = [base_mod, sr_lower_bound, sr_upper_bound, max_bpm] + excluded_ids
-        logging.debug(f"Recommendation query (cached): {query} with params {params}")
-        cursor.execute(query, params)
-        row = cursor.fetchone()
-    else: # NoMod calculation
-        total_objects_expr = "(b.num_hitcircles + b.num_sliders + b.num_spinners)"
-        if focus == 'jumps':
-            focus_clause = " AND b.aim > b.speed * 1.1 AND b.slider_factor > 0.95 "
-        elif focus == 'flow':
-            focus_clause = f" AND (b.aim_difficult_slider_count / NULLIF(b.num_sliders, 0)) > 0.5 AND b.num_sliders > {total_objects_expr} * 0.2 "
-        elif focus == 'speed':
-            focus_clause = f" AND b.speed > b.aim * 1.1 AND (b.speed_note_count / {total_objects_expr}) < 0.4 "
-        elif focus == 'stamina':
-            focus_clause = f" AND (b.speed_note_count / {total_objects_expr}) > 0.4 "
-
-        exclude_placeholders = '?' * len(excluded_ids)
-        query = f"""
-            SELECT *, stars as modded_stars FROM beatmaps b
-            WHERE game_mode = 0 AND {total_objects_expr} > 0
-              AND stars >= ? AND stars < ?
-              AND bpm <= ?
-              {focus_clause}
-              {f"AND md5_hash NOT IN ({','.join(exclude_placeholders)})" if excluded_ids else ""}
-            ORDER BY RANDOM()
-            LIMIT 1
-        """
-        params = [sr_lower_bound, sr_upper_bound, max_bpm] + excluded_ids
-        logging.debug(f"Recommendation query (NoMod): {query} with params {params}")
-        cursor.execute(query, params)
-        row = cursor.fetchone()
 
+    query = _recommendation_query(mods, cache_mods, focus, len(excluded_ids))
+    params = [cache_mods] if cache_mods != 0 else []
+    params += [sr_lower_bound, sr_upper_bound, max_bpm] + excluded_ids
+    logging.debug(f"Recommendation query (cache mods {cache_mods}): {query} with params {params}")
+    cursor.execute(query, params)
+    row = cursor.fetchone()
     conn.close()
 
     if not row:
@@ -646,11 +980,20 @@ def get_recommendation(target_sr, max_bpm, mods, excluded_ids=[], focus=None):
         return None
 
     beatmap = dict(row)
-    # The original star rating is from the DB (either nomod or pre-cached).
-    # We will overwrite it with a precise, final calculation.
-    beatmap['stars'] = beatmap.pop('modded_stars', beatmap.get('stars'))
-    osu_folder = os.getenv('OSU_FOLDER')
+    for key in ('stars', 'aim', 'speed', 'slider_factor', 'ar', 'od', 'cs', 'hp', 'bpm'):
+        beatmap[key] = beatmap.pop(f'modded_{key}')
+    for key in ('stars', 'aim', 'speed', 'slider_factor'):
+        if beatmap[key] is not None:
+            beatmap[key] = round(beatmap[key], 2)
+    if beatmap['bpm'] is not None:
+        beatmap['bpm'] = round(beatmap['bpm'])
+
+    if cache_mods == difficulty_mods:
+        logging.info(f"Found recommendation: {beatmap['title']} with mods {mods}, final stats: {beatmap['stars']}*, {beatmap['bpm']}BPM")
+        return beatmap
 
+    # The cached stars belong to a different mod combination, so refine them with a live calculation.
+    osu_folder = os.getenv('OSU_FOLDER')
     if not osu_folder:
         logging.error("OSU_FOLDER not set, cannot find .osu file for final calculation.")
         return beatmap
@@ -663,23 +1006,16 @@ def get_recommendation(target_sr, max_bpm, mods, excluded_ids=[], focus=None):
         return beatmap
 
     try:
+        import rosu_pp_py
         rosu_map = rosu_pp_py.Beatmap(path=osu_file_path)
         diff_calc = rosu_pp_py.Difficulty(mods=mods)
         diff_attrs = diff_calc.calculate(rosu_map)
-        
-        attr_builder = rosu_pp_py.BeatmapAttributesBuilder(map=rosu_map, mods=mods)
-        modded_map_attrs = attr_builder.build()
 
         beatmap['stars'] = round(diff_attrs.stars, 2)
         beatmap['aim'] = round(diff_attrs.aim, 2)
         beatmap['speed'] = round(diff_attrs.speed, 2)
         beatmap['slider_factor'] = round(diff_attrs.slider_factor, 2)
-        beatmap['bpm'] = round(beatmap['bpm'] * modded_map_attrs.clock_rate)
-        beatmap['ar'] = round(modded_map_attrs.ar, 2)
-        beatmap['cs'] = round(modded_map_attrs.cs, 2)
-        beatmap['hp'] = round(modded_map_attrs.hp, 2)
-        beatmap['od'] = round(modded_map_attrs.od, 2)
-        
+
         logging.info(f"Found recommendation: {beatmap['title']} with mods {mods}, final stats: {beatmap['stars']}*, {beatmap['bpm']}BPM")
         return beatmap
 
@@ -692,11 +1028,179 @@ def update_replay_pp(replay_md5, pp, stars, map_max_combo):
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute(
-        "UPDATE replays SET pp = ?, stars = ?, map_max_combo = ? WHERE replay_md5 = ?",
-        (pp, stars, map_max_combo, replay_md5)
+        "UPDATE replays SET pp = ?, stars = ?, map_max_combo = ?, calc_version = ? WHERE replay_md5 = ?",
+        (pp, stars, map_max_combo, parser.CALC_VERSION, replay_md5)
+    )
+    conn.commit()
+    conn.close()
+
+def update_replays_pp_batch(updates):
+    """
+    Updates pp and difficulty values for a batch of existing replays and
+    stamps them with the current calc version. Each update is a dict holding
+    replay_md5 plus the keys returned by parser.calculate_pp.
+    """
+    if not updates:
+        return
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.executemany('''
+        UPDATE replays SET
+            pp = :pp, stars = :stars, aim = :aim, speed = :speed, slider_factor = :slider_factor,
+            speed_note_count = :speed_note_count,
+            aim_difficult_strain_count = :aim_difficult_strain_count,
+            speed_difficult_strain_count = :speed_difficult_strain_count,
+            aim_difficult_slider_count = :aim_difficult_slider_count,
+            map_max_combo = :map_max_combo,
+            calc_version = :calc_version
+        WHERE replay_md5 = :replay_md5
+    ''', [{
+        'replay_md5': u['replay_md5'], 'pp': u.get('pp'), 'stars': u.get('stars'), 'aim': u.get('aim'),
+        'speed': u.get('speed'), 'slider_factor': u.get('slider_factor'),
+        'speed_note_count': u.get('speed_note_count'),
+        'aim_difficult_strain_count': u.get('aim_difficult_strain_count'),
+        'speed_difficult_strain_count': u.get('speed_difficult_strain_count'),
+        'aim_difficult_slider_count': u.get('aim_difficult_slider_count'),
+        'map_max_combo': u.get('map_max_combo'),
+        'calc_version': parser.CALC_VERSION if u.get('pp') is not None else None,
+    } for u in updates])
+    conn.commit()
+    logging.info(f"Updated pp for {len(updates)} replays.")
+    conn.close()
+
+def update_beatmap_difficulty_batch(updates):
+    """Overwrites the NoMod difficulty values of a batch of beatmaps and stamps the calc version."""
+    if not updates:
+        return
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.executemany('''
+        UPDATE beatmaps SET
+            stars = :stars, aim = :aim, speed = :speed, slider_factor = :slider_factor,
+            speed_note_count = :speed_note_count,
+            aim_difficult_strain_count = :aim_difficult_strain_count,
+            speed_difficult_strain_count = :speed_difficult_strain_count,
+            aim_difficult_slider_count = :aim_difficult_slider_count,
+            calc_version = :calc_version
+        WHERE md5_hash = :md5_hash
+    ''', [{
+        'md5_hash': u['md5_hash'], 'stars': u.get('stars'), 'aim': u.get('aim'), 'speed': u.get('speed'),
+        'slider_factor': u.get('slider_factor'), 'speed_note_count': u.get('speed_note_count'),
+        'aim_difficult_strain_count': u.get('aim_difficult_strain_count'),
+        'speed_difficult_strain_count': u.get('speed_difficult_strain_count'),
+        'aim_difficult_slider_count': u.get('aim_difficult_slider_count'),
+        'calc_version': parser.CALC_VERSION if u.get('stars') is not None else None,
+    } for u in updates])
+    conn.commit()
+    logging.info(f"Updated difficulty for {len(updates)} beatmaps.")
+    conn.close()
+
+def get_stale_replays():
+    """
+    Retrieves replays whose pp was calculated by a different rosu-pp version
+    (or an unknown one), together with the location of their .osu file.
+    Rows are ordered by (beatmap_md5, mods_used) so they can be grouped.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT r.replay_md5, r.beatmap_md5, r.mods_used, r.num_300s, r.num_100s, r.num_50s,
+               r.num_gekis, r.num_katus, r.num_misses, r.max_combo,
+               b.folder_name, b.osu_file_name
+        FROM replays r
+        JOIN beatmaps b ON r.beatmap_md5 = b.md5_hash
+        WHERE r.pp IS NOT NULL AND (r.calc_version IS NULL OR r.calc_version != ?)
+        ORDER BY r.beatmap_md5, r.mods_used
+    ''', (parser.CALC_VERSION,))
+    replays = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return replays
+
+def get_replays_missing_pp():
+    """
+    Retrieves replays stored without pp or stars (their beatmap was unknown
+    when they were added) whose beatmap has since become known, together with
+    the location of its .osu file. Ordered like get_stale_replays.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT r.replay_md5, r.beatmap_md5, r.mods_used, r.num_300s, r.num_100s, r.num_50s,
+               r.num_gekis, r.num_katus, r.num_misses, r.max_combo,
+               b.folder_name, b.osu_file_name
+        FROM replays r
+        JOIN beatmaps b ON r.beatmap_md5 = b.md5_hash
+        WHERE (r.pp IS NULL OR r.stars IS NULL)
+          AND b.folder_name IS NOT NULL AND b.osu_file_name IS NOT NULL
+        ORDER BY r.beatmap_md5, r.mods_used
+    ''')
+    replays = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return replays
+
+def fill_replay_bpm_from_beatmaps(replay_md5s):
+    """Copies the analyzed BPM values of their beatmaps onto replays that were stored without them."""
+    replay_md5s = list(replay_md5s)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    for i in range(0, len(replay_md5s), 500):
+        chunk = replay_md5s[i:i + 500]
+        placeholders = ','.join('?' for _ in chunk)
+        cursor.execute(f'''
+            UPDATE replays SET
+                bpm = (SELECT b.bpm FROM beatmaps b WHERE b.md5_hash = replays.beatmap_md5),
+                bpm_min = (SELECT b.bpm_min FROM beatmaps b WHERE b.md5_hash = replays.beatmap_md5),
+                bpm_max = (SELECT b.bpm_max FROM beatmaps b WHERE b.md5_hash = replays.beatmap_md5)
+            WHERE bpm IS NULL AND replay_md5 IN ({placeholders})
+        ''', chunk)
+    conn.commit()
+    conn.close()
+
+def get_stale_beatmaps():
+    """Retrieves analyzed beatmaps whose difficulty or rate curve comes from a different rosu-pp version."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT md5_hash, folder_name, osu_file_name
+        FROM beatmaps
+        WHERE stars IS NOT NULL AND (
+            calc_version IS NULL OR calc_version != :version
+            OR md5_hash IN (
+                SELECT md5_hash FROM beatmap_rate_curves
+                WHERE calc_version IS NULL OR calc_version != :version
+            )
+        )
+        ORDER BY md5_hash
+    ''', {'version': parser.CALC_VERSION})
+    beatmaps = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return beatmaps
+
+def delete_stale_mod_cache():
+    """Deletes mod cache rows from other rosu-pp versions; the warmer refills them lazily."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "DELETE FROM beatmap_mod_cache WHERE calc_version IS NULL OR calc_version != ?",
+        (parser.CALC_VERSION,)
     )
+    deleted = cursor.rowcount
     conn.commit()
     conn.close()
+    return deleted
+
+def count_stale_rows():
+    """Counts the rows per table whose calculated values predate the current rosu-pp version."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    stale_filter = "(calc_version IS NULL OR calc_version != ?)"
+    counts = {}
+    for table, extra in (('replays', 'pp IS NOT NULL'), ('beatmaps', 'stars IS NOT NULL'),
+                         ('beatmap_mod_cache', '1'), ('beatmap_rate_curves', '1')):
+        cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE {extra} AND {stale_filter}", (parser.CALC_VERSION,))
+        counts[table] = cursor.fetchone()[0]
+    conn.close()
+    return counts
 
 def update_replay_bpm(replay_md5, bpm, bpm_min, bpm_max):
     """Updates the detailed BPM info for an existing replay record."""
@@ -709,5 +1213,152 @@ def update_replay_bpm(replay_md5, bpm, bpm_min, bpm_max):
     conn.commit()
     conn.close()
 
+def save_job_checkpoint(job_type, state):
+    """Stores the resume state of a job, replacing the previous checkpoint."""
+    conn = get_db_connection()
+    conn.execute(
+        "INSERT OR REPLACE INTO job_checkpoints (job_type, state, updated_at) VALUES (?, ?, datetime('now'))",
+        (job_type, json.dumps(state))
+    )
+    conn.commit()
+    conn.close()
+
+def get_job_checkpoint(job_type):
+    """Returns the stored resume state of a job, or None."""
+    conn = get_db_connection()
+    row = conn.execute("SELECT state FROM job_checkpoints WHERE job_type = ?", (job_type,)).fetchone()
+    conn.close()
+    return json.loads(row['state']) if row else None
+
+def get_checkpointed_job_types():
+    """Returns the types of jobs that were interrupted before finishing."""
+    conn = get_db_connection()
+    job_types = [row['job_type'] for row in conn.execute("SELECT job_type FROM job_checkpoints ORDER BY updated_at")]
+    conn.close()
+    return job_types
+
+def clear_job_checkpoint(job_type):
+    """Removes the checkpoint of a job that finished or was cancelled."""
+    conn = get_db_connection()
+    conn.execute("DELETE FROM job_checkpoints WHERE job_type = ?", (job_type,))
+    conn.commit()
+    conn.close()
+
+def get_indexed_folders():
+    """Returns {folder_name: directory mtime_ns} for every Songs folder in the .osu file index."""
+    conn = get_db_connection()
+    folders = {row['folder_name']: row['mtime_ns'] for row in conn.execute("SELECT folder_name, mtime_ns FROM osu_folder_index")}
+    conn.close()
+    return folders
+
+def get_indexed_files(folder_names):
+    """Returns the .osu file index rows of the given Songs folders."""
+    folder_names = list(folder_names)
+    rows = []
+    conn = get_db_connection()
+    # Chunked to stay below SQLite's host parameter limit.
+    for i in range(0, len(folder_names), 500):
+        chunk = folder_names[i:i + 500]
+        placeholders = ','.join('?' for _ in chunk)
+        rows.extend(dict(row) for row in conn.execute(
+            f"SELECT folder_name, osu_file_name, md5_hash, size, mtime_ns FROM osu_file_index WHERE folder_name IN ({placeholders})",
+            chunk
+        ))
+    conn.close()
+    return rows
+
+def save_indexed_folders(folders):
+    """
+    Replaces the index entries of Songs folders. folders is a list of
+    (folder_name, mtime_ns, files) where files holds
+    (osu_file_name, md5_hash, size, mtime_ns) tuples.
+    """
+    if not folders:
+        return
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    for folder_name, mtime_ns, files in folders:
+        cursor.execute("DELETE FROM osu_file_index WHERE folder_name = ?", (folder_name,))
+        cursor.executemany(
+            "INSERT INTO osu_file_index (folder_name, osu_file_name, md5_hash, size, mtime_ns) VALUES (?, ?, ?, ?, ?)",
+            [(folder_name, *file) for file in files]
+        )
+        cursor.execute("INSERT OR REPLACE INTO osu_folder_index (folder_name, mtime_ns) VALUES (?, ?)", (folder_name, mtime_ns))
+    conn.commit()
+    conn.close()
+
+def remove_indexed_folders(folder_names):
+    """Drops Songs folders that no longer exist from the .osu file index."""
+    if not folder_names:
+        return
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.executemany("DELETE FROM osu_file_index WHERE folder_name = ?", [(name,) for name in folder_names])
+    cursor.executemany("DELETE FROM osu_folder_index WHERE folder_name = ?", [(name,) for name in folder_names])
+    conn.commit()
+    conn.close()
+
+def find_osu_files(md5_hash):
+    """Returns the (folder_name, osu_file_name) locations of a .osu file by its md5."""
+    conn = get_db_connection()
+    locations = [
+        (row['folder_name'], row['osu_file_name'])
+        for row in conn.execute("SELECT folder_name, osu_file_name FROM osu_file_index WHERE md5_hash = ?", (md5_hash,))
+    ]
+    conn.close()
+    return locations
+
+def get_storage_stats():
+    """Returns page and free-list counts and the auto_vacuum mode of the database file."""
+    conn = get_db_connection()
+    stats = {
+        pragma: conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+        for pragma in ('page_count', 'page_size', 'freelist_count', 'auto_vacuum')
+    }
+    conn.close()
+    return stats
+
+# Runs kept per task in task_runs; older ones are dropped when a run is added.
+TASK_RUNS_KEPT = 50
+
+def add_task_run(task, status, seconds, items, errors, details):
+    """
+    Records a finished background task run, stamped with the current
+    calc_version and library size so runs of different versions and
+    libraries can be told apart. details holds the stages, timings and queues.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    library_beatmaps = cursor.execute("SELECT COUNT(*) FROM beatmaps").fetchone()[0]
+    cursor.execute('''
+        INSERT INTO task_runs (task, status, finished_at, seconds, items, errors, calc_version, library_beatmaps, details)
+        VALUES (?, ?, datetime('now'), ?, ?, ?, ?, ?, ?)
+    ''', (task, status, seconds, items, errors, parser.CALC_VERSION, library_beatmaps, json.dumps(details)))
+    cursor.execute('''
+        DELETE FROM task_runs WHERE task = ? AND id NOT IN (
+            SELECT id FROM task_runs WHERE task = ? ORDER BY id DESC LIMIT ?
+        )
+    ''', (task, task, TASK_RUNS_KEPT))
+    conn.commit()
+    conn.close()
+
+def get_task_runs(task=None, limit=20):
+    """Returns recorded task runs, newest first, optionally only those of one task."""
+    conn = get_db_connection()
+    query = "SELECT * FROM task_runs"
+    params = []
+    if task:
+        query += " WHERE task = ?"
+        params.append(task)
+    query += " ORDER BY id DESC LIMIT ?"
+    params.append(limit)
+    runs = []
+    for row in conn.execute(query, params):
+        run = dict(row)
+        run['details'] = json.loads(run['details']) if run['details'] else {}
+        runs.append(run)
+    conn.close()
+    return runs
+
 if __name__ == '__main__':
-    init_db()
\ No newline at end of file
+    init_db()
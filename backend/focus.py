@@ -0,0 +1,94 @@
+"""
+Skill focus tags of beatmaps (Jumps, Flow, Speed, Stamina, Balanced),
+derived from their stored difficulty attributes, and export of one list of
+beatmaps per tag. Used by `cli.py analyze` and tools/analyze_focus.py.
+"""
+import os
+
+import database
+
+FOCUS_TAGS = ("Balanced", "Jumps", "Flow", "Speed", "Stamina", "Incomplete Data")
+
+def get_focus_tag(beatmap):
+    """Determines the focus tag for a given beatmap based on its attributes."""
+    # Ensure all required attributes are present and not None
+    required_attrs = ['aim', 'speed', 'slider_factor', 'speed_note_count',
+                      'aim_difficult_slider_count', 'num_sliders', 'num_hitcircles', 'num_spinners']
+    for attr in required_attrs:
+        if beatmap[attr] is None:
+            return "Incomplete Data"
+
+    # Extract values for easier access
+    aim = beatmap['aim']
+    speed = beatmap['speed']
+    slider_factor = beatmap['slider_factor']
+    speed_note_count = beatmap['speed_note_count']
+    aim_difficult_slider_count = beatmap['aim_difficult_slider_count']
+    num_sliders = beatmap['num_sliders']
+    num_circles = beatmap['num_hitcircles']
+    num_spinners = beatmap['num_spinners']
+
+    n_objects = num_circles + num_sliders + num_spinners
+    if n_objects == 0:
+        return "Incomplete Data"
+
+    # Apply heuristics in a specific order of precedence
+    # Jumps
+    if aim > speed * 1.1 and slider_factor > 0.95:
+        return "Jumps"
+
+    # Flow
+    if num_sliders > 0 and (aim_difficult_slider_count / num_sliders) > 0.5 and num_sliders > (n_objects * 0.2):
+        return "Flow"
+
+    # Speed
+    if speed > aim * 1.1 and (speed_note_count / n_objects) < 0.4:
+        return "Speed"
+
+    # Stamina
+    if (speed_note_count / n_objects) > 0.4:
+        return "Stamina"
+
+    return "Balanced"
+
+def get_tagged_beatmaps():
+    """Returns the analyzed osu!standard beatmaps, hardest first, each with its tag under "focus"."""
+    conn = database.get_db_connection()
+    try:
+        rows = conn.execute("""
+            SELECT
+                artist, title, difficulty, stars,
+                aim, speed, slider_factor, speed_note_count,
+                aim_difficult_slider_count, num_sliders, num_hitcircles, num_spinners
+            FROM beatmaps
+            WHERE game_mode = 0 AND stars IS NOT NULL AND aim IS NOT NULL
+            ORDER BY stars DESC
+        """).fetchall()
+    finally:
+        conn.close()
+    beatmaps = [dict(row) for row in rows]
+    for beatmap in beatmaps:
+        beatmap['focus'] = get_focus_tag(beatmap)
+    return beatmaps
+
+def get_default_output_dir():
+    """The folder the focus lists are written to by default, next to the database file."""
+    return os.path.join(os.path.dirname(os.path.abspath(database.DATABASE_FILE)), 'focus_lists')
+
+def write_focus_lists(beatmaps, output_dir):
+    """Writes one <tag>.txt list per focus tag, hardest first. Returns {tag: beatmap count}."""
+    counts = dict.fromkeys(FOCUS_TAGS, 0)
+    grouped = {tag: [] for tag in FOCUS_TAGS}
+    for beatmap in beatmaps:
+        counts[beatmap['focus']] += 1
+        grouped[beatmap['focus']].append(beatmap)
+
+    os.makedirs(output_dir, exist_ok=True)
+    for tag, maps in grouped.items():
+        if not maps:
+            continue
+        filepath = os.path.join(output_dir, f"{tag.lower().replace(' ', '_')}.txt")
+        with open(filepath, 'w', encoding='utf-8') as f:
+            for bmap in sorted(maps, key=lambda m: m['stars'], reverse=True):
+                f.write(f"[{bmap['stars']:.2f}*] {bmap['artist']} - {bmap['title']} [{bmap['difficulty']}]\n")
+    return counts
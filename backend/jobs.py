@@ -0,0 +1,321 @@
+"""
+A small scheduler for background work.
+
+Job types are registered once with a function, a default priority, a
+concurrency limit and whether they persist checkpoints. Submitted jobs wait
+in a priority queue and start as soon as their type has a free slot, so a
+live replay ingest never waits behind a bulk sync. Long jobs call
+JobContext.check() between units of work: it raises JobCancelled once the
+job is cancelled and pauses the job while higher-priority work is pending.
+
+Resumable jobs save their state with JobContext.save_checkpoint(). The
+checkpoint is cleared when the job completes, fails or is cancelled; one that
+is still present at startup belongs to a job interrupted by the app closing
+(or by shutdown()), and resume_interrupted() submits it again.
+"""
+import os
+import time
+import heapq
+import logging
+import itertools
+import threading
+import concurrent.futures
+from collections import OrderedDict
+
+import database
+import profiling
+
+# Lower numbers run first.
+PRIORITY_LIVE = 0
+PRIORITY_USER = 10
+PRIORITY_BACKGROUND = 20
+
+# Work items a job keeps submitted to its thread pool at once (see run_bounded).
+MAX_IN_FLIGHT = min(32, (os.cpu_count() or 1) + 4) * 2
+# Finished jobs kept for /api/jobs.
+FINISHED_JOBS_KEPT = 100
+
+class JobCancelled(Exception):
+    """Raised by JobContext.check() inside a job that has been cancelled."""
+
+class Job:
+    """A submitted unit of background work."""
+    def __init__(self, job_id, job_type, func, args, kwargs, priority):
+        self.id = job_id
+        self.type = job_type
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.status = 'queued'  # queued, running, complete, cancelled, interrupted, error
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.checkpoint = None
+        self.interrupted = False  # stopped by shutdown(); keeps its checkpoint
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+
+    def wait(self, timeout=None):
+        """Blocks until the job has finished. Returns False on timeout."""
+        return self.done_event.wait(timeout)
+
+    def to_dict(self):
+        return {
+            "id": self.id, "type": self.type, "priority": self.priority, "status": self.status,
+            "error": self.error, "submitted_at": self.submitted_at,
+            "started_at": self.started_at, "finished_at": self.finished_at
+        }
+
+class JobContext:
+    """Handed to a running job as its `job` argument. A detached context (no scheduler) makes every call a no-op."""
+    def __init__(self, scheduler=None, job=None):
+        self._scheduler = scheduler
+        self._job = job
+
+    @property
+    def checkpoint(self):
+        """The state saved by an earlier, interrupted run of this job type, or None."""
+        return self._job.checkpoint if self._job else None
+
+    @property
+    def id(self):
+        return self._job.id if self._job else None
+
+    @property
+    def cancelled(self):
+        return self._job is not None and self._job.cancel_event.is_set()
+
+    def check(self):
+        """Raises JobCancelled if the job was cancelled; otherwise waits out higher-priority work."""
+        if self._job is None:
+            return
+        if self._job.cancel_event.is_set():
+            raise JobCancelled()
+        self._scheduler._yield_to_higher_priority(self._job)
+        if self._job.cancel_event.is_set():
+            raise JobCancelled()
+
+    def save_checkpoint(self, state):
+        """Persists resume state for this job type (only for resumable types)."""
+        if self._job is None or not self._scheduler._types[self._job.type]['resumable']:
+            return
+        database.save_job_checkpoint(self._job.type, state)
+        self._job.checkpoint = state
+
+def detached():
+    """Returns a context for running a job function directly, outside the scheduler."""
+    return JobContext()
+
+def run_bounded(executor, func, items, job, max_in_flight=MAX_IN_FLIGHT, on_depth=None):
+    """
+    Runs func(*args) on the executor for each (key, args) in items and yields
+    (key, future) as they complete. At most max_in_flight calls are submitted
+    at a time, so a paused or cancelled job stops using the pool almost
+    immediately instead of leaving thousands of queued calls behind.
+    on_depth, if given, is called with the number of submitted but not yet
+    yielded calls whenever new ones are submitted.
+    """
+    items = iter(items)
+    pending = {}
+
+    def fill():
+        for key, args in items:
+            pending[executor.submit(func, *args)] = key
+            if len(pending) >= max_in_flight:
+                break
+        if on_depth:
+            on_depth(len(pending))
+
+    try:
+        job.check()
+        fill()
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future
+            job.check()
+            fill()
+    finally:
+        for future in pending:
+            future.cancel()
+
+class JobScheduler:
+    """Priority queue of jobs with per-type concurrency limits."""
+    def __init__(self):
+        self._types = {}
+        self._queue = []  # heap of (priority, sequence, job)
+        self._running = {}  # job id -> job
+        self._finished = OrderedDict()  # job id -> job, oldest first
+        self._changed = threading.Condition()
+        self._ids = itertools.count(1)
+        self._shutting_down = False
+
+    def register(self, job_type, func, priority=PRIORITY_USER, concurrency=1, resumable=False):
+        """Declares a job type. func is called as func(*args, job=JobContext, **kwargs)."""
+        self._types[job_type] = {
+            "func": func, "priority": priority, "concurrency": concurrency, "resumable": resumable
+        }
+
+    def submit(self, job_type, *args, priority=None, unique=False, **kwargs):
+        """
+        Queues a job of a registered type. With unique, nothing is queued if a
+        job of that type is already queued or running and None is returned.
+        """
+        spec = self._types[job_type]
+        with self._changed:
+            if unique and any(job.type == job_type for job in self._active_jobs()):
+                return None
+            job = Job(next(self._ids), job_type, spec['func'], args, kwargs,
+                      spec['priority'] if priority is None else priority)
+            heapq.heappush(self._queue, (job.priority, job.id, job))
+            self._dispatch()
+            self._changed.notify_all()
+            return job
+
+    def cancel(self, job_id=None, job_type=None):
+        """Cancels queued or running jobs by id or by type. Returns how many were cancelled."""
+        cancelled = 0
+        with self._changed:
+            for job in self._active_jobs():
+                if job.id == job_id or job.type == job_type:
+                    job.cancel_event.set()
+                    cancelled += 1
+                    if job.status == 'queued':
+                        self._finish(job, 'cancelled')
+            self._queue = [entry for entry in self._queue if entry[2].status == 'queued']
+            heapq.heapify(self._queue)
+            self._changed.notify_all()
+        return cancelled
+
+    def cancel_all(self, exclude_id=None, min_priority=PRIORITY_USER, timeout=None):
+        """
+        Cancels every queued or running job with a priority of at least
+        min_priority (live jobs keep running) except exclude_id, and waits
+        until the cancelled jobs have stopped. Returns how many were cancelled.
+        """
+        with self._changed:
+            targets = [job for job in self._active_jobs() if job.id != exclude_id and job.priority >= min_priority]
+        for job in targets:
+            self.cancel(job_id=job.id)
+        for job in targets:
+            job.wait(timeout)
+        return len(targets)
+
+    def get_job(self, job_id):
+        with self._changed:
+            for job in itertools.chain(self._active_jobs(), self._finished.values()):
+                if job.id == job_id:
+                    return job
+        return None
+
+    def list_jobs(self):
+        """Returns every queued, running and recently finished job, newest first."""
+        with self._changed:
+            jobs = list(self._active_jobs()) + list(self._finished.values())
+        return [job.to_dict() for job in sorted(jobs, key=lambda job: job.id, reverse=True)]
+
+    def resume_interrupted(self):
+        """Resubmits resumable jobs whose checkpoint survived a previous run."""
+        for job_type in database.get_checkpointed_job_types():
+            if job_type in self._types and self._types[job_type]['resumable']:
+                logging.info(f"Resuming interrupted '{job_type}' job from its checkpoint.")
+                self.submit(job_type, unique=True)
+
+    def shutdown(self, timeout=None):
+        """
+        Prepares for exit: from now on only live jobs start. Live jobs (replay
+        ingests), queued or running, run to completion; every other running job
+        is interrupted at its next check() and keeps its checkpoint, so
+        resume_interrupted() continues it on the next start. Returns False if
+        jobs were still running after timeout seconds.
+        """
+        with self._changed:
+            self._shutting_down = True
+            for job in self._running.values():
+                if job.priority > PRIORITY_LIVE:
+                    job.interrupted = True
+                    job.cancel_event.set()
+            self._changed.notify_all()
+            return self._changed.wait_for(
+                lambda: not self._running and not any(entry[0] <= PRIORITY_LIVE for entry in self._queue),
+                timeout=timeout)
+
+    def wait_idle(self, timeout=None):
+        """Blocks until no job is queued or running. Returns False on timeout."""
+        with self._changed:
+            return self._changed.wait_for(lambda: not self._queue and not self._running, timeout=timeout)
+
+    # --- Internals (called with self._changed held unless noted) ---
+
+    def _active_jobs(self):
+        return itertools.chain(self._running.values(), (entry[2] for entry in self._queue))
+
+    def _dispatch(self):
+        """Starts every queued job whose type has a free slot, highest priority first."""
+        waiting = []
+        while self._queue:
+            entry = heapq.heappop(self._queue)
+            job = entry[2]
+            running_of_type = sum(1 for other in self._running.values() if other.type == job.type)
+            if self._shutting_down and job.priority > PRIORITY_LIVE:
+                waiting.append(entry)
+            elif running_of_type < self._types[job.type]['concurrency']:
+                job.status = 'running'
+                job.started_at = time.time()
+                self._running[job.id] = job
+                threading.Thread(target=self._run, args=(job,), name=f"job-{job.type}-{job.id}", daemon=True).start()
+            else:
+                waiting.append(entry)
+        for entry in waiting:
+            heapq.heappush(self._queue, entry)
+
+    def _finish(self, job, status, error=None):
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        self._running.pop(job.id, None)
+        self._finished[job.id] = job
+        while len(self._finished) > FINISHED_JOBS_KEPT:
+            self._finished.popitem(last=False)
+        job.done_event.set()
+
+    def _yield_to_higher_priority(self, job):
+        """Pauses a running job while more urgent jobs of other types are queued or running."""
+        def clear_to_run():
+            return job.cancel_event.is_set() or not any(
+                other.priority < job.priority and other.type != job.type for other in self._active_jobs()
+            )
+        with self._changed:
+            self._changed.wait_for(clear_to_run)
+
+    def _run(self, job):
+        """Runs a job on its own thread (without the lock held)."""
+        resumable = self._types[job.type]['resumable']
+        status, error = 'complete', None
+        try:
+            if resumable:
+                job.checkpoint = database.get_job_checkpoint(job.type)
+            with profiling.profile_job(job.type):
+                job.func(*job.args, job=JobContext(self, job), **job.kwargs)
+        except JobCancelled:
+            status = 'interrupted' if job.interrupted else 'cancelled'
+            logging.info(f"Job {job.id} ({job.type}) was {status}.")
+        except Exception as e:
+            status, error = 'error', str(e)
+            logging.error(f"Job {job.id} ({job.type}) failed: {e}", exc_info=True)
+
+        if resumable and status != 'interrupted':
+            try:
+                database.clear_job_checkpoint(job.type)
+            except Exception as e:
+                logging.error(f"Could not clear checkpoint of job {job.id} ({job.type}): {e}")
+
+        with self._changed:
+            self._finish(job, status, error)
+            self._dispatch()
+            self._changed.notify_all()
+
+# The process-wide scheduler used by the API, the watcher and the tasks.
+scheduler = JobScheduler()
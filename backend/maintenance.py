@@ -0,0 +1,168 @@
+"""
+Database upkeep: planner statistics, free-space reclamation and query plan checks.
+
+Bulk syncs, recomputes and imports rewrite large parts of the database, which
+leaves the planner with stale statistics and the file full of free pages.
+The maintenance job runs after such writes and once at startup. It runs at
+background priority, so it yields to any other work.
+
+1. Statistics: a bounded ANALYZE followed by PRAGMA optimize.
+2. Free space: PRAGMA incremental_vacuum in small steps. A database created
+   before auto_vacuum was enabled is converted once with a full VACUUM, but
+   only when enough of it is free to be worth it.
+3. Query plans: EXPLAIN QUERY PLAN for the hot queries. A query that scans a
+   whole table or sorts in a temporary b-tree where an index should serve it
+   is reported as a regression.
+"""
+import os
+import time
+import logging
+
+import database
+import jobs
+import tasks
+
+# Rows sampled per index by ANALYZE; keeps statistics cheap on huge tables.
+MAINTENANCE_ANALYSIS_LIMIT = int(os.getenv('MAINTENANCE_ANALYSIS_LIMIT', '1000'))
+# Free pages released per incremental_vacuum step (between cancellation checks).
+MAINTENANCE_VACUUM_STEP_PAGES = 2000
+# A database without incremental auto_vacuum is converted once this share of its pages is free.
+MAINTENANCE_VACUUM_CONVERT_RATIO = 0.25
+# Requests after every sync or recompute start a run at most this often.
+MAINTENANCE_MIN_INTERVAL = float(os.getenv('MAINTENANCE_MIN_INTERVAL_SECONDS', '600'))
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+_last_run = None
+
+# (name, sql, params, ordered): ordered queries must be served in index order
+# (no temporary b-tree for ORDER BY / GROUP BY).
+HOT_QUERIES = [
+    ("replays by player",
+     database._REPLAY_SELECT + database._REPLAY_FROM + " WHERE r.player_name = ? ORDER BY r.played_at DESC LIMIT ? OFFSET ?",
+     ('', 50, 0), True),
+    ("recent replays",
+     database._REPLAY_SELECT + database._REPLAY_FROM + " ORDER BY r.played_at DESC LIMIT ? OFFSET ?",
+     (50, 0), True),
+    ("player play count", "SELECT COUNT(*) FROM replays WHERE player_name = ?", ('',), False),
+    ("player pp ranking", "SELECT pp FROM replays WHERE player_name = ? AND pp > 0 ORDER BY pp DESC", ('',), True),
+    ("player list", "SELECT DISTINCT player_name FROM replays ORDER BY player_name", (), True),
+    ("replay mod frequencies",
+     "SELECT mods_used, COUNT(*) AS plays FROM replays WHERE game_mode = 0 GROUP BY mods_used", (), True),
+    ("beatmap list", "SELECT * FROM beatmaps ORDER BY artist, title LIMIT ? OFFSET ?", (50, 0), True),
+    ("mod cache coverage",
+     "SELECT mods, COUNT(*) AS cached FROM beatmap_mod_cache WHERE mods IN (?) GROUP BY mods", (64,), True),
+    ("recommendation (NoMod)", database._recommendation_query(0, 0), (0, 0, 0), False),
+    ("recommendation (modded)", database._recommendation_query(64, 64), (64, 0, 0, 0), False),
+]
+
+def _plan_problems(plan, ordered):
+    """Returns the plan steps that indicate a missing index."""
+    problems = []
+    for detail in plan:
+        if detail.startswith('SCAN ') and 'INDEX' not in detail:
+            problems.append(detail)
+        elif ordered and detail.startswith('USE TEMP B-TREE'):
+            problems.append(detail)
+    return problems
+
+def check_query_plans():
+    """Runs EXPLAIN QUERY PLAN for every hot query. Returns [{"name", "ok", "plan", "problems"}]."""
+    conn = database.get_db_connection()
+    results = []
+    try:
+        for name, sql, params, ordered in HOT_QUERIES:
+            plan = [row['detail'] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            problems = _plan_problems(plan, ordered)
+            results.append({"name": name, "ok": not problems, "plan": plan, "problems": problems})
+    finally:
+        conn.close()
+    return results
+
+def _update_statistics():
+    conn = database.get_db_connection()
+    try:
+        conn.execute(f"PRAGMA analysis_limit = {int(MAINTENANCE_ANALYSIS_LIMIT)}")
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA optimize")
+        conn.commit()
+    finally:
+        conn.close()
+
+def _reclaim_free_pages(progress, job):
+    """Releases free pages to the file system. Returns the number of pages freed."""
+    stats = database.get_storage_stats()
+    free_pages = stats['freelist_count']
+    if free_pages == 0:
+        return 0
+
+    conn = database.get_db_connection()
+    try:
+        if stats['auto_vacuum'] != AUTO_VACUUM_INCREMENTAL:
+            if free_pages < stats['page_count'] * MAINTENANCE_VACUUM_CONVERT_RATIO:
+                return 0
+            # One-time conversion; VACUUM rewrites the file and cannot be interrupted.
+            progress.update(message=f"Compacting database ({free_pages} free pages) and enabling incremental vacuum...")
+            logging.info(f"Converting database to incremental auto_vacuum ({free_pages} of {stats['page_count']} pages free).")
+            conn.execute(f"PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}")
+            conn.execute("VACUUM")
+            return free_pages
+
+        progress.begin_stage('vacuum', free_pages, message=f"Releasing {free_pages} free pages...")
+        freed = 0
+        while freed < free_pages:
+            job.check()
+            # incremental_vacuum frees one page per result row, so the rows must be stepped through.
+            conn.execute(f"PRAGMA incremental_vacuum({MAINTENANCE_VACUUM_STEP_PAGES})").fetchall()
+            remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if free_pages - remaining <= freed:
+                break
+            freed = free_pages - remaining
+            progress.update(current=freed)
+        return freed
+    finally:
+        conn.close()
+
+def request_maintenance():
+    """Queues a maintenance run after large writes, unless one ran within MAINTENANCE_MIN_INTERVAL."""
+    if _last_run is not None and time.monotonic() - _last_run < MAINTENANCE_MIN_INTERVAL:
+        return None
+    return jobs.scheduler.submit('maintenance', unique=True)
+
+def maintenance_task(job=None):
+    """The background task that refreshes planner statistics, reclaims free pages and checks query plans."""
+    global _last_run
+    job = job or jobs.detached()
+    progress = tasks.TASK_PROGRESS['maintenance']
+    progress.start('Starting database maintenance...')
+
+    try:
+        progress.begin_stage('statistics', 0, message='Updating query planner statistics...')
+        _update_statistics()
+        job.check()
+
+        freed = _reclaim_free_pages(progress, job)
+        progress.update(freed_pages=freed)
+        job.check()
+
+        progress.begin_stage('query plans', len(HOT_QUERIES), message='Checking query plans...')
+        results = check_query_plans()
+        regressions = [result['name'] for result in results if not result['ok']]
+        for result in results:
+            if not result['ok']:
+                logging.warning(f"Query plan regression in '{result['name']}': {'; '.join(result['problems'])}")
+        progress.update(current=len(results), regressions=regressions)
+
+        _last_run = time.monotonic()
+        message = f"Database maintenance complete. Released {freed} free pages."
+        if regressions:
+            message += f" {len(regressions)} queries do not use an index: {', '.join(regressions)}."
+        progress.finish(message)
+    except jobs.JobCancelled:
+        progress.finish('Database maintenance cancelled.', status='cancelled')
+        raise
+    except Exception as e:
+        logging.error(f"Error in maintenance task: {e}", exc_info=True)
+        progress.fail(e, f'Database maintenance failed: {e}')
+
+jobs.scheduler.register('maintenance', maintenance_task, priority=jobs.PRIORITY_BACKGROUND)
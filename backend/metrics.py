@@ -0,0 +1,200 @@
+"""
+Lightweight latency and volume metrics, exposed at /api/metrics.
+
+Collection is off unless METRICS_ENABLED=1. When it is off, install() does
+nothing: no function is wrapped and no request hook is registered, so the
+app runs exactly as without this module. When it is on, it records:
+
+- osu_tracker_http_request_seconds{endpoint, method, status}: every /api route.
+- osu_tracker_http_response_bytes_total{endpoint}: bytes served per route.
+- osu_tracker_call_seconds{component, function}: every public database
+  function, the .osu/.osr/osu!.db parsers, the rosu-pp calculations and JSON
+  serialization.
+- osu_tracker_db_rows_total{function}: rows returned by database functions.
+
+Histograms use fixed buckets and are aggregated in memory, so a sample costs
+two clock reads and a short locked update.
+"""
+import os
+import time
+import bisect
+import inspect
+import functools
+import threading
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '0') == '1'
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implicit.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "osu_tracker_http_request_seconds": ("histogram", "Latency of /api requests."),
+    "osu_tracker_http_response_bytes_total": ("counter", "Response bytes served by /api routes."),
+    "osu_tracker_call_seconds": ("histogram", "Latency of database, parser, rosu-pp and JSON calls."),
+    "osu_tracker_db_rows_total": ("counter", "Rows returned by database functions."),
+}
+
+_lock = threading.Lock()
+_histograms = {}  # name -> {labels tuple: [bucket counts..., +Inf count, sum]}
+_counters = {}  # name -> {labels tuple: value}
+_installed = False
+
+def observe(name, labels, seconds):
+    """Adds one sample to a histogram. labels is a tuple of (key, value) pairs."""
+    index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        values = series.get(labels)
+        if values is None:
+            values = series[labels] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+        values[index] += 1
+        values[-1] += seconds
+
+def increment(name, labels, amount=1):
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[labels] = series.get(labels, 0) + amount
+
+def _count_rows(result):
+    """Rows in a database function result: list and set lengths, lists nested one level in a dict, else one row."""
+    if isinstance(result, (list, set, tuple)):
+        return len(result)
+    if isinstance(result, dict):
+        nested = [len(value) for value in result.values() if isinstance(value, list)]
+        return sum(nested) if nested else 1
+    return 1 if result is not None else 0
+
+def timed(component, function, count_rows=False):
+    """Decorator that records the duration of each call (and optionally the rows it returned)."""
+    labels = (('component', component), ('function', function))
+    row_labels = (('function', function),)
+
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                observe('osu_tracker_call_seconds', labels, time.perf_counter() - start)
+            if count_rows:
+                increment('osu_tracker_db_rows_total', row_labels, _count_rows(result))
+            return result
+        return wrapper
+    return decorate
+
+def instrument_module(module, component, names=None, exclude=(), count_rows=False):
+    """Replaces public functions of a module (or only those in names) with timed wrappers."""
+    for name, func in list(vars(module).items()):
+        if name.startswith('_') or not inspect.isfunction(func) or func.__module__ != module.__name__:
+            continue
+        if (names is not None and name not in names) or name in exclude:
+            continue
+        setattr(module, name, timed(component, name, count_rows)(func))
+
+def _instrument_json(app):
+    provider_class = type(app.json)
+
+    class TimedJSONProvider(provider_class):
+        dumps = timed('json', 'dumps')(provider_class.dumps)
+
+    app.json = TimedJSONProvider(app)
+
+def _instrument_requests(app, blueprint_name):
+    from flask import g, request
+
+    @app.before_request
+    def start_timer():
+        if request.blueprint == blueprint_name:
+            g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+            observe('osu_tracker_http_request_seconds',
+                    (('endpoint', endpoint), ('method', request.method), ('status', str(response.status_code))),
+                    time.perf_counter() - start)
+            if response.content_length:
+                increment('osu_tracker_http_response_bytes_total', (('endpoint', endpoint),), response.content_length)
+        return response
+
+def install(app, blueprint_name='api'):
+    """Instruments the app and the backend modules when METRICS_ENABLED is set. Safe to call more than once."""
+    global _installed
+    if not METRICS_ENABLED or _installed:
+        return
+    _installed = True
+
+    import database
+    import parser
+    import rate_curves
+    import tasks
+
+    # get_db_connection is part of every other call and would only add noise.
+    instrument_module(database, 'database', exclude={'get_db_connection'}, count_rows=True)
+    instrument_module(parser, 'parser', names={
+        'parse_replay_file', 'parse_osu_db', 'parse_osu_file', 'parse_osu_metadata'
+    })
+    instrument_module(parser, 'rosu', names={'calculate_difficulty', 'calculate_pp', 'calculate_pp_batch'})
+    instrument_module(rate_curves, 'rosu', names={'calculate_rate_curve'})
+    instrument_module(tasks, 'rosu', names={'process_osu_file_and_cache', 'calculate_mod_cache_entry'})
+    _instrument_json(app)
+    _instrument_requests(app, blueprint_name)
+
+def snapshot():
+    """Returns every metric as plain data (the JSON form of /api/metrics)."""
+    with _lock:
+        histograms = {name: {labels: list(values) for labels, values in series.items()}
+                      for name, series in _histograms.items()}
+        counters = {name: dict(series) for name, series in _counters.items()}
+
+    data = {"enabled": METRICS_ENABLED, "buckets": list(LATENCY_BUCKETS), "histograms": {}, "counters": {}}
+    for name, series in histograms.items():
+        data["histograms"][name] = [
+            {"labels": dict(labels), "count": sum(values[:-1]), "sum": round(values[-1], 6),
+             "buckets": values[:-1]}
+            for labels, values in sorted(series.items())
+        ]
+    for name, series in counters.items():
+        data["counters"][name] = [
+            {"labels": dict(labels), "value": value} for labels, value in sorted(series.items())
+        ]
+    return data
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels.items()) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+def render_prometheus():
+    """Returns every metric in the Prometheus text exposition format."""
+    data = snapshot()
+    lines = []
+    for name, series in data["histograms"].items():
+        metric_type, help_text = HELP.get(name, ("histogram", name))
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+        for entry in series:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), entry["buckets"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(entry['labels'], [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(entry['labels'])} {entry['sum']}")
+            lines.append(f"{name}_count{_format_labels(entry['labels'])} {entry['count']}")
+    for name, series in data["counters"].items():
+        metric_type, help_text = HELP.get(name, ("counter", name))
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+        for entry in series:
+            lines.append(f"{name}{_format_labels(entry['labels'])} {entry['value']}")
+    return '\n'.join(lines) + '\n'
+
+def reset():
+    """Clears every recorded sample."""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
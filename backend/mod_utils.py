@@ -0,0 +1,109 @@
+"""
+Helpers for osu! mod bitmasks and the beatmap attributes they modify.
+
+AR, OD, CS, HP and BPM under mods follow deterministically from the base
+values and the clock rate, so they are derived here instead of being stored
+per mod combination. The SQL builders let SQLite evaluate the formulas across
+the whole beatmaps table in a single query.
+"""
+
+NO_MOD = 0
+EASY = 2
+HIDDEN = 8
+HARD_ROCK = 16
+DOUBLE_TIME = 64
+HALF_TIME = 256
+NIGHTCORE = 512  # Always used with DoubleTime
+FLASHLIGHT = 1024
+
+# Mods that change difficulty attributes (stars, aim, speed). Everything else
+# is irrelevant to difficulty and is stripped before a mod cache lookup.
+DIFFICULTY_MOD_MASK = EASY | HIDDEN | HARD_ROCK | DOUBLE_TIME | HALF_TIME | FLASHLIGHT
+
+def normalize_mods(mods):
+    """Reduces a mod bitmask to the bits that affect difficulty (NC counts as DT)."""
+    mods = mods or 0
+    if mods & NIGHTCORE:
+        mods |= DOUBLE_TIME
+    return mods & DIFFICULTY_MOD_MASK
+
+def get_clock_rate(mods):
+    """Returns the playback rate implied by the speed-changing mods."""
+    mods = mods or 0
+    if mods & (DOUBLE_TIME | NIGHTCORE):
+        return 1.5
+    if mods & HALF_TIME:
+        return 0.75
+    return 1.0
+
+def _stat_multiplier(mods, hr_multiplier):
+    """Returns the EZ/HR multiplier for a stat (HR uses 1.3 for CS, 1.4 otherwise)."""
+    if mods & HARD_ROCK:
+        return hr_multiplier
+    if mods & EASY:
+        return 0.5
+    return 1.0
+
+def _ar_to_preempt(ar):
+    return 1800 - 120 * ar if ar < 5 else 1200 - 150 * (ar - 5)
+
+def _preempt_to_ar(preempt):
+    return (1800 - preempt) / 120 if preempt > 1200 else 5 + (1200 - preempt) / 150
+
+def apply_mods(attributes, mods, clock_rate=None):
+    """
+    Returns a copy of the ar/od/cs/hp/bpm values in `attributes` adjusted for
+    the given mod bitmask. A custom clock_rate overrides the rate implied by
+    DT/HT. Missing values stay None.
+    """
+    rate = clock_rate if clock_rate is not None else get_clock_rate(mods)
+    result = {}
+
+    def scaled(key, hr_multiplier):
+        value = attributes.get(key)
+        if value is None:
+            return None
+        return min(value * _stat_multiplier(mods, hr_multiplier), 10.0)
+
+    ar = scaled('ar', 1.4)
+    if ar is not None and rate != 1.0:
+        ar = _preempt_to_ar(_ar_to_preempt(ar) / rate)
+    od = scaled('od', 1.4)
+    if od is not None and rate != 1.0:
+        od = (80 - (80 - 6 * od) / rate) / 6
+    bpm = attributes.get('bpm')
+    if bpm is not None:
+        bpm = bpm * rate
+
+    for key, value in (('ar', ar), ('od', od), ('cs', scaled('cs', 1.3)), ('hp', scaled('hp', 1.4)), ('bpm', bpm)):
+        result[key] = round(value, 2) if value is not None else None
+    return result
+
+def _scaled_sql(column, mods, hr_multiplier):
+    multiplier = _stat_multiplier(mods, hr_multiplier)
+    if multiplier == 1.0:
+        return column
+    return f"MIN({column} * {multiplier}, 10.0)"
+
+def modded_attributes_sql(mods, alias='b'):
+    """
+    Builds SQL expressions that compute modded ar/od/cs/hp/bpm from the base
+    columns of the beatmaps table aliased as `alias`. Returns a dict mapping
+    each attribute name to its expression.
+    """
+    rate = get_clock_rate(mods)
+    ar = _scaled_sql(f"{alias}.ar", mods, 1.4)
+    od = _scaled_sql(f"{alias}.od", mods, 1.4)
+
+    if rate != 1.0:
+        preempt = f"((CASE WHEN {ar} < 5 THEN 1800 - 120 * {ar} ELSE 1200 - 150 * ({ar} - 5) END) / {rate})"
+        ar = f"(CASE WHEN {preempt} > 1200 THEN (1800 - {preempt}) / 120 ELSE 5 + (1200 - {preempt}) / 150 END)"
+        od = f"((80 - (80 - 6 * {od}) / {rate}) / 6)"
+
+    return {
+        'ar': f"ROUND({ar}, 2)",
+        'od': f"ROUND({od}, 2)",
+        'cs': f"ROUND({_scaled_sql(f'{alias}.cs', mods, 1.3)}, 2)",
+        'hp': f"ROUND({_scaled_sql(f'{alias}.hp', mods, 1.4)}, 2)",
+        'bpm': f"ROUND({alias}.bpm * {rate}, 2)",
+    }
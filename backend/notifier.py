@@ -0,0 +1,159 @@
+"""
+Pushes new replays to the frontend as compact deltas.
+
+Instead of telling the UI to refetch everything, the watcher publishes the
+replays it just stored. The notifier coalesces everything published within
+UI_NOTIFY_INTERVAL_MS into a single 'replaysadded' event carrying the new
+replay rows (with rank and accuracy) and the updated aggregates of every
+player involved, which the views patch into their state in place.
+
+Where the event goes is pluggable: a dispatch function takes (event_name,
+payload). The desktop app fires it as a DOM event in its window; a headless
+server (service.py) has no window and publishes it to the browsers listening
+on /api/events instead. NOTIFY_WEBHOOK_URL additionally POSTs every event as
+JSON to another service.
+"""
+import os
+import json
+import time
+import logging
+import threading
+import urllib.request
+from collections import deque
+
+import database
+import scoring
+
+# Minimum time between two pushes to the frontend.
+UI_NOTIFY_INTERVAL_MS = int(os.getenv('UI_NOTIFY_INTERVAL_MS', '1000'))
+NOTIFY_WEBHOOK_URL = os.getenv('NOTIFY_WEBHOOK_URL', '')
+NOTIFY_WEBHOOK_TIMEOUT = 5.0
+# Events kept for /api/events listeners that reconnect (Last-Event-ID).
+EVENT_BACKLOG = 50
+
+def window_dispatcher(window):
+    """Returns a dispatch function that fires a DOM CustomEvent in a pywebview window."""
+    def dispatch(event_name, payload):
+        detail = json.dumps(payload)
+        window.evaluate_js(f"document.dispatchEvent(new CustomEvent({json.dumps(event_name)}, {{ detail: {detail} }}))")
+    return dispatch
+
+def webhook_dispatcher(url, timeout=NOTIFY_WEBHOOK_TIMEOUT):
+    """Returns a dispatch function that POSTs {"event", "payload"} as JSON to url."""
+    def dispatch(event_name, payload):
+        body = json.dumps({"event": event_name, "payload": payload}).encode('utf-8')
+        webhook_request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(webhook_request, timeout=timeout) as response:
+            response.read()
+    return dispatch
+
+def combine(dispatchers):
+    """Returns a dispatch function that calls every dispatcher; one failing does not stop the others."""
+    def dispatch(event_name, payload):
+        for channel in dispatchers:
+            try:
+                channel(event_name, payload)
+            except Exception as e:
+                logging.error(f"Failed to deliver '{event_name}' event: {e}", exc_info=True)
+    return dispatch
+
+class EventBroadcaster:
+    """
+    Holds the latest events for the /api/events stream. publish() is a
+    dispatch function; listeners block in wait_for_events() and read every
+    event after the last sequence number they have seen.
+    """
+    def __init__(self, backlog=EVENT_BACKLOG):
+        self._events = deque(maxlen=backlog)  # (sequence, event_name, payload)
+        self._sequence = 0
+        self._changed = threading.Condition()
+
+    def publish(self, event_name, payload):
+        with self._changed:
+            self._sequence += 1
+            self._events.append((self._sequence, event_name, payload))
+            self._changed.notify_all()
+
+    @property
+    def sequence(self):
+        """The sequence number of the latest event (0 before the first)."""
+        with self._changed:
+            return self._sequence
+
+    def wait_for_events(self, since_sequence, timeout=None):
+        """Blocks until an event newer than since_sequence exists or the timeout passes; returns the newer events."""
+        with self._changed:
+            self._changed.wait_for(lambda: self._sequence > since_sequence, timeout=timeout)
+            return [event for event in self._events if event[0] > since_sequence]
+
+# The events served on /api/events.
+broadcaster = EventBroadcaster()
+
+def build_dispatcher(window=None):
+    """
+    Returns the dispatch function for the configured channels: the window
+    when there is one, otherwise the /api/events broadcaster, plus the webhook
+    if NOTIFY_WEBHOOK_URL is set. The window's page also listens on
+    /api/events, so events only go to one of the two.
+    """
+    channels = [window_dispatcher(window) if window is not None else broadcaster.publish]
+    if NOTIFY_WEBHOOK_URL:
+        channels.append(webhook_dispatcher(NOTIFY_WEBHOOK_URL))
+    return combine(channels)
+
+def build_replay_delta(replay_md5s):
+    """Builds the 'replaysadded' payload for stored replays: the rows plus per-player aggregates."""
+    replays = database.get_replays_by_md5(replay_md5s)
+    for replay in replays:
+        scoring.add_rank_to_replay(replay)
+        replay['accuracy'] = round(scoring.calculate_accuracy(replay), 2)
+    players = {name: database.get_player_stats(name) for name in {r['player_name'] for r in replays}}
+    return {"replays": replays, "players": players}
+
+class DeltaNotifier:
+    """
+    Rate-limited, coalescing notifier. publish() never blocks on the UI: the
+    first publish after a quiet period is pushed immediately, later ones are
+    merged and pushed together once the interval has passed.
+    """
+    def __init__(self, dispatch, min_interval_ms=UI_NOTIFY_INTERVAL_MS):
+        self._dispatch = dispatch
+        self._min_interval = min_interval_ms / 1000.0
+        self._pending = {}  # replay_md5 -> None, kept in publish order
+        self._last_sent = 0.0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def publish(self, replay_md5s):
+        """Queues stored replays for the next push."""
+        with self._lock:
+            self._pending.update(dict.fromkeys(replay_md5s))
+            if self._timer is not None:
+                return
+            delay = max(0.0, self._last_sent + self._min_interval - time.monotonic())
+            self._timer = threading.Timer(delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Pushes everything queued so far in one event."""
+        with self._lock:
+            replay_md5s, self._pending = list(self._pending), {}
+            self._timer = None
+            self._last_sent = time.monotonic()
+        if not replay_md5s:
+            return
+        try:
+            payload = build_replay_delta(replay_md5s)
+            self._dispatch('replaysadded', payload)
+            logging.info(f"Pushed {len(payload['replays'])} new replay(s) to the frontend.")
+        except Exception as e:
+            logging.error(f"Failed to push replay update to the frontend: {e}", exc_info=True)
+
+    def close(self):
+        """Cancels a scheduled push and sends pending replays right away."""
+        with self._lock:
+            timer = self._timer
+        if timer is not None:
+            timer.cancel()
+        self.flush()
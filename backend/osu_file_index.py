@@ -0,0 +1,135 @@
+"""
+Persistent index from the md5 of every .osu file under Songs to its location.
+
+osu!.db only learns about a beatmap once osu! rewrites it, so a replay of a
+freshly downloaded map refers to an md5 the beatmaps table does not know.
+This index maps such an md5 to its file with one lookup.
+
+The index is kept up to date incrementally. Each set folder is stored with
+its directory mtime, and only folders whose mtime changed (files were added,
+removed or renamed) are listed again. Inside those folders, only .osu files
+whose size or mtime changed are hashed again.
+"""
+import os
+import hashlib
+import logging
+
+import database
+
+# Folders written to the database per transaction while refreshing.
+SAVE_BATCH_FOLDERS = 200
+
+def _hash_file(file_path):
+    with open(file_path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+def _changed_folders(songs_path):
+    """Returns (changed, removed): new or modified set folders as (name, mtime_ns), newest first, and vanished folder names."""
+    indexed = database.get_indexed_folders()
+    changed = []
+    present = set()
+    with os.scandir(songs_path) as entries:
+        for entry in entries:
+            try:
+                if not entry.is_dir():
+                    continue
+                mtime_ns = entry.stat().st_mtime_ns
+            except OSError:
+                continue
+            present.add(entry.name)
+            if indexed.get(entry.name) != mtime_ns:
+                changed.append((entry.name, mtime_ns))
+    # The newest folders are the likeliest to hold a map that is being looked up.
+    changed.sort(key=lambda folder: folder[1], reverse=True)
+    removed = [name for name in indexed if name not in present]
+    return changed, removed
+
+def _index_folder(songs_path, folder_name, previous_files):
+    """Lists the .osu files of one folder, hashing only files whose size or mtime changed."""
+    folder_path = os.path.join(songs_path, folder_name)
+    files = []
+    try:
+        entries = list(os.scandir(folder_path))
+    except OSError as e:
+        logging.warning(f"Could not index Songs folder {folder_path}: {e}")
+        return files
+
+    for entry in entries:
+        if not entry.name.endswith('.osu'):
+            continue
+        try:
+            stat = entry.stat()
+            previous = previous_files.get(entry.name)
+            if previous and previous['size'] == stat.st_size and previous['mtime_ns'] == stat.st_mtime_ns:
+                md5 = previous['md5_hash']
+            else:
+                md5 = _hash_file(entry.path)
+        except OSError as e:
+            logging.warning(f"Could not index beatmap file {entry.path}: {e}")
+            continue
+        files.append((entry.name, md5, stat.st_size, stat.st_mtime_ns))
+    return files
+
+def refresh(songs_path, folder_names=None, find_md5=None, job=None, on_folder=None):
+    """
+    Brings the index up to date with Songs. With folder_names, only those
+    folders are considered. With find_md5, the refresh stops as soon as that
+    md5 has been indexed (the remaining folders are picked up by a later
+    refresh). job is checked between folders and on_folder(done, total) is
+    called after each one. Returns {"folders", "files", "removed", "found"}.
+    """
+    # No lock: folders are replaced in single transactions, so concurrent refreshes
+    # (a background index job and a replay lookup) at worst hash a folder twice.
+    changed, removed = _changed_folders(songs_path)
+    if folder_names is not None:
+        wanted = set(folder_names)
+        changed = [folder for folder in changed if folder[0] in wanted]
+        removed = []
+
+    stats = {"folders": 0, "files": 0, "removed": len(removed), "found": False}
+    database.remove_indexed_folders(removed)
+
+    previously_indexed = set(database.get_indexed_folders())
+    batch = []
+    try:
+        for done, (folder_name, mtime_ns) in enumerate(changed, start=1):
+            if job:
+                job.check()
+            previous_files = {}
+            if folder_name in previously_indexed:
+                previous_files = {row['osu_file_name']: row for row in database.get_indexed_files([folder_name])}
+            files = _index_folder(songs_path, folder_name, previous_files)
+            batch.append((folder_name, mtime_ns, files))
+            stats["folders"] += 1
+            stats["files"] += len(files)
+            if on_folder:
+                on_folder(done, len(changed))
+
+            if find_md5 and any(file[1] == find_md5 for file in files):
+                stats["found"] = True
+                break
+            if len(batch) >= SAVE_BATCH_FOLDERS:
+                database.save_indexed_folders(batch)
+                batch = []
+    finally:
+        database.save_indexed_folders(batch)
+
+    if stats["folders"] or stats["removed"]:
+        logging.info(f"Indexed {stats['files']} .osu files in {stats['folders']} changed folders, "
+                     f"removed {stats['removed']} folders.")
+    return stats
+
+def lookup(songs_path, md5):
+    """Returns the (folder_name, osu_file_name) of an indexed .osu file that still exists, or None."""
+    for folder_name, osu_file_name in database.find_osu_files(md5):
+        if os.path.isfile(os.path.join(songs_path, folder_name, osu_file_name)):
+            return folder_name, osu_file_name
+    return None
+
+def resolve(songs_path, md5):
+    """Like lookup(), but refreshes the index (newest folders first) when the md5 is not indexed yet."""
+    location = lookup(songs_path, md5)
+    if location is None and os.path.isdir(songs_path):
+        if refresh(songs_path, find_md5=md5)["found"]:
+            location = lookup(songs_path, md5)
+    return location
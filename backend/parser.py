@@ -3,7 +3,19 @@ import lzma
 import logging
 import os
 from datetime import datetime, timedelta
-import rosu_pp_py
+from importlib import metadata
+
+def _get_calc_version():
+    """Returns the identifier of the difficulty/pp algorithm used for calculations."""
+    try:
+        return f"rosu-pp-py {metadata.version('rosu-pp-py')}"
+    except metadata.PackageNotFoundError:
+        # Frozen bundles may not ship package metadata; fall back to the module attribute if present.
+        import rosu_pp_py
+        return f"rosu-pp-py {getattr(rosu_pp_py, '__version__', 'unknown')}"
+
+# Stamped on every stored pp/stars value so results from different rosu-pp versions never mix silently.
+CALC_VERSION = _get_calc_version()
 
 def read_byte(file):
     """Reads a 1-byte integer from the file."""
@@ -128,7 +140,8 @@ def parse_osu_db(db_path):
                     num_pairs = read_int(f)
                     f.seek(num_pairs * pair_size, 1) # Skip the pairs data
 
-            f.seek(12, 1) # drain_time, total_time, preview_time
+            f.seek(8, 1) # drain_time, total_time
+            preview_time = read_int(f)  # ms into the audio; -1 (read unsigned) when the map sets none
             
             num_timing_points = read_int(f)
             bpm = 0.0
@@ -167,18 +180,20 @@ def parse_osu_db(db_path):
                     "folder_name": folder_name, "osu_file_name": osu_file_name, "grades": grades,
                     "last_played_date": last_played_date, "game_mode": gameplay_mode,
                     "num_hitcircles": num_hitcircles, "num_sliders": num_sliders, "num_spinners": num_spinners,
-                    "ar": round(ar, 2), "cs": round(cs, 2), "hp": round(hp, 2), "od": round(od, 2), "bpm": round(bpm, 2)
+                    "ar": round(ar, 2), "cs": round(cs, 2), "hp": round(hp, 2), "od": round(od, 2), "bpm": round(bpm, 2),
+                    "preview_time": preview_time if preview_time < 2 ** 31 else None
                 }
     return beatmaps
 
 def parse_osu_file(file_path):
     """
-    Parses a .osu file to find audio/background filenames and detailed BPM info,
-    including the duration-weighted main BPM.
+    Parses a .osu file to find audio/background filenames, the audio preview
+    point and detailed BPM info, including the duration-weighted main BPM.
     """
     data = {
         "audio_file": None, 
         "background_file": None,
+        "preview_time": None,
         "bpm": None,
         "bpm_min": None,
         "bpm_max": None
@@ -201,6 +216,9 @@ def parse_osu_file(file_path):
                 if current_section == "[General]":
                     if line.startswith("AudioFilename:"):
                         data["audio_file"] = line.split(":", 1)[1].strip()
+                    elif line.startswith("PreviewTime:"):
+                        preview_time = int(line.split(":", 1)[1].strip())
+                        data["preview_time"] = preview_time if preview_time >= 0 else None
                 
                 elif current_section == "[Events]":
                     if data.get("background_file") is None and (line.startswith("0,0,") or line.startswith("Image,")):
@@ -264,8 +282,68 @@ def parse_osu_file(file_path):
     logging.debug(f"Parser result for {os.path.basename(file_path)}: {data}")
     return data
 
+def parse_osu_metadata(file_path):
+    """
+    Reads the library metadata osu!.db would hold for a .osu file (mode, names,
+    difficulty settings and hit object counts). Used for beatmaps that exist in
+    Songs before osu! has written them to osu!.db. Returns None if unreadable.
+    """
+    data = {
+        "artist": None, "title": None, "creator": None, "difficulty": None,
+        "game_mode": 0, "grades": {}, "last_played_date": None,
+        "num_hitcircles": 0, "num_sliders": 0, "num_spinners": 0,
+        "ar": None, "cs": None, "hp": None, "od": None
+    }
+    keys = {
+        "[General]": {"Mode": ("game_mode", int)},
+        "[Metadata]": {"Artist": ("artist", str), "Title": ("title", str),
+                       "Creator": ("creator", str), "Version": ("difficulty", str)},
+        "[Difficulty]": {"ApproachRate": ("ar", float), "CircleSize": ("cs", float),
+                         "HPDrainRate": ("hp", float), "OverallDifficulty": ("od", float)},
+    }
+
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            current_section = ""
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("//"):
+                    continue
+
+                if line.startswith('['):
+                    current_section = line
+                    continue
+
+                if current_section == "[HitObjects]":
+                    parts = line.split(',')
+                    if len(parts) < 4:
+                        continue
+                    object_type = int(parts[3])
+                    if object_type & 1:
+                        data["num_hitcircles"] += 1
+                    elif object_type & (2 | 128):  # Sliders and mania hold notes
+                        data["num_sliders"] += 1
+                    elif object_type & 8:
+                        data["num_spinners"] += 1
+                elif current_section in keys and ':' in line:
+                    key, value = line.split(':', 1)
+                    target = keys[current_section].get(key.strip())
+                    if target:
+                        field, convert = target
+                        data[field] = convert(value.strip())
+    except Exception as e:
+        logging.warning(f"Could not read beatmap metadata from {file_path}: {e}")
+        return None
+
+    # Old formats have no ApproachRate line; osu! then uses the OD.
+    if data["ar"] is None:
+        data["ar"] = data["od"]
+    return data
+
 def calculate_difficulty(osu_file_path, mods=0):
     """Calculates difficulty attributes (e.g., stars) for a beatmap with given mods."""
+    # rosu-pp is imported on first use so that starting the app does not load it.
+    import rosu_pp_py
     try:
         beatmap = rosu_pp_py.Beatmap(path=osu_file_path)
         diff_calc = rosu_pp_py.Difficulty(mods=mods)
@@ -289,6 +367,7 @@ def calculate_difficulty(osu_file_path, mods=0):
 
 def calculate_pp(osu_file_path, replay_data):
     """Calculates PP and star rating for a given play using rosu-pp-py."""
+    import rosu_pp_py
     try:
         # Parse the beatmap file
         beatmap = rosu_pp_py.Beatmap(path=osu_file_path)
@@ -329,4 +408,48 @@ def calculate_pp(osu_file_path, replay_data):
     except Exception as e:
         # Return default values if calculation fails for any reason
         logging.error(f"Could not calculate PP for {osu_file_path}: {e}", exc_info=True)
-        return {"pp": None, "stars": None, "map_max_combo": None, "aim": None, "speed": None, "slider_factor": None}
\ No newline at end of file
+        return {"pp": None, "stars": None, "map_max_combo": None, "aim": None, "speed": None, "slider_factor": None}
+
+def calculate_pp_batch(osu_file_path, mods, replays):
+    """
+    Calculates PP for several plays of the same beatmap and mods. The beatmap
+    is parsed and its difficulty calculated once; returns a list of pp dicts
+    (see calculate_pp), each with the replay_md5 of its play.
+    """
+    import rosu_pp_py
+    try:
+        beatmap = rosu_pp_py.Beatmap(path=osu_file_path)
+        diff_attrs = rosu_pp_py.Difficulty(mods=mods).calculate(beatmap)
+    except Exception as e:
+        logging.error(f"Could not calculate difficulty for {osu_file_path} with mods {mods}: {e}", exc_info=False)
+        return []
+
+    results = []
+    for replay_data in replays:
+        try:
+            perf_calc = rosu_pp_py.Performance(
+                n300=replay_data.get('num_300s'),
+                n100=replay_data.get('num_100s'),
+                n50=replay_data.get('num_50s'),
+                n_geki=replay_data.get('num_gekis'),
+                n_katu=replay_data.get('num_katus'),
+                misses=replay_data.get('num_misses'),
+                combo=replay_data.get('max_combo'),
+            )
+            perf_attrs = perf_calc.calculate(diff_attrs)
+            results.append({
+                "replay_md5": replay_data.get('replay_md5'),
+                "pp": perf_attrs.pp,
+                "stars": perf_attrs.difficulty.stars,
+                "aim": perf_attrs.difficulty.aim,
+                "speed": perf_attrs.difficulty.speed,
+                "slider_factor": perf_attrs.difficulty.slider_factor,
+                "speed_note_count": perf_attrs.difficulty.speed_note_count,
+                "aim_difficult_strain_count": perf_attrs.difficulty.aim_difficult_strain_count,
+                "speed_difficult_strain_count": perf_attrs.difficulty.speed_difficult_strain_count,
+                "aim_difficult_slider_count": perf_attrs.difficulty.aim_difficult_slider_count,
+                "map_max_combo": perf_attrs.difficulty.max_combo,
+            })
+        except Exception as e:
+            logging.error(f"Could not calculate PP for replay {replay_data.get('replay_md5')}: {e}", exc_info=False)
+    return results
\ No newline at end of file
@@ -0,0 +1,226 @@
+"""
+Opt-in profiling of API requests and background jobs.
+
+Profiling is off by default. With PROFILE_ENABLED=1 (or after turning it on
+through POST /api/profiles), every job type and /api path listed in
+PROFILE_TARGETS is profiled. A single job run or request can also be
+profiled on its own: profile_next(job_type) before submitting the job, or
+?profile=1 on a request.
+
+- Requests run on one thread and are profiled with cProfile, written as .prof
+  files (open them with pstats, snakeviz, etc.). Only one cProfile profile
+  can be active at a time (per process on Python 3.12+), so a request or job
+  that overlaps another one is run without profiling.
+- Jobs spread their work over thread pools, which cProfile cannot follow. By
+  default they are profiled by sampling the stacks of every thread every
+  PROFILE_SAMPLE_INTERVAL_MS, written as .collapsed.txt files (one
+  "thread;frame;frame count" line per stack, the input format of flame
+  graph tools). PROFILE_MODE=deterministic uses cProfile on the job thread
+  instead.
+
+Profiles are written to a "profiles" folder next to the database. Only the
+newest PROFILE_MAX_FILES are kept.
+"""
+import os
+import re
+import sys
+import time
+import pstats
+import logging
+import cProfile
+import threading
+import contextlib
+from collections import Counter
+
+import database
+
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '20'))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '5'))
+PROFILE_FOLDER_NAME = 'profiles'
+PROFILE_EXTENSIONS = ('.prof', '.collapsed.txt')
+
+_settings = {
+    "enabled": os.getenv('PROFILE_ENABLED', '0') == '1',
+    "mode": os.getenv('PROFILE_MODE', 'sampling'),
+    "targets": [target.strip() for target in os.getenv('PROFILE_TARGETS', 'sync,scan,recompute,/api/recommend').split(',')
+                if target.strip()],
+}
+_armed_jobs = set()
+_lock = threading.Lock()
+_cprofile_lock = threading.Lock()  # held while a cProfile profile is active
+
+def get_settings():
+    with _lock:
+        return {**_settings, "targets": list(_settings["targets"]), "armed": sorted(_armed_jobs)}
+
+def update_settings(enabled=None, mode=None, targets=None):
+    """Changes the profiling settings at runtime (not persisted; the .env values apply again after a restart)."""
+    if mode is not None and mode not in ('sampling', 'deterministic'):
+        raise ValueError("mode must be 'sampling' or 'deterministic'.")
+    with _lock:
+        if enabled is not None:
+            _settings["enabled"] = bool(enabled)
+        if mode is not None:
+            _settings["mode"] = mode
+        if targets is not None:
+            _settings["targets"] = [str(target).strip() for target in targets if str(target).strip()]
+
+def profile_next(job_type):
+    """Profiles the next run of job_type, whether or not profiling is enabled."""
+    with _lock:
+        _armed_jobs.add(job_type)
+
+def disarm(job_type):
+    with _lock:
+        _armed_jobs.discard(job_type)
+
+def _should_profile_job(job_type):
+    with _lock:
+        if job_type in _armed_jobs:
+            _armed_jobs.discard(job_type)
+            return True
+        return _settings["enabled"] and job_type in _settings["targets"]
+
+def _should_profile_request(path, requested):
+    if requested:
+        return True
+    with _lock:
+        return _settings["enabled"] and any(
+            target.startswith('/') and path.startswith(target) for target in _settings["targets"]
+        )
+
+def get_profile_dir():
+    """The folder holding the profiles, next to the database file."""
+    return os.path.join(os.path.dirname(os.path.abspath(database.DATABASE_FILE)), PROFILE_FOLDER_NAME)
+
+def list_profiles():
+    """Returns the saved profiles, newest first, as [{"name", "size", "created"}]."""
+    folder = get_profile_dir()
+    if not os.path.isdir(folder):
+        return []
+    profiles = []
+    for entry in os.scandir(folder):
+        if entry.is_file() and entry.name.endswith(PROFILE_EXTENSIONS):
+            stat = entry.stat()
+            profiles.append({"name": entry.name, "size": stat.st_size, "created": stat.st_mtime})
+    return sorted(profiles, key=lambda profile: profile["created"], reverse=True)
+
+def _rotate(folder):
+    for profile in list_profiles()[PROFILE_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(folder, profile["name"]))
+        except OSError as e:
+            logging.warning(f"Could not remove old profile {profile['name']}: {e}")
+
+def _new_profile_path(label, extension):
+    folder = get_profile_dir()
+    os.makedirs(folder, exist_ok=True)
+    safe_label = re.sub(r'[^A-Za-z0-9_.-]+', '_', label).strip('_')
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    return os.path.join(folder, f"{stamp}-{int(time.time() * 1000) % 1000:03d}-{safe_label}{extension}")
+
+class SamplingProfiler:
+    """Periodically records the Python stack of every thread and counts identical stacks."""
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler-sampler', daemon=True)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+def _start_cprofile():
+    """Starts a cProfile profiler, or returns None if another one is already active."""
+    if not _cprofile_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiling tool (a debugger, coverage, ...) holds the profiling hook.
+        _cprofile_lock.release()
+        return None
+    return profiler
+
+@contextlib.contextmanager
+def _profile(label, mode):
+    """Profiles the enclosed block and saves the result. Failures to write are logged, never raised."""
+    if mode == 'sampling':
+        profiler = SamplingProfiler(PROFILE_SAMPLE_INTERVAL_MS / 1000)
+        profiler.start()
+    else:
+        profiler = _start_cprofile()
+        if profiler is None:
+            logging.info(f"Not profiling {label}: another deterministic profile is active.")
+            yield
+            return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if mode == 'sampling':
+            profiler.stop()
+        else:
+            profiler.disable()
+            _cprofile_lock.release()
+        try:
+            path = _new_profile_path(label, '.collapsed.txt' if mode == 'sampling' else '.prof')
+            if mode == 'sampling':
+                profiler.write(path)
+            else:
+                pstats.Stats(profiler).dump_stats(path)
+            _rotate(os.path.dirname(path))
+            logging.info(f"Profile of {label} ({time.perf_counter() - start:.2f} s) saved to {path}")
+        except Exception as e:
+            logging.error(f"Could not save profile of {label}: {e}", exc_info=True)
+
+def profile_job(job_type):
+    """Context manager the scheduler wraps around each job run; a no-op unless that job should be profiled."""
+    if not _should_profile_job(job_type):
+        return contextlib.nullcontext()
+    with _lock:
+        mode = _settings["mode"]
+    return _profile(f"job-{job_type}", mode)
+
+def install(app, blueprint_name='api'):
+    """Registers the request hooks that profile matching /api requests."""
+    from flask import g, request
+
+    @app.before_request
+    def start_request_profile():
+        if request.blueprint != blueprint_name:
+            return
+        if _should_profile_request(request.path, request.args.get('profile') == '1'):
+            g.request_profile = _profile(f"{request.method}-{request.path}", 'deterministic')
+            g.request_profile.__enter__()
+
+    @app.teardown_request
+    def finish_request_profile(error=None):
+        profile = g.pop('request_profile', None)
+        if profile is not None:
+            profile.__exit__(None, None, None)
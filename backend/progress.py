@@ -0,0 +1,236 @@
+"""
+Thread-safe progress tracking for background tasks.
+
+Workers report through TaskProgress methods instead of writing into a shared
+dict, and readers only ever see consistent snapshots. Every change bumps a
+version number so listeners (the SSE progress stream) can block until there
+is something new to send instead of polling.
+
+Besides the sequential stages shown to the user, a task can record timings
+(wall time and items of work that may overlap the stages or run on several
+threads, e.g. rosu calculation or database writes) and queue depths (items
+waiting between two steps). Both are part of the snapshot and of the run
+history kept by the tracker's on_finish callback.
+"""
+import time
+import logging
+import threading
+import contextlib
+
+class TaskProgress:
+    """Progress of one background task: its current stage, counters, throughput and errors."""
+    def __init__(self, tracker, name, extra_fields=None):
+        self._tracker = tracker
+        self.name = name
+        self._extra_defaults = dict(extra_fields or {})
+        self._reset('idle', '')
+
+    def _reset(self, status, message, **fields):
+        now = time.monotonic()
+        self._state = {
+            "status": status, "current": 0, "total": 0, "message": message,
+            "batches_done": 0, "errors": 0, "last_error": None, "stage": None,
+            **self._extra_defaults, **fields
+        }
+        self._started_at = now
+        self._finished_at = None
+        self._stages = []  # [{"name", "current", "total", "started_at", "ended_at"}]
+        self._timings = {}  # name -> {"seconds", "items", "calls"}
+        self._queues = {}  # name -> {"depth", "max"}
+
+    def _current_stage(self):
+        return self._stages[-1] if self._stages else None
+
+    # --- Writers (called from worker threads) ---
+
+    def start(self, message, **fields):
+        """Marks the task as running and clears the counters of the previous run."""
+        with self._tracker._changed:
+            self._reset('running', message, **fields)
+            self._tracker._bump()
+
+    def claim(self, message=''):
+        """Atomically marks an idle task as running. Returns False if it is already running."""
+        with self._tracker._changed:
+            if self._state['status'] == 'running':
+                return False
+            self._reset('running', message)
+            self._tracker._bump()
+            return True
+
+    def begin_stage(self, stage, total, message=None):
+        """Starts a new stage; current restarts at 0 and throughput is measured per stage."""
+        with self._tracker._changed:
+            now = time.monotonic()
+            previous = self._current_stage()
+            if previous and previous['ended_at'] is None:
+                previous['ended_at'] = now
+            self._stages.append({"name": stage, "current": 0, "total": total, "started_at": now, "ended_at": None})
+            self._state.update(stage=stage, current=0, total=total)
+            if message is not None:
+                self._state['message'] = message
+            self._tracker._bump()
+
+    def update(self, **fields):
+        """Sets any fields (message, current, total or task-specific extras)."""
+        with self._tracker._changed:
+            self._state.update(fields)
+            stage = self._current_stage()
+            if stage:
+                stage['current'] = self._state['current']
+                stage['total'] = self._state['total']
+            self._tracker._bump()
+
+    def advance(self, count=1, message=None):
+        """Adds count processed items to the current stage."""
+        with self._tracker._changed:
+            self._state['current'] += count
+            stage = self._current_stage()
+            if stage:
+                stage['current'] = self._state['current']
+            if message is not None:
+                self._state['message'] = message
+            self._tracker._bump()
+
+    def batch_done(self, message=None):
+        """Records a completed database write."""
+        with self._tracker._changed:
+            self._state['batches_done'] += 1
+            if message is not None:
+                self._state['message'] = message
+            self._tracker._bump()
+
+    def record_error(self, error):
+        """Counts a per-item failure that did not stop the task."""
+        with self._tracker._changed:
+            self._state['errors'] += 1
+            self._state['last_error'] = str(error)
+            self._tracker._bump()
+
+    def add_timing(self, name, seconds, items=0):
+        """Adds seconds and items to the named timing. Does not notify listeners; the next update carries it."""
+        with self._tracker._changed:
+            timing = self._timings.setdefault(name, {"seconds": 0.0, "items": 0, "calls": 0})
+            timing['seconds'] += seconds
+            timing['items'] += items
+            timing['calls'] += 1
+
+    @contextlib.contextmanager
+    def measure(self, name, items=0):
+        """Adds the duration of the enclosed block (and items) to the named timing. Safe from any thread."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(name, time.perf_counter() - start, items)
+
+    def set_queue_depth(self, name, depth):
+        """Records how many items currently wait in the named queue, keeping the run's maximum."""
+        with self._tracker._changed:
+            queue = self._queues.setdefault(name, {"depth": 0, "max": 0})
+            queue['depth'] = depth
+            queue['max'] = max(queue['max'], depth)
+
+    def finish(self, message, status='complete'):
+        """Ends the run with 'complete', 'cancelled' or 'error'."""
+        with self._tracker._changed:
+            now = time.monotonic()
+            stage = self._current_stage()
+            if stage and stage['ended_at'] is None:
+                stage['ended_at'] = now
+            self._finished_at = now
+            self._state.update(status=status, message=message)
+            for queue in self._queues.values():
+                queue['depth'] = 0
+            self._tracker._bump()
+            snapshot = self.snapshot()
+        if self._tracker.on_finish:
+            try:
+                self._tracker.on_finish(self.name, snapshot)
+            except Exception as e:
+                logging.warning(f"Could not record the run of task '{self.name}': {e}")
+
+    def fail(self, error, message):
+        """Ends the run with an error status."""
+        with self._tracker._changed:
+            self._state['errors'] += 1
+            self._state['last_error'] = str(error)
+        self.finish(message, status='error')
+
+    # --- Readers ---
+
+    def __getitem__(self, key):
+        with self._tracker._changed:
+            return self._state[key]
+
+    def get(self, key, default=None):
+        with self._tracker._changed:
+            return self._state.get(key, default)
+
+    def snapshot(self):
+        """Returns a consistent copy of the progress, with throughput (items/s) and ETA (s) per stage."""
+        with self._tracker._changed:
+            now = time.monotonic()
+            data = dict(self._state)
+            end = self._finished_at or now
+            data['elapsed'] = round(end - self._started_at, 1) if data['status'] != 'idle' else 0.0
+
+            stages = []
+            for stage in self._stages:
+                seconds = (stage['ended_at'] or now) - stage['started_at']
+                throughput = stage['current'] / seconds if seconds > 0 else 0.0
+                stages.append({
+                    "name": stage['name'], "current": stage['current'], "total": stage['total'],
+                    "seconds": round(seconds, 1), "throughput": round(throughput, 1)
+                })
+            data['stages'] = stages
+            # Timings may overlap each other and the stages, and add up time spent on several threads.
+            data['timings'] = [
+                {"name": name, "seconds": round(timing['seconds'], 3), "items": timing['items'],
+                 "calls": timing['calls'],
+                 "throughput": round(timing['items'] / timing['seconds'], 1) if timing['seconds'] > 0 else 0.0}
+                for name, timing in self._timings.items()
+            ]
+            data['queues'] = {name: dict(queue) for name, queue in self._queues.items()}
+
+            current_stage = stages[-1] if stages else None
+            data['throughput'] = current_stage['throughput'] if current_stage else 0.0
+            remaining = data['total'] - data['current']
+            if data['status'] == 'running' and data['throughput'] > 0 and remaining > 0:
+                data['eta'] = round(remaining / data['throughput'], 1)
+            else:
+                data['eta'] = None
+            return data
+
+class ProgressTracker:
+    """
+    The set of tracked tasks, indexable by task name. on_finish, if given, is
+    called as on_finish(task name, snapshot) after every finished run, outside
+    the lock.
+    """
+    def __init__(self, tasks, on_finish=None):
+        self._changed = threading.Condition(threading.RLock())
+        self.version = 0
+        self.on_finish = on_finish
+        self._tasks = {name: TaskProgress(self, name, extra) for name, extra in tasks.items()}
+
+    def _bump(self):
+        self.version += 1
+        self._changed.notify_all()
+
+    def __getitem__(self, name):
+        return self._tasks[name]
+
+    def __contains__(self, name):
+        return name in self._tasks
+
+    def snapshot(self):
+        """Returns {task name: snapshot} for every task."""
+        with self._changed:
+            return {name: task.snapshot() for name, task in self._tasks.items()}
+
+    def wait_for_change(self, since_version, timeout=None):
+        """Blocks until the version differs from since_version or the timeout passes; returns the current version."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != since_version, timeout=timeout)
+            return self.version
@@ -0,0 +1,178 @@
+"""
+Star-rating curves over a small grid of playback rates.
+
+Sync evaluates each beatmap at every rate in RATE_GRID and stores the stars,
+aim and speed values as packed float32 blobs. Questions like "stars at 1.15x"
+or "which map and rate hit 6.0*" are then answered by interpolating the
+stored curves, without calling rosu for each map. Beatmaps rosu cannot
+evaluate get an empty curve, so that sync does not retry them; it is left
+out of the index.
+"""
+import bisect
+import logging
+import random
+import threading
+from array import array
+
+import database
+import mod_utils
+
+# Playback rates evaluated during sync. Must stay sorted; changing it
+# requires recomputing the stored curves.
+RATE_GRID = (0.75, 0.85, 1.0, 1.1, 1.2, 1.3, 1.4, 1.5)
+CURVE_ATTRIBUTES = ('stars', 'aim', 'speed')
+
+def pack_curve(values):
+    """Packs a sequence of floats aligned with RATE_GRID into a compact blob."""
+    return array('f', values).tobytes()
+
+def unpack_curve(blob):
+    """Unpacks a blob written by pack_curve into an array of floats."""
+    values = array('f')
+    values.frombytes(blob)
+    return values
+
+def calculate_rate_curve(rosu_map, md5):
+    """Calculates the stars/aim/speed curve of a parsed rosu beatmap over RATE_GRID."""
+    import rosu_pp_py
+    curve = {'md5_hash': md5, 'stars': [], 'aim': [], 'speed': []}
+    for rate in RATE_GRID:
+        diff_attrs = rosu_pp_py.Difficulty(clock_rate=rate).calculate(rosu_map)
+        curve['stars'].append(diff_attrs.stars)
+        curve['aim'].append(diff_attrs.aim or 0.0)
+        curve['speed'].append(diff_attrs.speed or 0.0)
+    return curve
+
+def failed_curve(md5):
+    """The empty curve stored for a beatmap whose curve could not be calculated."""
+    return {'md5_hash': md5, **{attr: [] for attr in CURVE_ATTRIBUTES}}
+
+def interpolate(values, rate):
+    """Linearly interpolates a curve at the given rate, clamped to the grid bounds."""
+    if rate <= RATE_GRID[0]:
+        return values[0]
+    if rate >= RATE_GRID[-1]:
+        return values[-1]
+    i = bisect.bisect_right(RATE_GRID, rate)
+    r0, r1 = RATE_GRID[i - 1], RATE_GRID[i]
+    t = (rate - r0) / (r1 - r0)
+    return values[i - 1] + (values[i] - values[i - 1]) * t
+
+def solve_rate(values, target, min_rate=RATE_GRID[0], max_rate=RATE_GRID[-1]):
+    """
+    Returns the lowest rate within [min_rate, max_rate] at which the curve
+    reaches `target`, or None if it never does in that range.
+    """
+    for i in range(1, len(RATE_GRID)):
+        lo, hi = values[i - 1], values[i]
+        if (lo - target) * (hi - target) > 0 or lo == hi:
+            continue
+        r0, r1 = RATE_GRID[i - 1], RATE_GRID[i]
+        rate = r0 + (target - lo) / (hi - lo) * (r1 - r0)
+        if min_rate <= rate <= max_rate:
+            return rate
+    return None
+
+class RateCurveIndex:
+    """
+    An in-memory, column-oriented copy of every stored curve. Each grid rate
+    has its own array of star values, so a library-wide query is a single
+    pass over flat arrays.
+    """
+    def __init__(self, rows):
+        self.md5s = []
+        self.bpms = array('d')
+        self.columns = {attr: [array('f') for _ in RATE_GRID] for attr in CURVE_ATTRIBUTES}
+        self.positions = {}
+
+        for row in rows:
+            self.positions[row['md5_hash']] = len(self.md5s)
+            self.md5s.append(row['md5_hash'])
+            self.bpms.append(row['bpm'] or 0.0)
+            for attr in CURVE_ATTRIBUTES:
+                values = unpack_curve(row[attr])
+                for g, column in enumerate(self.columns[attr]):
+                    column.append(values[g])
+
+    def __len__(self):
+        return len(self.md5s)
+
+    def curve(self, md5, attr='stars'):
+        """Returns the curve of one beatmap as a list, or None if it is not indexed."""
+        pos = self.positions.get(md5)
+        if pos is None:
+            return None
+        return [column[pos] for column in self.columns[attr]]
+
+    def value_at(self, md5, rate, attr='stars'):
+        """Returns the interpolated attribute of a beatmap at the given rate."""
+        values = self.curve(md5, attr)
+        return interpolate(values, rate) if values is not None else None
+
+    def find_candidates(self, target_sr, max_bpm, min_rate=RATE_GRID[0], max_rate=RATE_GRID[-1], excluded_ids=()):
+        """Returns [(md5, rate)] for every beatmap that reaches target_sr within the rate and BPM limits."""
+        excluded = set(excluded_ids)
+        stars = self.columns['stars']
+        lowest, highest = stars[0], stars[-1]
+        candidates = []
+        for pos, md5 in enumerate(self.md5s):
+            # Curves rise with rate, so the grid endpoints rule out most maps cheaply.
+            if lowest[pos] > target_sr or highest[pos] < target_sr or md5 in excluded:
+                continue
+            rate = solve_rate([column[pos] for column in stars], target_sr, min_rate, max_rate)
+            if rate is None or self.bpms[pos] * rate > max_bpm:
+                continue
+            candidates.append((md5, rate))
+        return candidates
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index():
+    """Returns the shared curve index, loading it from the database on first use."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = RateCurveIndex(database.get_rate_curve_rows())
+            logging.info(f"Loaded {len(_index)} rate curves into memory.")
+        return _index
+
+def invalidate_index():
+    """Drops the shared index so the next query reloads it."""
+    global _index
+    with _index_lock:
+        _index = None
+
+def save_curves(curves):
+    """Stores a batch of calculated curves and invalidates the shared index."""
+    if not curves:
+        return
+    database.add_rate_curves([
+        {'md5_hash': c['md5_hash'], **{attr: pack_curve(c[attr]) for attr in CURVE_ATTRIBUTES}}
+        for c in curves
+    ])
+    invalidate_index()
+
+def recommend_with_rate(target_sr, max_bpm, min_rate=RATE_GRID[0], max_rate=RATE_GRID[-1], excluded_ids=()):
+    """
+    Picks a random osu!standard beatmap together with the playback rate that
+    brings it to target_sr. Returns the beatmap with its attributes adjusted
+    to that rate, or None.
+    """
+    index = get_index()
+    candidates = index.find_candidates(target_sr, max_bpm, min_rate, max_rate, excluded_ids)
+    if not candidates:
+        logging.warning("No map found matching rate criteria.")
+        return None
+
+    md5, rate = random.choice(candidates)
+    beatmap = database.get_beatmap_by_md5(md5)
+    if not beatmap:
+        return None
+
+    beatmap.update(mod_utils.apply_mods(beatmap, mod_utils.NO_MOD, clock_rate=rate))
+    beatmap['rate'] = round(rate, 2)
+    for attr in CURVE_ATTRIBUTES:
+        beatmap[attr] = round(index.value_at(md5, rate, attr), 2)
+    logging.info(f"Found rate recommendation: {beatmap['title']} at {beatmap['rate']}x, {beatmap['stars']}*")
+    return beatmap
@@ -0,0 +1,74 @@
+"""
+Headless mode: runs the API, the filesystem watcher and the job system
+without a pywebview window, e.g. as a daemon on a home server that has a
+synced copy of the osu! folder.
+
+    python backend/service.py --host 0.0.0.0 --port 5000 --threads 8
+
+The frontend is served at the same address; browsers receive new replays over
+/api/events (see notifier.py). SIGTERM or SIGINT shuts down gracefully: the
+server stops accepting requests, replays the watcher already detected are
+still ingested, and bulk jobs are interrupted so that they resume from their
+checkpoint on the next start. A second signal exits right away.
+
+Every open page holds two event streams (progress and /api/events), each on
+a server thread. At most half of --threads serve streams; further pages
+retry until a stream ends (after STREAM_MAX_SECONDS), so raise --threads
+for the number of browsers you expect.
+"""
+# Imported first: startup phases are timed from here.
+import startup
+
+import os
+import sys
+import signal
+import logging
+import argparse
+
+from config import configure_logging, ensure_env_file
+from app import app, SERVER_THREADS, SHUTDOWN_TIMEOUT, start_background_init, stop_background_work
+from api import routes
+
+SERVICE_HOST = os.getenv('SERVICE_HOST', '127.0.0.1')
+SERVICE_PORT = int(os.getenv('SERVICE_PORT', '5000'))
+
+def parse_args(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Runs the osu! tracker without a window.')
+    arg_parser.add_argument('--host', default=SERVICE_HOST, help=f'address to listen on (default {SERVICE_HOST})')
+    arg_parser.add_argument('--port', type=int, default=SERVICE_PORT, help=f'port to listen on (default {SERVICE_PORT})')
+    arg_parser.add_argument('--threads', type=int, default=SERVER_THREADS,
+                            help=f'request worker threads (default {SERVER_THREADS})')
+    arg_parser.add_argument('--shutdown-timeout', type=float, default=SHUTDOWN_TIMEOUT,
+                            help=f'seconds to wait for ingests to drain on shutdown (default {SHUTDOWN_TIMEOUT:.0f})')
+    return arg_parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_logging()
+    startup.mark('imports')
+    ensure_env_file()
+    # There is no window to wait for before the startup report is logged.
+    startup.REPORT_AFTER = {'server listening', 'background init'}
+
+    # Event streams never take more than half of the request threads.
+    routes.MAX_OPEN_STREAMS = int(os.getenv('MAX_OPEN_STREAMS', str(max(1, args.threads // 2))))
+
+    from waitress import create_server
+    server = create_server(app, host=args.host, port=args.port, threads=args.threads)
+    # waitress stops serving on KeyboardInterrupt; SIGTERM is handled like Ctrl+C.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    start_background_init()
+    startup.mark('server listening')
+    logging.info(f"Serving on http://{args.host}:{args.port} with {args.threads} threads. Press Ctrl+C to stop.")
+    server.run()
+
+    # run() returns once interrupted, after in-flight requests were given a few seconds.
+    logging.info("Shutting down...")
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    server.close()
+    return 0 if stop_background_work(args.shutdown_timeout) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,270 @@
+"""
+Sharded beatmap analysis for libraries too large for one machine.
+
+The analysis step of a sync is split by md5 range: shard i of n covers the
+beatmaps whose md5 starts with a 32-bit prefix p where p * n // 2^32 == i,
+so the n shards are contiguous, equally sized ranges. Each shard runs as its
+own worker (shard_task, or `cli.py shard`), possibly on another machine with
+a copy of the osu! folder, and needs no database. It writes a result file: gzipped JSON lines
+with a header, one line per beatmap of its range (the osu!.db metadata plus,
+for analyzed maps, the difficulty, rate curve and mod cache rows) and a
+summary line. Files are written under a temporary name and renamed when
+complete.
+
+merge_task (`cli.py merge`) bulk-loads result files into the database with
+the same upserts a sync uses, so merging a file twice, or merging shards of
+which some maps are already stored, changes nothing. Files written with
+another rosu-pp version or rate grid are rejected. `cli.py sync --shards N`
+runs the whole flow locally: N worker processes, then the merge.
+"""
+import os
+import gzip
+import json
+import logging
+import concurrent.futures
+
+import database
+import parser
+import rate_curves
+import jobs
+import tasks
+
+SHARD_FORMAT = 'osu-tracker-shard'
+SHARD_FORMAT_VERSION = 1
+SHARD_FILE_SUFFIX = '.jsonl.gz'
+MERGE_BATCH_SIZE = 1000
+_PREFIX_SPACE = 2 ** 32
+
+def shard_range(index, count):
+    """Returns the [start, end) range of 32-bit md5 prefixes covered by shard index of count."""
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Shard index must be between 0 and {count - 1}.")
+    return -(-index * _PREFIX_SPACE // count), -(-(index + 1) * _PREFIX_SPACE // count)
+
+def shard_of(md5, count):
+    """Returns the index of the shard a beatmap md5 belongs to (0 for a malformed md5)."""
+    try:
+        return int(md5[:8], 16) * count // _PREFIX_SPACE
+    except ValueError:
+        return 0
+
+def shard_file_name(index, count):
+    return f"shard-{index:03d}-of-{count:03d}{SHARD_FILE_SUFFIX}"
+
+def _compact(row):
+    """Drops empty values, which the upserts treat like missing ones anyway."""
+    return {key: value for key, value in row.items() if value is not None and value != {}}
+
+def shard_task(shard_index, shard_count, output_path, workers=None, only_new=False, job=None):
+    """
+    Analyzes the beatmaps of one shard and writes its result file. With
+    only_new, beatmaps the local database already analyzed are written with
+    their metadata only, as a sync would skip them.
+    """
+    job = job or jobs.detached()
+    progress = tasks.TASK_PROGRESS['shard']
+    progress.start(f'Starting shard {shard_index + 1}/{shard_count}...', shard=shard_index)
+    temp_path = f"{output_path}.tmp"
+
+    try:
+        osu_folder = os.getenv('OSU_FOLDER')
+        if not osu_folder: raise ValueError("OSU_FOLDER environment variable is not set.")
+        db_path = os.path.join(osu_folder, 'osu!.db')
+        songs_path = os.path.join(osu_folder, 'Songs')
+        if not os.path.exists(db_path): raise FileNotFoundError(f"osu!.db not found at {db_path}")
+        start, end = shard_range(shard_index, shard_count)
+
+        progress.begin_stage('read', 0, message='Reading beatmap library (osu!.db)...')
+        db_stat = os.stat(db_path)
+        beatmaps = {md5: data for md5, data in parser.parse_osu_db(db_path).items()
+                    if shard_of(md5, shard_count) == shard_index}
+        progress.update(current=len(beatmaps), total=len(beatmaps))
+        job.check()
+
+        known_md5s = set()
+        if only_new:
+            known_md5s = database.get_processed_beatmap_hashes() & database.get_rate_curve_hashes()
+        items_to_process = [(md5, data) for md5, data in beatmaps.items()
+                            if md5 not in known_md5s and data.get('game_mode') == 0]
+
+        progress.begin_stage('verify', len(items_to_process), message=f"Verifying {len(items_to_process)} beatmap files...")
+        verified_items = tasks.verify_beatmap_files(items_to_process, songs_path, job, progress)
+        verified_md5s = {md5 for md5, _, _ in verified_items}
+
+        header = {
+            "format": SHARD_FORMAT, "version": SHARD_FORMAT_VERSION, "shard": shard_index, "shards": shard_count,
+            "md5_range": [f"{start:08x}", f"{end - 1:08x}"], "beatmaps": len(beatmaps), "calc_version": parser.CALC_VERSION,
+            "rate_grid": list(rate_curves.RATE_GRID), "osu_db": [db_stat.st_size, db_stat.st_mtime_ns],
+        }
+        analyzed = 0
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as f:
+            f.write(json.dumps(header) + '\n')
+            # Metadata of everything in range that is not analyzed here, like the first step of a full sync.
+            for md5, data in beatmaps.items():
+                if md5 not in verified_md5s:
+                    f.write(json.dumps({"md5": md5, "beatmap": _compact(data)}) + '\n')
+
+            total = len(verified_items)
+            progress.begin_stage('analyze', total, message=f"Analyzing {total} beatmaps...")
+
+            def analyze(*args):
+                with progress.measure('analysis', 1):
+                    return tasks.process_osu_file_and_cache(*args)
+
+            work = ((md5, (osu_path, bmap.get('bpm', 0), md5)) for md5, bmap, osu_path in verified_items)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                results = jobs.run_bounded(executor, analyze, work, job,
+                                           on_depth=lambda depth: progress.set_queue_depth('in flight', depth))
+                for done, (md5, future) in enumerate(results, start=1):
+                    progress.advance(message=f"Analyzing beatmaps ({done}/{total})")
+                    line = {"md5": md5, "beatmap": _compact(beatmaps[md5])}
+                    try:
+                        md5, result_data, mod_caches, rate_curve = future.result()
+                        if result_data:
+                            line["beatmap"].update(_compact(result_data))
+                            analyzed += 1
+                        if mod_caches:
+                            line["mod_cache"] = mod_caches
+                        if rate_curve:
+                            line["rate_curve"] = {attr: rate_curve[attr] for attr in rate_curves.CURVE_ATTRIBUTES}
+                    except Exception as e:
+                        logging.error(f"Error processing beatmap future for md5 {md5}: {e}", exc_info=True)
+                        progress.record_error(e)
+                    f.write(json.dumps(line) + '\n')
+
+            f.write(json.dumps({"summary": {"beatmaps": len(beatmaps), "analyzed": analyzed}}) + '\n')
+        os.replace(temp_path, output_path)
+
+        progress.finish(f"Shard {shard_index + 1}/{shard_count}: analyzed {analyzed} of {len(beatmaps)} beatmaps "
+                        f"into {output_path}.")
+    except jobs.JobCancelled:
+        _remove(temp_path)
+        progress.finish('Shard cancelled. No result file was written.', status='cancelled')
+        raise
+    except Exception as e:
+        _remove(temp_path)
+        logging.error(f"Error in shard task: {e}", exc_info=True)
+        progress.fail(e, f'Shard failed: {e}')
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def read_shard_header(path):
+    """Returns the header of a result file. Raises ValueError if it is not one or cannot be merged here."""
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+    except (OSError, ValueError) as e:
+        raise ValueError(f"{path} is not a shard result file: {e}")
+    if header.get('format') != SHARD_FORMAT or header.get('version') != SHARD_FORMAT_VERSION:
+        raise ValueError(f"{path} is not a version {SHARD_FORMAT_VERSION} shard result file.")
+    if header.get('calc_version') != parser.CALC_VERSION:
+        raise ValueError(f"{path} was calculated with {header.get('calc_version')}, this installation uses "
+                         f"{parser.CALC_VERSION}. Run that shard again with this version.")
+    if header.get('rate_grid') != list(rate_curves.RATE_GRID):
+        raise ValueError(f"{path} was calculated with a different rate grid.")
+    return header
+
+def _load_shard_file(path, batch_size, job, progress):
+    """
+    Upserts the rows of one result file in batches. Returns (beatmaps,
+    analyzed, problem): the rows merged and, for a damaged or truncated
+    file, what is wrong with it (None otherwise).
+    """
+    beatmap_batch, mod_cache_batch, curve_batch = {}, [], []
+    beatmap_count = analyzed = 0
+
+    def save_batch():
+        nonlocal beatmap_batch, mod_cache_batch, curve_batch
+        with progress.measure('db flush', len(beatmap_batch)):
+            if beatmap_batch:
+                database.add_or_update_beatmaps(beatmap_batch)
+            if mod_cache_batch:
+                database.add_beatmap_mod_cache(mod_cache_batch)
+            rate_curves.save_curves(curve_batch)
+        progress.batch_done()
+        beatmap_batch, mod_cache_batch, curve_batch = {}, [], []
+
+    summary = None
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            f.readline()  # The header, validated by read_shard_header.
+            for line in f:
+                row = json.loads(line)
+                if 'summary' in row:
+                    summary = row['summary']
+                    break
+                beatmap_batch[row['md5']] = row['beatmap']
+                mod_cache_batch.extend(row.get('mod_cache', ()))
+                if 'rate_curve' in row:
+                    curve_batch.append({'md5_hash': row['md5'], **row['rate_curve']})
+                    analyzed += 1
+                beatmap_count += 1
+                progress.advance()
+                if len(beatmap_batch) >= batch_size:
+                    job.check()
+                    save_batch()
+    except (EOFError, OSError, ValueError) as e:
+        # Rows read so far are complete; loading them again later is harmless.
+        save_batch()
+        return beatmap_count, analyzed, f"{path} is damaged or incomplete ({e}); {beatmap_count} rows were merged."
+    save_batch()
+    if summary is None or summary.get('beatmaps') != beatmap_count:
+        return beatmap_count, analyzed, f"{path} is incomplete; {beatmap_count} rows were merged."
+    return beatmap_count, analyzed, None
+
+def merge_task(paths, batch_size=None, follow_ups=True, job=None):
+    """
+    The task that bulk-loads shard result files into the database, then
+    queues the sync follow-ups (unless follow_ups is False).
+    """
+    job = job or jobs.detached()
+    progress = tasks.TASK_PROGRESS['merge']
+    progress.start(f'Checking {len(paths)} shard result files...', files=len(paths))
+    batch_size = batch_size or MERGE_BATCH_SIZE
+
+    try:
+        progress.begin_stage('validate', len(paths))
+        headers = {}
+        for path in paths:
+            headers[path] = read_shard_header(path)
+            progress.advance()
+
+        shard_counts = {header['shards'] for header in headers.values()}
+        if len(shard_counts) > 1:
+            raise ValueError(f"The files belong to different shardings ({sorted(shard_counts)} shards).")
+        if len({tuple(header['osu_db']) for header in headers.values()}) > 1:
+            logging.warning("The shard files were made from different copies of osu!.db.")
+        shard_count = shard_counts.pop() if shard_counts else 0
+        missing = sorted(set(range(shard_count)) - {header['shard'] for header in headers.values()})
+
+        total = sum(header['beatmaps'] for header in headers.values())
+        progress.begin_stage('merge', total, message=f"Merging {len(paths)} shard result files...")
+        merged = analyzed = 0
+        for path in sorted(paths, key=lambda path: headers[path]['shard']):
+            beatmap_count, analyzed_count, problem = _load_shard_file(path, batch_size, job, progress)
+            merged += beatmap_count
+            analyzed += analyzed_count
+            if problem:
+                logging.error(problem)
+                progress.record_error(problem)
+
+        message = f"Merged {merged} beatmaps ({analyzed} analyzed) from {len(paths)} shard files."
+        if missing:
+            message += f" Shards not merged yet: {', '.join(str(index) for index in missing)}."
+        progress.finish(message)
+        if follow_ups:
+            tasks.queue_sync_follow_ups()
+    except jobs.JobCancelled:
+        progress.finish('Merge cancelled. Batches merged so far were saved.', status='cancelled')
+        raise
+    except Exception as e:
+        logging.error(f"Error in merge task: {e}", exc_info=True)
+        progress.fail(e, f'Merge failed: {e}')
+
+jobs.scheduler.register('shard', shard_task, priority=jobs.PRIORITY_USER)
+jobs.scheduler.register('merge', merge_task, priority=jobs.PRIORITY_USER)
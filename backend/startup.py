@@ -0,0 +1,93 @@
+"""
+Startup phase timing and deferred initialization.
+
+The window is shown as soon as the server can serve the frontend. Database
+migrations, resuming interrupted jobs and the filesystem watcher start
+afterwards on a background thread (start_background_init). /api requests
+that arrive before the database is ready wait for it in wait_for_database;
+static files never do.
+
+Phases are timed from the moment this module is imported, which app.py does
+before any other import. The report is logged once the window has loaded and
+the background steps have finished, and is served at /api/startup.
+"""
+import time
+import logging
+import threading
+
+_started = time.perf_counter()
+_lock = threading.Lock()
+_phases = []  # [{"name", "at"}], at in ms since startup began
+_database = {"status": "ready", "message": "", "error": None}
+# Set unless start_background_init is migrating the database, so tools and
+# tests that never call it do not wait.
+_database_ready = threading.Event()
+_database_ready.set()
+# The report is logged once all of these phases were reached.
+REPORT_AFTER = {'window loaded', 'background init'}
+_reported = False
+
+def mark(phase):
+    """Records that a startup phase was reached."""
+    global _reported
+    at = round((time.perf_counter() - _started) * 1000, 1)
+    with _lock:
+        _phases.append({"name": phase, "at": at})
+        report_due = not _reported and REPORT_AFTER <= {reached['name'] for reached in _phases}
+        _reported = _reported or report_due
+    logging.info(f"Startup: {phase} after {at:.0f} ms")
+    if report_due:
+        log_report()
+
+def report():
+    """Returns the phases reached so far and the database state."""
+    with _lock:
+        return {"phases": [dict(phase) for phase in _phases], "database": dict(_database)}
+
+def log_report():
+    lines = [f"  {phase['at']:>8.0f} ms  {phase['name']}" for phase in report()['phases']]
+    logging.info("Startup phases:\n" + '\n'.join(lines))
+
+def _set_database_state(status, message='', error=None):
+    with _lock:
+        _database.update(status=status, message=message, error=error)
+
+def _on_migration_step(step, total, description):
+    _set_database_state('migrating', f"Step {step}/{total}: {description}")
+
+def start_background_init(init_database, steps=()):
+    """
+    Runs init_database(progress_callback) and then each (phase name, function)
+    in steps on a background thread. A failing step is logged and skipped; if
+    the database cannot be initialized the steps do not run.
+    """
+    _database_ready.clear()
+    _set_database_state('pending')
+
+    def run():
+        try:
+            init_database(progress_callback=_on_migration_step)
+            _set_database_state('ready')
+        except Exception as e:
+            logging.error(f"Database initialization failed: {e}", exc_info=True)
+            _set_database_state('error', 'Database initialization failed.', str(e))
+        finally:
+            _database_ready.set()
+        mark('database ready')
+
+        if _database['status'] == 'ready':
+            for name, step in steps:
+                try:
+                    step()
+                    mark(name)
+                except Exception as e:
+                    logging.error(f"Startup step '{name}' failed: {e}", exc_info=True)
+        mark('background init')
+
+    threading.Thread(target=run, name='startup', daemon=True).start()
+
+def wait_for_database(timeout=None):
+    """Blocks until the database is initialized. Returns the database state (status 'ready' on success)."""
+    _database_ready.wait(timeout)
+    with _lock:
+        return dict(_database)
@@ -1,22 +1,84 @@
 import os
+import time
 import logging
+import threading
 import concurrent.futures
 from flask import jsonify
 
 import database
 import parser
-import rosu_pp_py
+import mod_utils
+import rate_curves
+import osu_file_index
+import maintenance
+import thumbnails
+import jobs
+from progress import ProgressTracker
 from utils import get_safe_join
 
-# Global dictionary to track progress of background tasks.
-# status can be 'idle', 'running', 'complete', 'error'
-TASK_PROGRESS = {
-    "sync": {"status": "idle", "current": 0, "total": 0, "message": "", "batches_done": 0},
-    "scan": {"status": "idle", "current": 0, "total": 0, "message": ""}
-}
+def _record_task_run(name, snapshot):
+    """Stores a finished run with its stages, timings and queue depths in the task_runs history."""
+    stages = snapshot['stages']
+    database.add_task_run(
+        name, snapshot['status'], snapshot['elapsed'], stages[-1]['current'] if stages else 0, snapshot['errors'],
+        {"message": snapshot['message'], "stages": stages, "timings": snapshot['timings'], "queues": snapshot['queues']}
+    )
 
-def process_osu_file_and_cache(osu_file_path, base_bpm, md5):
-    """Helper function to parse a .osu file and pre-calculate modded difficulties."""
+# Progress of background tasks, keyed by task name, with task-specific extra fields.
+# status can be 'idle', 'running', 'complete', 'cancelled', 'error'.
+# Every finished run is added to the task_runs history.
+TASK_PROGRESS = ProgressTracker({
+    "sync": {},
+    "scan": {},
+    "warm": {"mods": None},
+    "recompute": {"calc_version": None},
+    "index": {},
+    "backfill": {"updated": 0, "missing_files": 0, "failed": 0},
+    "backup": {"operation": None},
+    "maintenance": {"regressions": [], "freed_pages": 0},
+    "thumbnails": {"failed": 0},
+    "shard": {"shard": None},
+    "merge": {"files": 0}
+}, on_finish=_record_task_run)
+
+# Budget for a single mod cache warming run. CPU time is measured with
+# process_time, so work done in the worker threads counts against it.
+MOD_CACHE_WARM_CPU_SECONDS = float(os.getenv('MOD_CACHE_WARM_CPU_SECONDS', '120'))
+MOD_CACHE_WARM_MAX_ROWS = int(os.getenv('MOD_CACHE_WARM_MAX_ROWS', '20000'))
+MOD_CACHE_WARM_BATCH_SIZE = 200
+
+# Mod combinations requested by the recommender, served before replay history.
+_requested_warm_mods = []
+_warm_lock = threading.Lock()
+
+def build_mod_cache_entry(md5, mods, diff_attrs):
+    """Builds a beatmap_mod_cache row from rosu difficulty attributes (None marks a failed calculation)."""
+    if diff_attrs is None:
+        return {'md5_hash': md5, 'mods': mods, 'stars': None}
+    # AR/OD/CS/HP/BPM are derived from the base values at query time (see mod_utils).
+    return {
+        'md5_hash': md5,
+        'mods': mods,
+        'stars': round(diff_attrs.stars, 2),
+        'aim': round(diff_attrs.aim, 2) if diff_attrs.aim else None,
+        'speed': round(diff_attrs.speed, 2) if diff_attrs.speed else None,
+        'slider_factor': round(diff_attrs.slider_factor, 2) if diff_attrs.slider_factor else None,
+        'speed_note_count': round(diff_attrs.speed_note_count, 2) if diff_attrs.speed_note_count else None,
+        'aim_difficult_strain_count': round(diff_attrs.aim_difficult_strain_count, 2) if diff_attrs.aim_difficult_strain_count else None,
+        'speed_difficult_strain_count': round(diff_attrs.speed_difficult_strain_count, 2) if diff_attrs.speed_difficult_strain_count else None,
+        'aim_difficult_slider_count': round(diff_attrs.aim_difficult_slider_count, 2) if diff_attrs.aim_difficult_slider_count else None,
+    }
+
+def process_osu_file_and_cache(osu_file_path, base_bpm, md5, mods_to_cache=()):
+    """
+    Helper function to parse a .osu file and calculate its NoMod difficulty
+    and its star-rating curve over rate_curves.RATE_GRID. Modded difficulties
+    are filled lazily by the warmer, but callers may pass mods_to_cache to
+    calculate specific combinations up front. If only the rosu calculations
+    fail, the parsed details are kept and an empty curve is returned so that
+    the map is not analyzed again on every sync.
+    """
+    import rosu_pp_py
     try:
         # Get file-based details like audio/bg filenames and detailed BPM
         details = parser.parse_osu_file(osu_file_path)
@@ -26,160 +88,397 @@ def process_osu_file_and_cache(osu_file_path, base_bpm, md5):
         # Get NoMod difficulty attributes
         nomod_attrs = parser.calculate_difficulty(osu_file_path, mods=0)
         details.update(nomod_attrs)
-        
-        # Pre-calculate difficulty for common mod combinations
-        mods_to_cache = [2, 16, 64, 256] # EZ, HR, DT, HT
-        mod_cache_results = []
+    except Exception as e:
+        logging.warning(f"Could not parse/process file {osu_file_path}: {e}")
+        return md5, {}, [], None
 
+    try:
         rosu_map = rosu_pp_py.Beatmap(path=osu_file_path)
+        rate_curve = rate_curves.calculate_rate_curve(rosu_map, md5)
 
+        mod_cache_results = []
         for mod_int in mods_to_cache:
-            diff_calc = rosu_pp_py.Difficulty(mods=mod_int)
-            diff_attrs = diff_calc.calculate(rosu_map)
-            
-            attr_builder = rosu_pp_py.BeatmapAttributesBuilder(map=rosu_map, mods=mod_int)
-            map_attrs = attr_builder.build()
-
-            mod_cache_results.append({
-                'md5_hash': md5,
-                'mods': mod_int,
-                'stars': round(diff_attrs.stars, 2),
-                'ar': round(map_attrs.ar, 2),
-                'od': round(map_attrs.od, 2),
-                'cs': round(map_attrs.cs, 2),
-                'hp': round(map_attrs.hp, 2),
-                'bpm': round(base_bpm * map_attrs.clock_rate, 2),
-                'aim': round(diff_attrs.aim, 2) if diff_attrs.aim else None,
-                'speed': round(diff_attrs.speed, 2) if diff_attrs.speed else None,
-                'slider_factor': round(diff_attrs.slider_factor, 2) if diff_attrs.slider_factor else None,
-                'speed_note_count': round(diff_attrs.speed_note_count, 2) if diff_attrs.speed_note_count else None,
-                'aim_difficult_strain_count': round(diff_attrs.aim_difficult_strain_count, 2) if diff_attrs.aim_difficult_strain_count else None,
-                'speed_difficult_strain_count': round(diff_attrs.speed_difficult_strain_count, 2) if diff_attrs.speed_difficult_strain_count else None,
-                'aim_difficult_slider_count': round(diff_attrs.aim_difficult_slider_count, 2) if diff_attrs.aim_difficult_slider_count else None,
-            })
-
-        return md5, details, mod_cache_results
+            diff_attrs = rosu_pp_py.Difficulty(mods=mod_int).calculate(rosu_map)
+            mod_cache_results.append(build_mod_cache_entry(md5, mod_int, diff_attrs))
     except Exception as e:
-        logging.warning(f"Could not parse/process file {osu_file_path}: {e}")
-        return md5, {}, []
+        logging.warning(f"Could not calculate rate curve for {osu_file_path}: {e}")
+        return md5, details, [], rate_curves.failed_curve(md5)
+
+    return md5, details, mod_cache_results, rate_curve
+
+def calculate_mod_cache_entry(osu_file_path, md5, mods):
+    """Calculates a single mod cache row; failures produce a row without stars so they are not retried."""
+    import rosu_pp_py
+    try:
+        rosu_map = rosu_pp_py.Beatmap(path=osu_file_path)
+        diff_attrs = rosu_pp_py.Difficulty(mods=mods).calculate(rosu_map)
+        return build_mod_cache_entry(md5, mods, diff_attrs)
+    except Exception as e:
+        logging.warning(f"Could not calculate mods {mods} for {osu_file_path}: {e}")
+        return build_mod_cache_entry(md5, mods, None)
+
+def request_mod_cache_warm(mods=None):
+    """
+    Queues a mod combination for lazy caching and starts the warmer if it is
+    idle. Without mods, the warmer only works through the replay history.
+    """
+    mods = mod_utils.normalize_mods(mods)
+    with _warm_lock:
+        if mods and mods not in _requested_warm_mods:
+            _requested_warm_mods.append(mods)
+    # The task sets its progress itself, so a warm job cancelled while queued leaves nothing behind.
+    jobs.scheduler.submit('warm', unique=True)
+
+def _next_warm_mods(history, exhausted):
+    """Picks the next mod combination to warm: explicit requests first, then the most played."""
+    with _warm_lock:
+        while _requested_warm_mods and _requested_warm_mods[0] in exhausted:
+            _requested_warm_mods.pop(0)
+        if _requested_warm_mods:
+            return _requested_warm_mods[0]
+    for mods, _ in history:
+        if mods not in exhausted:
+            return mods
+    return None
+
+def warm_mod_cache_task(cpu_budget=None, max_rows=None, job=None):
+    """
+    The background task that fills beatmap_mod_cache on demand. Combinations
+    requested by the recommender come first, followed by the combinations the
+    player uses most in their replays. A run stops once its CPU or row budget
+    is spent; remaining work is picked up by the next run.
+    """
+    job = job or jobs.detached()
+    progress = TASK_PROGRESS['warm']
+    progress.start('Starting difficulty cache warm-up...')
+
+    cpu_budget = MOD_CACHE_WARM_CPU_SECONDS if cpu_budget is None else cpu_budget
+    max_rows = MOD_CACHE_WARM_MAX_ROWS if max_rows is None else max_rows
+
+    try:
+        osu_folder = os.getenv('OSU_FOLDER')
+        if not osu_folder: raise ValueError("OSU_FOLDER environment variable is not set.")
+        songs_path = os.path.join(osu_folder, 'Songs')
+
+        history = database.get_replay_mod_frequencies()
+        exhausted = set()
+        cpu_start = time.process_time()
+        rows_written = 0
+
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            while True:
+                job.check()
+                if time.process_time() - cpu_start >= cpu_budget or rows_written >= max_rows:
+                    progress.finish(f"Warm-up budget reached after caching {rows_written} entries.")
+                    return
+
+                mods = _next_warm_mods(history, exhausted)
+                if mods is None:
+                    with _warm_lock:
+                        if not _requested_warm_mods:
+                            progress.finish(f"Difficulty cache is up to date ({rows_written} new entries).")
+                            return
+                    continue
+
+                batch_size = min(MOD_CACHE_WARM_BATCH_SIZE, max_rows - rows_written)
+                beatmaps = database.get_uncached_beatmaps(mods, limit=batch_size)
+                if not beatmaps:
+                    exhausted.add(mods)
+                    continue
 
-def sync_local_beatmaps_task():
-    """The background task for syncing the local beatmap database."""
+                if progress['mods'] != mods:
+                    progress.begin_stage(f"mods {mods}", 0, message=f"Caching difficulty for mods {mods}...")
+                    progress.update(mods=mods)
+                futures = []
+                for beatmap in beatmaps:
+                    osu_file_path = get_safe_join(songs_path, beatmap.get('folder_name'), beatmap.get('osu_file_name'))
+                    if osu_file_path and os.path.exists(osu_file_path):
+                        futures.append(executor.submit(calculate_mod_cache_entry, osu_file_path, beatmap['md5_hash'], mods))
+                    else:
+                        futures.append(None)
+
+                entries = []
+                for beatmap, future in zip(beatmaps, futures):
+                    entries.append(future.result() if future else build_mod_cache_entry(beatmap['md5_hash'], mods, None))
+
+                with progress.measure('mod cache', len(entries)):
+                    database.add_beatmap_mod_cache(entries)
+                rows_written += len(entries)
+                progress.advance(len(entries))
+                progress.batch_done()
+    except jobs.JobCancelled:
+        progress.finish('Cache warm-up cancelled.', status='cancelled')
+        raise
+    except Exception as e:
+        logging.error(f"Error in mod cache warm task: {e}", exc_info=True)
+        progress.fail(e, f'Cache warm-up failed: {e}')
+
+def _beatmap_from_osu_file(songs_path, folder_name, osu_file_name):
+    """Builds a beatmaps row from the .osu file itself, for maps osu!.db does not list yet."""
+    osu_file_path = get_safe_join(songs_path, folder_name, osu_file_name)
+    metadata = parser.parse_osu_metadata(osu_file_path) if osu_file_path else None
+    if not metadata:
+        return None
+    return {**metadata, 'folder_name': folder_name, 'osu_file_name': osu_file_name}
+
+def _read_song_folder_beatmaps(songs_path, folder_names, known_md5s):
+    """Indexes Songs folders and returns rows for the .osu files in them that are not known yet."""
+    osu_file_index.refresh(songs_path, folder_names=folder_names)
+    beatmaps = {}
+    for row in database.get_indexed_files(folder_names):
+        md5 = row['md5_hash']
+        if md5 in known_md5s or md5 in beatmaps:
+            continue
+        beatmap = _beatmap_from_osu_file(songs_path, row['folder_name'], row['osu_file_name'])
+        if beatmap:
+            beatmaps[md5] = beatmap
+    return beatmaps
+
+def add_beatmap_from_songs(songs_path, md5, resolve=True):
+    """
+    Stores and analyzes a beatmap that is not in the beatmaps table yet,
+    located through the .osu file index, so replays of freshly downloaded maps
+    can be scored right away. Without resolve the index is only looked up,
+    not refreshed. Returns the stored beatmap or None if no file matches.
+    """
+    location = osu_file_index.resolve(songs_path, md5) if resolve else osu_file_index.lookup(songs_path, md5)
+    if not location:
+        return None
+    beatmap = _beatmap_from_osu_file(songs_path, *location)
+    if not beatmap:
+        return None
+
+    rate_curve = None
+    if beatmap['game_mode'] == 0:
+        _, details, _, rate_curve = process_osu_file_and_cache(get_safe_join(songs_path, *location), None, md5)
+        beatmap.update(details)
+    database.add_or_update_beatmaps({md5: beatmap})
+    if rate_curve:
+        rate_curves.save_curves([rate_curve])
+    logging.info(f"Added beatmap {md5} from {location[0]}/{location[1]} before osu!.db listed it.")
+    return beatmap
+
+def find_new_beatmaps(db_path, songs_path, song_folders=()):
+    """
+    Returns {md5: beatmap} for beatmaps that are not stored yet: entries osu!.db
+    gained since the last sync, plus the .osu files of the given Songs folders
+    (osu! only rewrites osu!.db now and then, so a freshly imported set may
+    not be listed there yet).
+    """
+    known_md5s = database.get_beatmap_hashes()
+    new_beatmaps = {}
+
+    if os.path.exists(db_path):
+        try:
+            for md5, data in parser.parse_osu_db(db_path).items():
+                if md5 not in known_md5s:
+                    new_beatmaps[md5] = data
+        except Exception as e:
+            # osu! may be in the middle of rewriting the file; the next change event retries.
+            logging.warning(f"Could not read osu!.db for an incremental sync: {e}")
+
+    if song_folders:
+        new_beatmaps.update(_read_song_folder_beatmaps(songs_path, song_folders, known_md5s.union(new_beatmaps)))
+    return new_beatmaps
+
+def queue_sync_follow_ups():
+    """Starts the background work that builds on an updated beatmaps table."""
+    request_mod_cache_warm()
+    jobs.scheduler.submit('index', unique=True)
+    jobs.scheduler.submit('backfill', unique=True)
+    thumbnails.request_thumbnails()
+    maintenance.request_maintenance()
+
+def verify_beatmap_files(items, songs_path, job, progress):
+    """Returns (md5, beatmap, .osu path) for each (md5, beatmap) in items whose .osu file exists, advancing progress per item."""
+    verified_items = []
+    for i, (md5, beatmap) in enumerate(items):
+        if i % 1000 == 0:
+            job.check()
+        progress.advance()
+        folder_name = beatmap.get('folder_name')
+        osu_file = beatmap.get('osu_file_name')
+        if folder_name and osu_file:
+            safe_path = get_safe_join(songs_path, folder_name, osu_file)
+            if safe_path and os.path.exists(safe_path):
+                verified_items.append((md5, beatmap, safe_path))
+    return verified_items
+
+def sync_local_beatmaps_task(job=None, incremental=False, song_folders=(), workers=None, batch_size=None,
+                             follow_ups=True):
+    """
+    The background task for syncing the local beatmap database. Analyzed
+    beatmaps are saved in batches and skipped by later runs; the checkpoint
+    additionally records the osu!.db it was started from, so a sync resumed
+    against the same file skips re-saving the library metadata.
+
+    With incremental, only beatmaps that are not stored yet are saved and
+    analyzed (see find_new_beatmaps). The library watcher runs this mode
+    whenever osu!.db or the Songs folder changes.
+
+    workers and batch_size override the number of analysis threads and the
+    beatmaps saved per write, and follow_ups=False skips queuing the work that
+    builds on the result (used by the command line, see cli.py).
+    """
+    job = job or jobs.detached()
     progress = TASK_PROGRESS['sync']
-    progress['status'] = 'running'
-    progress['current'] = 0
-    progress['total'] = 0
-    progress['message'] = 'Starting beatmap sync...'
-    progress['batches_done'] = 0
+    progress.start('Checking for new beatmaps...' if incremental else 'Starting beatmap sync...')
     
-    BATCH_SIZE = 500
+    BATCH_SIZE = batch_size or 500
 
     try:
         osu_folder = os.getenv('OSU_FOLDER')
         if not osu_folder: raise ValueError("OSU_FOLDER environment variable is not set.")
         
         db_path = os.path.join(osu_folder, 'osu!.db')
-        if not os.path.exists(db_path): raise FileNotFoundError(f"osu!.db not found at {db_path}")
-
         songs_path = os.path.join(osu_folder, 'Songs')
-        
-        progress['message'] = 'Reading beatmap library (osu!.db)...'
-        all_beatmap_data = parser.parse_osu_db(db_path)
-        
-        progress['message'] = 'Saving basic beatmap metadata...'
-        database.add_or_update_beatmaps(all_beatmap_data)
-        progress['batches_done'] += 1
+        checkpoint = {}
+
+        if incremental:
+            progress.begin_stage('read', 0)
+            all_beatmap_data = find_new_beatmaps(db_path, songs_path, song_folders)
+            progress.update(current=len(all_beatmap_data), total=len(all_beatmap_data))
+            job.check()
+            if not all_beatmap_data:
+                progress.finish('No new beatmaps found. Your library is up to date.')
+                return
+            logging.info(f"Incremental sync found {len(all_beatmap_data)} new beatmaps.")
+            progress.update(message=f'Saving {len(all_beatmap_data)} new beatmaps...')
+            with progress.measure('db flush', len(all_beatmap_data)):
+                database.add_or_update_beatmaps(all_beatmap_data)
+            progress.batch_done()
+        else:
+            if not os.path.exists(db_path): raise FileNotFoundError(f"osu!.db not found at {db_path}")
+
+            db_stat = os.stat(db_path)
+            osu_db_signature = [db_stat.st_size, db_stat.st_mtime_ns]
+            checkpoint = job.checkpoint or {}
+            resuming = checkpoint.get('osu_db') == osu_db_signature
+
+            progress.begin_stage('read', 0, message='Reading beatmap library (osu!.db)...')
+            all_beatmap_data = parser.parse_osu_db(db_path)
+            progress.update(current=len(all_beatmap_data), total=len(all_beatmap_data))
+            job.check()
 
-        progress['message'] = 'Checking for un-analyzed beatmaps...'
+            if resuming:
+                logging.info(f"Resuming interrupted sync ({checkpoint.get('analyzed', 0)} beatmaps were already analyzed).")
+            else:
+                progress.update(message='Saving basic beatmap metadata...')
+                with progress.measure('db flush', len(all_beatmap_data)):
+                    database.add_or_update_beatmaps(all_beatmap_data)
+                progress.batch_done()
+                checkpoint = {'osu_db': osu_db_signature, 'analyzed': 0}
+                job.save_checkpoint(checkpoint)
+
+        progress.update(message='Checking for un-analyzed beatmaps...')
         processed_md5s = database.get_processed_beatmap_hashes()
+        # Maps analyzed before rate curves existed are picked up once to fill in their curve.
+        # Maps whose curve could not be calculated have an empty one and are not retried.
+        curve_md5s = database.get_rate_curve_hashes()
         
         items_to_process = [
             (md5, data) for md5, data in all_beatmap_data.items() 
-            if md5 not in processed_md5s and data.get('game_mode') == 0
+            if (md5 not in processed_md5s or md5 not in curve_md5s) and data.get('game_mode') == 0
         ]
         
         if not items_to_process:
-            progress['status'] = 'complete'
-            progress['message'] = 'No new beatmaps to analyze. Your library is up to date.'
+            progress.finish('No new beatmaps to analyze. Your library is up to date.')
+            if follow_ups:
+                queue_sync_follow_ups()
             return
             
         # --- Stage 1: File Verification ---
-        progress['total'] = len(items_to_process)
-        progress['current'] = 0
-        progress['message'] = f"Step 1/2: Verifying {progress['total']} beatmap files..."
-        
-        verified_items = []
-        for i, (md5, beatmap) in enumerate(items_to_process):
-            progress['current'] = i + 1
-            folder_name = beatmap.get('folder_name')
-            osu_file = beatmap.get('osu_file_name')
-            if folder_name and osu_file:
-                safe_path = get_safe_join(songs_path, folder_name, osu_file)
-                if safe_path and os.path.exists(safe_path):
-                    verified_items.append((md5, beatmap, safe_path))
+        progress.begin_stage('verify', len(items_to_process), message=f"Step 1/2: Verifying {len(items_to_process)} beatmap files...")
+        verified_items = verify_beatmap_files(items_to_process, songs_path, job, progress)
 
         # --- Stage 2: Analysis ---
-        progress['total'] = len(verified_items)
-        progress['current'] = 0
-        if progress['total'] == 0:
-            progress['status'] = 'complete'
-            progress['message'] = 'Beatmap library is up to date. No new files found to analyze.'
+        if not verified_items:
+            progress.finish('Beatmap library is up to date. No new files found to analyze.')
+            if follow_ups:
+                queue_sync_follow_ups()
             return
             
-        progress['message'] = f"Step 2/2: Analyzing {progress['total']} beatmaps..."
+        total = len(verified_items)
+        progress.begin_stage('analyze', total, message=f"Step 2/2: Analyzing {total} beatmaps...")
         
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            tasks = {
-                executor.submit(process_osu_file_and_cache, osu_path, bmap.get('bpm', 0), md5): md5
-                for md5, bmap, osu_path in verified_items
-            }
+        processed_batch = {}
+        mod_cache_batch = []
+        curve_batch = []
+        analyzed = checkpoint.get('analyzed', 0)
 
+        def save_batch():
+            nonlocal processed_batch, mod_cache_batch, curve_batch, analyzed
+            if processed_batch:
+                with progress.measure('db flush', len(processed_batch)):
+                    database.add_or_update_beatmaps(processed_batch)
+                progress.batch_done()
+            if mod_cache_batch:
+                with progress.measure('mod cache', len(mod_cache_batch)):
+                    database.add_beatmap_mod_cache(mod_cache_batch)
+            with progress.measure('rate curves', len(curve_batch)):
+                rate_curves.save_curves(curve_batch)
+            progress.set_queue_depth('unsaved', 0)
+            analyzed += len(processed_batch)
+            if not incremental:
+                job.save_checkpoint({**checkpoint, 'analyzed': analyzed})
             processed_batch = {}
             mod_cache_batch = []
-            for future in concurrent.futures.as_completed(tasks):
-                progress['current'] += 1
-                progress['message'] = f"Step 2/2: Analyzing beatmaps ({progress['current']}/{progress['total']})"
-                try:
-                    md5, result_data, mod_caches = future.result()
-                    if result_data:
-                        current_beatmap_data = all_beatmap_data[md5]
-                        current_beatmap_data.update(result_data)
-                        processed_batch[md5] = current_beatmap_data
-                    if mod_caches:
-                        mod_cache_batch.extend(mod_caches)
-                    
-                    if len(processed_batch) >= BATCH_SIZE:
-                        progress['message'] = f"Step 2/2: Saving progress... ({progress['current']}/{progress['total']})"
-                        database.add_or_update_beatmaps(processed_batch)
-                        database.add_beatmap_mod_cache(mod_cache_batch)
-                        progress['batches_done'] += 1
-                        processed_batch = {}
-                        mod_cache_batch = []
-                except Exception as e:
-                    logging.error(f"Error processing beatmap future for md5 {tasks[future]}: {e}", exc_info=True)
-
-        if processed_batch:
-            database.add_or_update_beatmaps(processed_batch)
-            progress['batches_done'] += 1
-        if mod_cache_batch:
-            database.add_beatmap_mod_cache(mod_cache_batch)
+            curve_batch = []
+
+        def analyze(*args):
+            # Runs on the pool threads; the summed time shows how busy rosu keeps them.
+            with progress.measure('analysis', 1):
+                return process_osu_file_and_cache(*args)
+
+        work = ((md5, (osu_path, bmap.get('bpm', 0), md5)) for md5, bmap, osu_path in verified_items)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            # Whatever was analyzed is saved even if the job is cancelled midway.
+            try:
+                results = jobs.run_bounded(executor, analyze, work, job,
+                                           on_depth=lambda depth: progress.set_queue_depth('in flight', depth))
+                for done, (md5, future) in enumerate(results, start=1):
+                    progress.advance(message=f"Step 2/2: Analyzing beatmaps ({done}/{total})")
+                    try:
+                        md5, result_data, mod_caches, rate_curve = future.result()
+                        if result_data:
+                            current_beatmap_data = all_beatmap_data[md5]
+                            current_beatmap_data.update(result_data)
+                            processed_batch[md5] = current_beatmap_data
+                        if mod_caches:
+                            mod_cache_batch.extend(mod_caches)
+                        if rate_curve:
+                            curve_batch.append(rate_curve)
+                        progress.set_queue_depth('unsaved', len(processed_batch))
+
+                        if len(processed_batch) >= BATCH_SIZE:
+                            progress.update(message=f"Step 2/2: Saving progress... ({done}/{total})")
+                            save_batch()
+                    except Exception as e:
+                        logging.error(f"Error processing beatmap future for md5 {md5}: {e}", exc_info=True)
+                        progress.record_error(e)
+            finally:
+                save_batch()
         
-        progress['status'] = 'complete'
-        progress['message'] = 'Sync complete! Your beatmap library is up to date.'
+        if incremental:
+            progress.finish(f'Added {len(all_beatmap_data)} new beatmaps to your library.')
+        else:
+            progress.finish('Sync complete! Your beatmap library is up to date.')
+        if follow_ups:
+            queue_sync_follow_ups()
+    except jobs.JobCancelled:
+        progress.finish('Sync cancelled. Analyzed beatmaps were saved.', status='cancelled')
+        raise
     except Exception as e:
         logging.error(f"Error in sync task: {e}", exc_info=True)
-        progress['status'] = 'error'
-        progress['message'] = f'Sync failed: {e}'
+        progress.fail(e, f'Sync failed: {e}')
 
-def scan_replays_task():
-    """The background task for scanning the replays folder."""
+def scan_replays_task(job=None, batch_size=None):
+    """The background task for scanning the replays folder. batch_size overrides the replays saved per write."""
+    job = job or jobs.detached()
     progress = TASK_PROGRESS['scan']
-    progress['status'] = 'running'
-    progress['current'] = 0
-    progress['total'] = 0
-    progress['message'] = 'Starting replay scan...'
+    progress.start('Starting replay scan...')
 
-    BATCH_SIZE = 200 # Define batch size for DB writes
+    BATCH_SIZE = batch_size or 200 # Define batch size for DB writes
 
     try:
         osu_folder = os.getenv('OSU_FOLDER')
@@ -192,23 +491,24 @@ def scan_replays_task():
         all_beatmaps = {b['md5_hash']: b for b in database.get_all_beatmaps(limit=100000)['beatmaps']}
         if not all_beatmaps: logging.warning("Beatmap DB is empty. Replay data may be incomplete.")
 
-        progress['message'] = 'Checking for existing replays in database...'
+        progress.update(message='Checking for existing replays in database...')
         existing_replay_md5s = database.get_all_replay_md5s()
         all_replay_files = [f for f in os.listdir(replays_path) if f.endswith('.osr')]
         replay_files_to_process = [f for f in all_replay_files if f[:-4] not in existing_replay_md5s]
         
-        progress['total'] = len(replay_files_to_process)
-        if progress['total'] == 0:
-            progress['status'] = 'complete'
-            progress['message'] = 'No new replays found. Your scores are up to date.'
+        total = len(replay_files_to_process)
+        if total == 0:
+            progress.finish('No new replays found. Your scores are up to date.')
             return
 
-        progress['message'] = f"Found {progress['total']} new replays to process..."
+        progress.begin_stage('process', total, message=f"Found {total} new replays to process...")
         replay_batch = []
+        index_refreshed = False
+        unresolved_md5s = set()
 
         for i, file_name in enumerate(replay_files_to_process):
-            progress['current'] = i + 1
-            progress['message'] = f"Processing replays: {progress['current']}/{progress['total']}"
+            job.check()
+            progress.advance(message=f"Processing replays: {i + 1}/{total}")
             
             file_path = get_safe_join(replays_path, file_name)
             if not file_path:
@@ -216,38 +516,310 @@ def scan_replays_task():
                 continue
                 
             try:
-                replay_data = parser.parse_replay_file(file_path)
+                with progress.measure('parse replay', 1):
+                    replay_data = parser.parse_replay_file(file_path)
                 if not replay_data or not replay_data.get('replay_md5'): continue
                 
-                beatmap_info = all_beatmaps.get(replay_data['beatmap_md5'])
+                beatmap_md5 = replay_data['beatmap_md5']
+                beatmap_info = all_beatmaps.get(beatmap_md5)
+                if beatmap_info is None and beatmap_md5 not in unresolved_md5s:
+                    # Maps osu!.db does not list yet are looked up in the .osu file index.
+                    if not index_refreshed:
+                        progress.update(message='Indexing Songs folder for beatmaps missing from osu!.db...')
+                        osu_file_index.refresh(songs_path, job=job)
+                        index_refreshed = True
+                    beatmap_info = add_beatmap_from_songs(songs_path, beatmap_md5, resolve=False)
+                    if beatmap_info:
+                        all_beatmaps[beatmap_md5] = beatmap_info
+                    else:
+                        unresolved_md5s.add(beatmap_md5)
+
                 if beatmap_info:
                     folder_name = beatmap_info.get('folder_name')
                     osu_file = beatmap_info.get('osu_file_name')
                     osu_file_path = get_safe_join(songs_path, folder_name, osu_file)
                     
                     if osu_file_path and os.path.exists(osu_file_path):
-                        pp_info = parser.calculate_pp(osu_file_path, replay_data)
+                        with progress.measure('analysis', 1):
+                            pp_info = parser.calculate_pp(osu_file_path, replay_data)
                         replay_data.update(pp_info)
                         osu_details = parser.parse_osu_file(osu_file_path)
                         replay_data.update(osu_details)
                         database.update_beatmap_details(replay_data['beatmap_md5'], osu_details)
                 
                 replay_batch.append(replay_data)
-                
+                progress.set_queue_depth('unsaved', len(replay_batch))
+
                 if len(replay_batch) >= BATCH_SIZE:
-                    progress['message'] = f"Saving a batch of replays... ({progress['current']}/{progress['total']})"
-                    database.add_replays_batch(replay_batch)
+                    progress.update(message=f"Saving a batch of replays... ({i + 1}/{total})")
+                    with progress.measure('db flush', len(replay_batch)):
+                        database.add_replays_batch(replay_batch)
+                    progress.batch_done()
                     replay_batch = [] # Reset the batch
+            except jobs.JobCancelled:
+                raise
             except Exception as e:
                 logging.error(f"Could not process file {file_name}: {e}", exc_info=True)
+                progress.record_error(e)
         
         if replay_batch:
-            progress['message'] = 'Finalizing scan...'
-            database.add_replays_batch(replay_batch)
+            progress.update(message='Finalizing scan...')
+            with progress.measure('db flush', len(replay_batch)):
+                database.add_replays_batch(replay_batch)
+            progress.batch_done()
         
-        progress['status'] = 'complete'
-        progress['message'] = f"Scan complete! Added {progress['total']} new replays to your library."
+        progress.finish(f"Scan complete! Added {total} new replays to your library.")
+    except jobs.JobCancelled:
+        if replay_batch:
+            database.add_replays_batch(replay_batch)
+        progress.finish('Scan cancelled. Processed replays were saved.', status='cancelled')
+        raise
     except Exception as e:
         logging.error(f"Error in scan task: {e}", exc_info=True)
-        progress['status'] = 'error'
-        progress['message'] = f'Scan failed: {e}'
\ No newline at end of file
+        progress.fail(e, f'Scan failed: {e}')
+
+def _recalculate_beatmap(osu_file_path, md5):
+    """Recalculates the NoMod difficulty and rate curve of one beatmap."""
+    import rosu_pp_py
+    difficulty = parser.calculate_difficulty(osu_file_path, mods=0)
+    difficulty['md5_hash'] = md5
+    try:
+        rate_curve = rate_curves.calculate_rate_curve(rosu_pp_py.Beatmap(path=osu_file_path), md5)
+    except Exception as e:
+        logging.warning(f"Could not calculate rate curve for {osu_file_path}: {e}")
+        rate_curve = rate_curves.failed_curve(md5)
+    return difficulty, rate_curve
+
+def recompute_stale_task(job=None, workers=None, batch_size=None, follow_ups=True):
+    """
+    The background task that brings stored pp and star values up to the
+    installed rosu-pp version. Stale beatmaps are recalculated first, then
+    stale replays grouped by (beatmap, mods) so each map is parsed once per
+    mod combination. Results are written in batches that stamp the current
+    calc_version, which doubles as the checkpoint: an interrupted run resumes
+    with whatever is still stale. Stale mod cache rows are dropped and left to
+    the lazy warmer. workers, batch_size and follow_ups work as in
+    sync_local_beatmaps_task.
+    """
+    job = job or jobs.detached()
+    progress = TASK_PROGRESS['recompute']
+    progress.start('Looking for values from older rosu-pp versions...', calc_version=parser.CALC_VERSION)
+
+    BATCH_SIZE = batch_size or 500
+
+    try:
+        osu_folder = os.getenv('OSU_FOLDER')
+        if not osu_folder: raise ValueError("OSU_FOLDER environment variable is not set.")
+        songs_path = os.path.join(osu_folder, 'Songs')
+
+        stale_beatmaps = database.get_stale_beatmaps()
+        stale_replays = database.get_stale_replays()
+
+        replay_groups = {}
+        for replay in stale_replays:
+            replay_groups.setdefault((replay['beatmap_md5'], replay['mods_used'] or 0), []).append(replay)
+
+        total = len(stale_beatmaps) + len(stale_replays)
+        if total == 0:
+            deleted = database.delete_stale_mod_cache()
+            if deleted and follow_ups:
+                request_mod_cache_warm()
+            progress.finish(f'All values are up to date for {parser.CALC_VERSION}.')
+            return
+
+        skipped = 0
+
+        def in_flight(depth):
+            progress.set_queue_depth('in flight', depth)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            # --- Stage 1: Beatmap difficulty and rate curves ---
+            progress.begin_stage('beatmaps', len(stale_beatmaps), message=f"Step 1/2: Recalculating {len(stale_beatmaps)} beatmaps...")
+            work = []
+            for beatmap in stale_beatmaps:
+                osu_file_path = get_safe_join(songs_path, beatmap.get('folder_name'), beatmap.get('osu_file_name'))
+                if osu_file_path and os.path.exists(osu_file_path):
+                    work.append((beatmap['md5_hash'], (osu_file_path, beatmap['md5_hash'])))
+                else:
+                    skipped += 1
+                    progress.advance()
+
+            difficulty_batch, curve_batch = [], []
+            try:
+                for md5, future in jobs.run_bounded(executor, _recalculate_beatmap, work, job, on_depth=in_flight):
+                    progress.advance()
+                    try:
+                        difficulty, rate_curve = future.result()
+                        if difficulty.get('stars') is not None:
+                            difficulty_batch.append(difficulty)
+                        if rate_curve:
+                            curve_batch.append(rate_curve)
+                    except Exception as e:
+                        logging.error(f"Error recalculating beatmap {md5}: {e}", exc_info=True)
+                        progress.record_error(e)
+                    if len(difficulty_batch) >= BATCH_SIZE:
+                        with progress.measure('db flush', len(difficulty_batch)):
+                            database.update_beatmap_difficulty_batch(difficulty_batch)
+                            rate_curves.save_curves(curve_batch)
+                        progress.batch_done()
+                        difficulty_batch, curve_batch = [], []
+            finally:
+                with progress.measure('db flush', len(difficulty_batch)):
+                    database.update_beatmap_difficulty_batch(difficulty_batch)
+                    rate_curves.save_curves(curve_batch)
+
+            # --- Stage 2: Replay pp, one task per (beatmap, mods) group ---
+            progress.begin_stage('replays', len(stale_replays), message=f"Step 2/2: Recalculating {len(stale_replays)} replays in {len(replay_groups)} groups...")
+            work = []
+            for (beatmap_md5, mods), replays in replay_groups.items():
+                first = replays[0]
+                osu_file_path = get_safe_join(songs_path, first.get('folder_name'), first.get('osu_file_name'))
+                if osu_file_path and os.path.exists(osu_file_path):
+                    work.append((len(replays), (osu_file_path, mods, replays)))
+                else:
+                    skipped += len(replays)
+                    progress.advance(len(replays))
+
+            replay_batch = []
+            try:
+                for group_size, future in jobs.run_bounded(executor, parser.calculate_pp_batch, work, job, on_depth=in_flight):
+                    progress.advance(group_size)
+                    try:
+                        replay_batch.extend(future.result())
+                    except Exception as e:
+                        logging.error(f"Error recalculating replay group: {e}", exc_info=True)
+                        progress.record_error(e)
+                    if len(replay_batch) >= BATCH_SIZE:
+                        progress.update(message=f"Step 2/2: Saving progress... ({progress['current']}/{len(stale_replays)})")
+                        with progress.measure('db flush', len(replay_batch)):
+                            database.update_replays_pp_batch(replay_batch)
+                        progress.batch_done()
+                        replay_batch = []
+            finally:
+                with progress.measure('db flush', len(replay_batch)):
+                    database.update_replays_pp_batch(replay_batch)
+
+        if database.delete_stale_mod_cache() and follow_ups:
+            request_mod_cache_warm()
+        if follow_ups:
+            maintenance.request_maintenance()
+
+        progress.finish(f"Recompute complete for {parser.CALC_VERSION}. "
+                        f"{total - skipped} values updated, {skipped} skipped (missing .osu files).")
+    except jobs.JobCancelled:
+        progress.finish('Recompute cancelled. Values recalculated so far were saved.', status='cancelled')
+        raise
+    except Exception as e:
+        logging.error(f"Error in recompute task: {e}", exc_info=True)
+        progress.fail(e, f'Recompute failed: {e}')
+
+def backfill_replays_task(job=None):
+    """
+    The background task that scores replays stored while their beatmap was
+    still unknown. After a sync brought the beatmap in, their pp and stars are
+    calculated grouped by (beatmap, mods), like recompute_stale_task, and
+    written in bulk. Replays whose .osu file is missing stay unscored.
+    """
+    job = job or jobs.detached()
+    progress = TASK_PROGRESS['backfill']
+    progress.start('Looking for replays without pp...')
+
+    BATCH_SIZE = 500
+
+    try:
+        osu_folder = os.getenv('OSU_FOLDER')
+        if not osu_folder: raise ValueError("OSU_FOLDER environment variable is not set.")
+        songs_path = os.path.join(osu_folder, 'Songs')
+
+        replays = database.get_replays_missing_pp()
+        if not replays:
+            progress.finish('Every replay with a known beatmap has pp.')
+            return
+
+        replay_groups = {}
+        for replay in replays:
+            replay_groups.setdefault((replay['beatmap_md5'], replay['mods_used'] or 0), []).append(replay)
+
+        progress.begin_stage('replays', len(replays), message=f"Calculating pp for {len(replays)} replays in {len(replay_groups)} groups...")
+        work = []
+        missing_files = 0
+        for (beatmap_md5, mods), group in replay_groups.items():
+            osu_file_path = get_safe_join(songs_path, group[0]['folder_name'], group[0]['osu_file_name'])
+            if osu_file_path and os.path.exists(osu_file_path):
+                work.append((len(group), (osu_file_path, mods, group)))
+            else:
+                missing_files += len(group)
+                progress.advance(len(group))
+        progress.update(missing_files=missing_files)
+
+        updated = 0
+        replay_batch = []
+
+        def save_batch():
+            nonlocal updated, replay_batch
+            scored = [result for result in replay_batch if result.get('pp') is not None]
+            with progress.measure('db flush', len(scored)):
+                database.update_replays_pp_batch(scored)
+                database.fill_replay_bpm_from_beatmaps(result['replay_md5'] for result in scored)
+            updated += len(scored)
+            progress.update(updated=updated)
+            if scored:
+                progress.batch_done()
+            replay_batch = []
+
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            try:
+                for group_size, future in jobs.run_bounded(
+                        executor, parser.calculate_pp_batch, work, job,
+                        on_depth=lambda depth: progress.set_queue_depth('in flight', depth)):
+                    progress.advance(group_size)
+                    try:
+                        replay_batch.extend(future.result())
+                    except Exception as e:
+                        logging.error(f"Error calculating pp for a replay group: {e}", exc_info=True)
+                        progress.record_error(e)
+                    if len(replay_batch) >= BATCH_SIZE:
+                        save_batch()
+            finally:
+                save_batch()
+
+        failed = len(replays) - missing_files - updated
+        progress.update(failed=failed)
+        logging.info(f"Replay backfill: {updated} scored, {missing_files} missing .osu files, {failed} failed.")
+        progress.finish(f"Calculated pp for {updated} replays. "
+                        f"{missing_files} skipped (missing .osu files), {failed} failed.")
+    except jobs.JobCancelled:
+        progress.finish('Backfill cancelled. Replays scored so far were saved.', status='cancelled')
+        raise
+    except Exception as e:
+        logging.error(f"Error in backfill task: {e}", exc_info=True)
+        progress.fail(e, f'Backfill failed: {e}')
+
+def index_songs_task(job=None):
+    """The background task that brings the .osu file index up to date (see osu_file_index)."""
+    job = job or jobs.detached()
+    progress = TASK_PROGRESS['index']
+    progress.start('Indexing .osu files...')
+
+    try:
+        osu_folder = os.getenv('OSU_FOLDER')
+        if not osu_folder: raise ValueError("OSU_FOLDER environment variable is not set.")
+        songs_path = os.path.join(osu_folder, 'Songs')
+        if not os.path.isdir(songs_path): raise FileNotFoundError(f"Songs directory not found at: {songs_path}")
+
+        progress.begin_stage('index', 0, message='Indexing changed Songs folders...')
+        stats = osu_file_index.refresh(songs_path, job=job, on_folder=lambda done, total: progress.update(current=done, total=total))
+        progress.finish(f"Indexed {stats['files']} .osu files in {stats['folders']} changed folders.")
+    except jobs.JobCancelled:
+        progress.finish('Indexing cancelled. Indexed folders were saved.', status='cancelled')
+        raise
+    except Exception as e:
+        logging.error(f"Error in index task: {e}", exc_info=True)
+        progress.fail(e, f'Indexing failed: {e}')
+
+jobs.scheduler.register('sync', sync_local_beatmaps_task, priority=jobs.PRIORITY_USER, resumable=True)
+jobs.scheduler.register('scan', scan_replays_task, priority=jobs.PRIORITY_USER)
+jobs.scheduler.register('recompute', recompute_stale_task, priority=jobs.PRIORITY_USER)
+jobs.scheduler.register('warm', warm_mod_cache_task, priority=jobs.PRIORITY_BACKGROUND)
+jobs.scheduler.register('index', index_songs_task, priority=jobs.PRIORITY_BACKGROUND)
+jobs.scheduler.register('backfill', backfill_replays_task, priority=jobs.PRIORITY_BACKGROUND)
@@ -0,0 +1,264 @@
+"""
+Card-sized thumbnails of beatmap backgrounds.
+
+Beatmap and replay cards used to load the full background image, often a
+multi-megabyte 1080p JPEG or PNG, for every card on a page. They now load a
+THUMBNAIL_WIDTH px wide WebP (JPEG where Pillow has no WebP support) from
+/api/thumbnails.
+
+Thumbnails live in a "thumbnails" folder next to the database. Each file is
+named after a hash of its source image's path, size and modification time and
+of the thumbnail settings: the background shared by every difficulty of a set
+is stored once, and an edited image gets a new entry. Serving a thumbnail
+refreshes its modification time; when the folder grows past THUMBNAIL_CACHE_MB
+the least recently served thumbnails are removed.
+
+The thumbnails job makes thumbnails ahead of time after a sync, until the
+cache holds TRIM_TARGET of its limit; it never trims, so it cannot evict the
+thumbnails it just made. Anything it has not reached is made on the first
+request. Pillow is optional and
+imported on first use: without it available() is False and the original
+image is served.
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+import concurrent.futures
+
+import database
+import jobs
+import tasks
+from utils import get_safe_join
+
+THUMBNAIL_WIDTH = int(os.getenv('THUMBNAIL_WIDTH', '400'))
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', '80'))
+THUMBNAIL_CACHE_MB = float(os.getenv('THUMBNAIL_CACHE_MB', '256'))
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', str(min(4, os.cpu_count() or 1))))
+THUMBNAIL_FOLDER_NAME = 'thumbnails'
+# Serving a thumbnail refreshes its mtime (its LRU position) at most this often.
+TOUCH_INTERVAL = 3600
+# Trimming removes thumbnails until the cache is this fraction of its limit.
+TRIM_TARGET = 0.9
+
+_pil = None  # The PIL.Image module, False when Pillow is missing, None until first checked.
+_format = None  # (Pillow format name, file extension, mimetype)
+_lock = threading.Lock()
+_trim_lock = threading.Lock()
+_inflight = {}  # cache key -> Future of a thumbnail being made
+_failed = set()  # cache keys of images Pillow could not read
+_cache_bytes = None  # Total size of the cache folder, counted on first write.
+
+def _image_module():
+    global _pil, _format
+    with _lock:
+        if _pil is None:
+            try:
+                from PIL import Image, features
+                _pil = Image
+                _format = ('WEBP', '.webp', 'image/webp') if features.check('webp') else ('JPEG', '.jpg', 'image/jpeg')
+            except ImportError:
+                logging.info("Pillow is not installed; beatmap backgrounds are served at full size.")
+                _pil = False
+        return _pil or None
+
+def available():
+    """True when thumbnails can be made (Pillow is installed)."""
+    return _image_module() is not None
+
+def mimetype():
+    _image_module()
+    return _format[2] if _format else None
+
+def get_cache_dir():
+    """The folder holding the thumbnails, next to the database file."""
+    return os.path.join(os.path.dirname(os.path.abspath(database.DATABASE_FILE)), THUMBNAIL_FOLDER_NAME)
+
+def _cache_key(source_path, stat):
+    identity = f"{os.path.normcase(os.path.abspath(source_path))}|{stat.st_size}|{stat.st_mtime_ns}|" \
+               f"{THUMBNAIL_WIDTH}|{THUMBNAIL_QUALITY}|{_format[0]}"
+    return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+def _generate(image_module, source_path, target_path):
+    """Writes the thumbnail of source_path to target_path. Returns the size of the written file."""
+    with image_module.open(source_path) as image:
+        # Lets the JPEG decoder skip to a smaller scale instead of decoding the full image.
+        image.draft('RGB', (THUMBNAIL_WIDTH, max(1, THUMBNAIL_WIDTH * image.height // max(1, image.width))))
+        image = image.convert('RGB')
+        image.thumbnail((THUMBNAIL_WIDTH, THUMBNAIL_WIDTH * 4), image_module.Resampling.LANCZOS, reducing_gap=2.0)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        temp_path = f"{target_path}.{threading.get_ident()}.tmp"
+        image.save(temp_path, _format[0], quality=THUMBNAIL_QUALITY)
+    os.replace(temp_path, target_path)
+    return os.path.getsize(target_path)
+
+def ensure_thumbnail(source_path, serving=True):
+    """
+    Returns the path of the thumbnail of an image, making it first if needed,
+    or None when it cannot be made (no Pillow, missing or unreadable image).
+    Concurrent calls for the same image make it once. With serving False
+    (pre-generation), an existing thumbnail keeps its LRU position and the
+    cache is not trimmed.
+    """
+    image_module = _image_module()
+    if image_module is None:
+        return None
+    try:
+        stat = os.stat(source_path)
+    except OSError:
+        return None
+
+    key = _cache_key(source_path, stat)
+    target_path = os.path.join(get_cache_dir(), key[:2], key + _format[1])
+    try:
+        if time.time() - os.path.getmtime(target_path) > TOUCH_INTERVAL and serving:
+            os.utime(target_path)
+        return target_path
+    except OSError:
+        pass
+
+    with _lock:
+        if key in _failed:
+            return None
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = _inflight[key] = concurrent.futures.Future()
+
+    if owner:
+        try:
+            size = _generate(image_module, source_path, target_path)
+            _add_to_cache(size, serving)
+            future.set_result(target_path)
+        except Exception as e:
+            logging.warning(f"Could not make a thumbnail of {source_path}: {e}")
+            with _lock:
+                _failed.add(key)
+            future.set_result(None)
+        finally:
+            with _lock:
+                _inflight.pop(key, None)
+    return future.result()
+
+def _scan_cache():
+    """Returns [(mtime, size, path)] of every thumbnail in the cache folder."""
+    entries = []
+    folder = get_cache_dir()
+    if not os.path.isdir(folder):
+        return entries
+    for shard in os.scandir(folder):
+        if not shard.is_dir():
+            continue
+        for entry in os.scandir(shard.path):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return entries
+
+def _add_to_cache(size, make_room=True):
+    global _cache_bytes
+    with _lock:
+        if _cache_bytes is None:
+            # Counted after the new file was written, so it is already included.
+            _cache_bytes = sum(entry[1] for entry in _scan_cache())
+        else:
+            _cache_bytes += size
+        over_limit = _cache_bytes > THUMBNAIL_CACHE_MB * 2 ** 20
+    # One trim at a time; writers arriving meanwhile skip it.
+    if make_room and over_limit and _trim_lock.acquire(blocking=False):
+        try:
+            trim()
+        finally:
+            _trim_lock.release()
+
+def _cache_full():
+    """True once the cache holds TRIM_TARGET of its limit; pre-generation stops there."""
+    global _cache_bytes
+    with _lock:
+        if _cache_bytes is None:
+            _cache_bytes = sum(entry[1] for entry in _scan_cache())
+        return _cache_bytes >= THUMBNAIL_CACHE_MB * 2 ** 20 * TRIM_TARGET
+
+def trim(limit_bytes=None):
+    """Removes the least recently served thumbnails until the cache fits TRIM_TARGET of its limit. Returns the count."""
+    global _cache_bytes
+    limit_bytes = THUMBNAIL_CACHE_MB * 2 ** 20 if limit_bytes is None else limit_bytes
+    entries = sorted(_scan_cache())
+    total = sum(entry[1] for entry in entries)
+    removed = 0
+    for _, size, path in entries:
+        if total <= limit_bytes * TRIM_TARGET:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+        except OSError as e:
+            logging.warning(f"Could not remove thumbnail {path}: {e}")
+    with _lock:
+        _cache_bytes = total
+    if removed:
+        logging.info(f"Removed {removed} least recently used thumbnails ({total / 2 ** 20:.1f} MB left).")
+    return removed
+
+def get_cache_stats():
+    entries = _scan_cache()
+    return {"available": available(), "thumbnails": len(entries), "bytes": sum(entry[1] for entry in entries),
+            "limit_bytes": int(THUMBNAIL_CACHE_MB * 2 ** 20), "width": THUMBNAIL_WIDTH}
+
+def request_thumbnails():
+    """Queues thumbnail generation for every stored background, e.g. after a sync."""
+    return jobs.scheduler.submit('thumbnails', unique=True)
+
+def thumbnails_task(job=None):
+    """The background task that makes thumbnails of every beatmap background that has none yet."""
+    job = job or jobs.detached()
+    progress = tasks.TASK_PROGRESS['thumbnails']
+    progress.start('Looking for beatmap backgrounds...')
+
+    try:
+        if not available():
+            progress.finish('Pillow is not installed; backgrounds are served at full size.')
+            return
+        osu_folder = os.getenv('OSU_FOLDER')
+        if not osu_folder: raise ValueError("OSU_FOLDER environment variable is not set.")
+        songs_path = os.path.join(osu_folder, 'Songs')
+
+        sources = [
+            path for path in (get_safe_join(songs_path, folder_name, file_name)
+                              for folder_name, file_name in database.get_background_files())
+            if path
+        ]
+        progress.begin_stage('thumbnails', len(sources), message=f"Making thumbnails of {len(sources)} backgrounds...")
+        done = failed = 0
+        cache_full = _cache_full()
+        if not cache_full:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS) as executor:
+                work = ((path, (path, False)) for path in sources)
+                for path, future in jobs.run_bounded(executor, ensure_thumbnail, work, job):
+                    done += 1
+                    progress.advance()
+                    if future.result() is None:
+                        failed += 1
+                        progress.update(failed=failed)
+                    # Going on would only evict what this run just made.
+                    if _cache_full():
+                        cache_full = True
+                        break
+
+        if cache_full and not done:
+            progress.finish('The thumbnail cache is full; other backgrounds get a thumbnail when first shown.')
+            return
+        message = f"Thumbnails are ready for {done - failed} backgrounds ({failed} missing or unreadable)."
+        if cache_full:
+            message += f" The cache is full; the other {len(sources) - done} are made when first shown."
+        progress.finish(message)
+    except jobs.JobCancelled:
+        progress.finish('Thumbnail generation cancelled.', status='cancelled')
+        raise
+    except Exception as e:
+        logging.error(f"Error in thumbnails task: {e}", exc_info=True)
+        progress.fail(e, f'Thumbnail generation failed: {e}')
+
+jobs.scheduler.register('thumbnails', thumbnails_task, priority=jobs.PRIORITY_BACKGROUND)
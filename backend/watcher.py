@@ -2,91 +2,385 @@ import time
 import logging
 import os
 import threading
+from collections import OrderedDict
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
 import database
 import parser
-from config import IS_BUNDLED
+import notifier
+import jobs
+import tasks
 from utils import get_safe_join
 
-# This will hold the pywebview window object once the app starts
-window = None
+# Pushes newly stored replays to the frontend once the app starts
+ui_notifier = None
+# Set by stop_watching(); start_watching() then shuts the watcher down and sets _stopped.
+_stop_requested = threading.Event()
+_stopped = threading.Event()
+_drain_on_stop = True
 
-def process_new_replay(file_path):
-    """Processes a single newly created replay file."""
-    # Add a small delay to ensure the file is fully written by osu!
-    time.sleep(1 if IS_BUNDLED else 0.5)
+# --- Ingest tuning ---
+# A file is considered fully written once its size and mtime stay unchanged
+# for STABILITY_CHECKS consecutive polls.
+STABILITY_POLL_INTERVAL = 0.1
+STABILITY_CHECKS = 2
+STABILITY_TIMEOUT = 30.0
+# Ready files are held this long so a burst (e.g. a replay pack import) is ingested as one batch.
+BATCH_WINDOW = 0.25
+MAX_BATCH_SIZE = 200
+INGEST_WORKERS = 2
+# Number of recently ingested files remembered to drop duplicate create/modify events.
+INGESTED_MEMORY = 10000
 
-    logging.info(f"New replay detected: {os.path.basename(file_path)}")
+# --- Library tuning ---
+# osu! rewrites osu!.db often; an incremental sync starts once osu!.db and Songs
+# have been quiet this long, or at the latest after LIBRARY_SYNC_MAX_DELAY.
+LIBRARY_SYNC_QUIET_SECONDS = float(os.getenv('LIBRARY_SYNC_QUIET_SECONDS', '10'))
+LIBRARY_SYNC_MAX_DELAY = LIBRARY_SYNC_QUIET_SECONDS * 6
+
+def _file_signature(file_path):
+    """Returns (size, mtime) of a file, or None if it cannot be read."""
     try:
-        osu_folder = os.getenv('OSU_FOLDER')
-        if not osu_folder:
-            logging.error("Cannot process new replay, OSU_FOLDER not set.")
-            return
-
-        replay_data = parser.parse_replay_file(file_path)
-        if not replay_data or not replay_data.get('replay_md5'):
-            logging.warning(f"Could not parse new replay file (it may be incomplete): {file_path}")
-            return
-        
-        beatmap_info = database.get_beatmap_by_md5(replay_data['beatmap_md5'])
-        if beatmap_info:
-            folder_name = beatmap_info.get('folder_name')
-            osu_file = beatmap_info.get('osu_file_name')
-            songs_path = os.path.join(osu_folder, 'Songs')
-            osu_file_path = get_safe_join(songs_path, folder_name, osu_file)
-
-            if osu_file_path and os.path.exists(osu_file_path):
-                pp_info = parser.calculate_pp(osu_file_path, replay_data)
-                replay_data.update(pp_info)
-                osu_details = parser.parse_osu_file(osu_file_path)
-                replay_data.update(osu_details)
-        
-        database.add_replay(replay_data)
-        logging.info(f"Successfully processed and added new replay for {replay_data.get('player_name')}.")
-
-        # Notify the frontend that data has changed, triggering a UI refresh
-        if window:
-            window.evaluate_js("document.dispatchEvent(new CustomEvent('datachanged', { bubbles: true }))")
-            logging.info("Dispatched 'datachanged' event to frontend.")
-
-    except Exception as e:
-        logging.error(f"Error processing new replay {file_path}: {e}", exc_info=True)
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+def _build_replay_record(file_path, songs_path):
+    """Parses a replay file and enriches it with pp and .osu details when the beatmap is known."""
+    replay_data = parser.parse_replay_file(file_path)
+    if not replay_data or not replay_data.get('replay_md5'):
+        logging.warning(f"Could not parse new replay file (it may be incomplete): {file_path}")
+        return None
+
+    beatmap_info = database.get_beatmap_by_md5(replay_data['beatmap_md5'])
+    if beatmap_info is None:
+        # A freshly downloaded map osu!.db does not list yet
+        beatmap_info = tasks.add_beatmap_from_songs(songs_path, replay_data['beatmap_md5'])
+    if beatmap_info:
+        folder_name = beatmap_info.get('folder_name')
+        osu_file = beatmap_info.get('osu_file_name')
+        osu_file_path = get_safe_join(songs_path, folder_name, osu_file)
+
+        if osu_file_path and os.path.exists(osu_file_path):
+            pp_info = parser.calculate_pp(osu_file_path, replay_data)
+            replay_data.update(pp_info)
+            osu_details = parser.parse_osu_file(osu_file_path)
+            replay_data.update(osu_details)
+    return replay_data
+
+def ingest_replay_batch(file_paths, job=None):
+    """Processes a batch of fully written replay files and stores them in one write."""
+    osu_folder = os.getenv('OSU_FOLDER')
+    if not osu_folder:
+        logging.error("Cannot process new replays, OSU_FOLDER not set.")
+        return []
+    songs_path = os.path.join(osu_folder, 'Songs')
+
+    replays = []
+    for file_path in file_paths:
+        logging.info(f"New replay detected: {os.path.basename(file_path)}")
+        try:
+            replay_data = _build_replay_record(file_path, songs_path)
+            if replay_data:
+                replays.append(replay_data)
+        except Exception as e:
+            logging.error(f"Error processing new replay {file_path}: {e}", exc_info=True)
+
+    if not replays:
+        return []
+
+    inserted = database.add_replays_batch(replays)
+    logging.info(f"Successfully processed {len(replays)} replay(s), {len(inserted)} of them new.")
+
+    # Send the new rows to the frontend so the views can patch themselves in place
+    if ui_notifier and inserted:
+        ui_notifier.publish(inserted)
+    return replays
+
+# Ingests run as the highest-priority job type, so bulk jobs pause for them.
+jobs.scheduler.register('ingest', ingest_replay_batch, priority=jobs.PRIORITY_LIVE, concurrency=INGEST_WORKERS)
+
+class ReplayIngestQueue:
+    """
+    Collects replay file events, waits until each file has stopped changing
+    and submits ready files to the job scheduler in batches. Repeated events
+    for a file that is pending or was already ingested unchanged are dropped.
+    """
+    def __init__(self):
+        self._pending = {}  # path -> {"signature", "stable", "first_seen"}
+        self._ingested = OrderedDict()  # path -> signature at ingest time
+        self._submitted = []  # ingest jobs that may still be queued or running
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._draining = False
+        self._thread = threading.Thread(target=self._run, name='replay-ingest-dispatch', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, drain=True):
+        """
+        Stops dispatching. With drain, files that are still being written are
+        given until they settle (at most STABILITY_TIMEOUT) and every batch
+        submitted finishes first; otherwise queued batches are cancelled.
+        """
+        self._draining = drain
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join()
+        for job in self._submitted:
+            if drain:
+                job.wait()
+            else:
+                jobs.scheduler.cancel(job_id=job.id)
+
+    def _submit_batch(self, file_paths):
+        self._submitted = [job for job in self._submitted if not job.done_event.is_set()]
+        self._submitted.append(jobs.scheduler.submit('ingest', file_paths))
+
+    def submit(self, file_path):
+        """Registers a created or modified replay file."""
+        with self._lock:
+            if file_path in self._pending:
+                return
+            signature = _file_signature(file_path)
+            if signature is not None and self._ingested.get(file_path) == signature:
+                return
+            self._pending[file_path] = {"signature": signature, "stable": 0, "first_seen": time.monotonic()}
+        self._wakeup.set()
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _collect_ready(self):
+        """Polls pending files and returns those whose size and mtime have settled."""
+        ready = []
+        now = time.monotonic()
+        with self._lock:
+            for file_path, state in list(self._pending.items()):
+                signature = _file_signature(file_path)
+                if signature is None or signature[0] == 0:
+                    state["stable"] = 0
+                elif signature == state["signature"]:
+                    state["stable"] += 1
+                else:
+                    state["signature"] = signature
+                    state["stable"] = 0
+
+                if state["stable"] >= STABILITY_CHECKS:
+                    ready.append(file_path)
+                    del self._pending[file_path]
+                    self._ingested[file_path] = signature
+                    self._ingested.move_to_end(file_path)
+                    if len(self._ingested) > INGESTED_MEMORY:
+                        self._ingested.popitem(last=False)
+                elif now - state["first_seen"] > STABILITY_TIMEOUT:
+                    logging.warning(f"Replay file never settled, skipping: {file_path}")
+                    del self._pending[file_path]
+        return ready
+
+    def _run(self):
+        batch = []
+        batch_started = None
+        while not self._stopped.is_set() or (self._draining and self.pending_count()):
+            if not batch and self.pending_count() == 0:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            time.sleep(STABILITY_POLL_INTERVAL)
+            ready = self._collect_ready()
+            if ready:
+                if not batch:
+                    batch_started = time.monotonic()
+                batch.extend(ready)
+
+            # Flush when nothing else is settling, the window expired, or the batch is full.
+            burst_over = self.pending_count() == 0
+            window_expired = batch and time.monotonic() - batch_started >= BATCH_WINDOW
+            if batch and (burst_over or window_expired or len(batch) >= MAX_BATCH_SIZE):
+                for i in range(0, len(batch), MAX_BATCH_SIZE):
+                    self._submit_batch(batch[i:i + MAX_BATCH_SIZE])
+                batch = []
+
+        if batch:
+            self._submit_batch(batch)
 
 class ReplayEventHandler(FileSystemEventHandler):
     """Handles file system events for the replays folder."""
+    def __init__(self, ingest_queue):
+        super().__init__()
+        self.ingest_queue = ingest_queue
+
     def on_created(self, event):
         if not event.is_directory and event.src_path.endswith('.osr'):
-            # Run processing in a new thread to avoid blocking the watchdog observer
-            thread = threading.Thread(target=process_new_replay, args=(event.src_path,))
-            thread.daemon = True
-            thread.start()
+            self.ingest_queue.submit(event.src_path)
+
+    def on_modified(self, event):
+        self.on_created(event)
+
+    def on_moved(self, event):
+        if not event.is_directory and event.dest_path.endswith('.osr'):
+            self.ingest_queue.submit(event.dest_path)
+
+class LibrarySyncDebouncer:
+    """
+    Collects osu!.db rewrites and new Songs folders and submits one
+    incremental sync per quiet period. While an earlier incremental sync is
+    still queued, new changes wait for the next period instead of piling up.
+    """
+    def __init__(self, quiet_seconds=LIBRARY_SYNC_QUIET_SECONDS, max_delay=LIBRARY_SYNC_MAX_DELAY):
+        self._quiet_seconds = quiet_seconds
+        self._max_delay = max_delay
+        self._song_folders = {}  # folder name -> None, kept in arrival order
+        self._changed = False
+        self._first_change = None
+        self._timer = None
+        self._submitted = None
+        self._lock = threading.Lock()
+
+    def osu_db_changed(self):
+        self._record()
+
+    def song_folder_added(self, folder_name):
+        self._record(folder_name)
+
+    def _record(self, folder_name=None):
+        with self._lock:
+            if folder_name:
+                self._song_folders[folder_name] = None
+            if not self._changed:
+                self._changed = True
+                self._first_change = time.monotonic()
+            self._schedule(self._quiet_seconds)
+
+    def _schedule(self, delay):
+        """Restarts the quiet-period timer (called with the lock held)."""
+        if self._timer is not None:
+            self._timer.cancel()
+        overdue = self._first_change + self._max_delay - time.monotonic()
+        self._timer = threading.Timer(max(0.0, min(delay, overdue)), self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        """Submits the collected changes as one incremental sync."""
+        with self._lock:
+            self._timer = None
+            if not self._changed:
+                return
+            if self._submitted is not None and self._submitted.status == 'queued':
+                # Check again after a full quiet period; an overdue max_delay would otherwise retry immediately.
+                self._first_change = time.monotonic()
+                self._schedule(self._quiet_seconds)
+                return
+            song_folders = list(self._song_folders)
+            self._song_folders = {}
+            self._changed = False
+            logging.info(f"Library changed, starting incremental sync ({len(song_folders)} new song folder(s)).")
+            self._submitted = jobs.scheduler.submit('sync', incremental=True, song_folders=song_folders)
+
+    def close(self):
+        """Drops changes that have not been submitted yet."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+class LibraryEventHandler(FileSystemEventHandler):
+    """Handles osu!.db rewrites (osu! folder) and new beatmap set folders (top level of Songs)."""
+    def __init__(self, debouncer, osu_folder_path):
+        super().__init__()
+        self.debouncer = debouncer
+        self.osu_db_path = os.path.normcase(os.path.join(osu_folder_path, 'osu!.db'))
+        self.songs_path = os.path.normcase(os.path.join(osu_folder_path, 'Songs'))
 
-def start_watching(osu_folder_path, window_obj):
-    """Initializes and starts the file system watcher."""
-    global window
-    window = window_obj
+    def _handle(self, path, is_directory):
+        path = os.path.normcase(path)
+        if path == self.osu_db_path:
+            self.debouncer.osu_db_changed()
+        elif is_directory and os.path.dirname(path) == self.songs_path:
+            self.debouncer.song_folder_added(os.path.basename(path))
 
+    def on_created(self, event):
+        self._handle(event.src_path, event.is_directory)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self._handle(event.src_path, False)
+
+    def on_moved(self, event):
+        self._handle(event.dest_path, event.is_directory)
+
+def start_watching(osu_folder_path, dispatch=None):
+    """
+    Initializes and starts the file system watcher, then blocks until
+    stop_watching() is called. New replays are pushed through dispatch
+    (see notifier.build_dispatcher), by default to /api/events.
+    """
+    global ui_notifier
     if not osu_folder_path:
         logging.warning("osu! folder not set. Watchdog service will not start.")
         return
+    _stopped.clear()
+    ui_notifier = notifier.DeltaNotifier(dispatch or notifier.build_dispatcher())
+
+    observer = Observer()
+    watched = []
 
     replays_path = os.path.join(osu_folder_path, 'Data', 'r')
-    if not os.path.isdir(replays_path):
-        logging.error(f"Replays directory not found at: {replays_path}. Watchdog will not start.")
-        return
+    ingest_queue = None
+    if os.path.isdir(replays_path):
+        ingest_queue = ReplayIngestQueue()
+        ingest_queue.start()
+        observer.schedule(ReplayEventHandler(ingest_queue), replays_path, recursive=False)
+        watched.append(replays_path)
+    else:
+        logging.error(f"Replays directory not found at: {replays_path}. New replays will not be detected.")
+
+    # Both are watched non-recursively: osu!.db lives in the osu! folder and
+    # only new set folders in Songs matter, not the files written inside them.
+    library_debouncer = LibrarySyncDebouncer()
+    library_handler = LibraryEventHandler(library_debouncer, osu_folder_path)
+    observer.schedule(library_handler, osu_folder_path, recursive=False)
+    watched.append(os.path.join(osu_folder_path, 'osu!.db'))
+    songs_path = os.path.join(osu_folder_path, 'Songs')
+    if os.path.isdir(songs_path):
+        observer.schedule(library_handler, songs_path, recursive=False)
+        watched.append(songs_path)
 
-    event_handler = ReplayEventHandler()
-    observer = Observer()
-    observer.schedule(event_handler, replays_path, recursive=False)
-    
     observer.start()
-    logging.info(f"Watchdog service started, monitoring: {replays_path}")
+    logging.info(f"Watchdog service started, monitoring: {', '.join(watched)}")
 
     try:
-        while observer.is_alive():
-            observer.join(1)
+        while observer.is_alive() and not _stop_requested.wait(1):
+            pass
     except KeyboardInterrupt:
+        pass
+    try:
         observer.stop()
-    observer.join()
\ No newline at end of file
+        observer.join()
+        library_debouncer.close()
+        if ingest_queue:
+            ingest_queue.stop(drain=_drain_on_stop)
+        ui_notifier.close()
+        logging.info("Watchdog service stopped.")
+    finally:
+        _stopped.set()
+
+def stop_watching(drain=True, timeout=None):
+    """
+    Stops the watcher started by start_watching(). With drain, replays that
+    were already detected are still ingested and pushed before it returns.
+    Returns False if the watcher had not stopped within timeout seconds.
+    """
+    global _drain_on_stop
+    _drain_on_stop = drain
+    _stop_requested.set()
+    if ui_notifier is None:
+        return True
+    return _stopped.wait(timeout)
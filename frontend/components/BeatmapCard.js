@@ -1,4 +1,4 @@
-import { getSongFileUrl } from '../services/api.js';
+import { getSongFileUrl, getThumbnailUrl } from '../services/api.js';
 import { playAudio } from '../utils/audioPlayer.js';
 
 // Helper function to create an element with classes and text content securely
@@ -13,7 +13,7 @@ export function createBeatmapCard(beatmap) {
     const card = createElement('div', ['beatmap-card']);
 
     if (beatmap.folder_name && beatmap.background_file) {
-        const imageUrl = getSongFileUrl(beatmap.folder_name, beatmap.background_file);
+        const imageUrl = getThumbnailUrl(beatmap.folder_name, beatmap.background_file);
         card.style.backgroundImage = `url("${CSS.escape(imageUrl)}")`;
         card.classList.add('has-bg');
     }
@@ -93,12 +93,14 @@ export function createBeatmapCard(beatmap) {
     // --- Event Listeners ---
     if (beatmap.folder_name && beatmap.audio_file) {
         const audioUrl = getSongFileUrl(beatmap.folder_name, beatmap.audio_file);
+        const previewStart = beatmap.preview_time > 0 ? beatmap.preview_time / 1000 : 0;
         playButton.addEventListener('click', (e) => {
             e.stopPropagation();
             playAudio(
                 audioUrl,
                 () => { playButton.textContent = '❚❚'; }, // onPlay
-                () => { playButton.textContent = '▶'; }  // onEnd
+                () => { playButton.textContent = '▶'; }, // onEnd
+                { startAt: previewStart }
             );
         });
     } else {
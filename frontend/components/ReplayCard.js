@@ -1,4 +1,4 @@
-import { getSongFileUrl } from '../services/api.js';
+import { getSongFileUrl, getThumbnailUrl } from '../services/api.js';
 import { getModsFromInt } from '../utils/mods.js';
 import { playAudio } from '../utils/audioPlayer.js';
 
@@ -15,7 +15,7 @@ export function createReplayCard(item) {
     const beatmap = item.beatmap || {};
 
     if (beatmap.folder_name && beatmap.background_file) {
-        const imageUrl = getSongFileUrl(beatmap.folder_name, beatmap.background_file);
+        const imageUrl = getThumbnailUrl(beatmap.folder_name, beatmap.background_file);
         card.style.backgroundImage = `url("${CSS.escape(imageUrl)}")`;
     }
 
@@ -114,12 +114,14 @@ export function createReplayCard(item) {
 
     if (beatmap.folder_name && beatmap.audio_file) {
         const audioUrl = getSongFileUrl(beatmap.folder_name, beatmap.audio_file);
+        const previewStart = beatmap.preview_time > 0 ? beatmap.preview_time / 1000 : 0;
         playButton.addEventListener('click', e => {
             e.stopPropagation();
             playAudio(
                 audioUrl,
                 () => { playButton.textContent = '❚❚'; }, // onPlay
-                () => { playButton.textContent = '▶'; }  // onEnd / onPause
+                () => { playButton.textContent = '▶'; }, // onEnd / onPause
+                { startAt: previewStart }
             );
         });
     } else {
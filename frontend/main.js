@@ -1,12 +1,12 @@
-import { getPlayers, getConfig, getProgressStatus } from './services/api.js';
-import { createScoresView, loadScores } from './views/ScoresView.js';
-import { createProfileView, loadProfile } from './views/ProfileView.js';
+import { getPlayers, getConfig, subscribeToProgress, subscribeToServerEvents } from './services/api.js';
+import { createScoresView, loadScores, applyScoresDelta } from './views/ScoresView.js';
+import { createProfileView, loadProfile, applyProfileDelta } from './views/ProfileView.js';
 import { createBeatmapsView, loadBeatmaps } from './views/BeatmapsView.js';
 import { createConfigView } from './views/ConfigView.js';
 import { createRecommenderView } from './views/RecommenderView.js';
 import { stopAudio } from './utils/audioPlayer.js';
 
-let progressInterval = null;
+let progressSource = null;
 let lastProgress = {};
 
 function updateGlobalStatus(progress) {
@@ -35,68 +35,67 @@ function updateGlobalStatus(progress) {
     }
 }
 
-function stopGlobalProgressPolling() {
-    if (progressInterval) {
-        clearInterval(progressInterval);
-        progressInterval = null;
-    }
+function isAnyTaskRunning(progress) {
+    return progress.sync?.status === 'running' || progress.scan?.status === 'running';
 }
 
-async function pollProgress() {
-    try {
-        const progress = await getProgressStatus();
-        
-        document.dispatchEvent(new CustomEvent('progressupdated', { detail: progress }));
-        updateGlobalStatus(progress);
-        
-        const syncProgress = progress.sync;
-        const lastSyncProgress = lastProgress.sync || {};
-        const scanProgress = progress.scan;
-        const lastScanProgress = lastProgress.scan || {};
-
-        let shouldRefresh = false;
-
-        // Check for sync updates: either the task just finished, or a batch was completed.
-        if (
-            (lastSyncProgress.status === 'running' && syncProgress.status !== 'running') ||
-            (syncProgress.status === 'running' && syncProgress.batches_done > (lastSyncProgress.batches_done || 0))
-        ) {
-            shouldRefresh = true;
-        }
+function handleProgress(progress) {
+    document.dispatchEvent(new CustomEvent('progressupdated', { detail: progress }));
+    updateGlobalStatus(progress);
 
-        // Check for scan updates (final only)
-        if (lastScanProgress.status === 'running' && scanProgress.status !== 'running') {
-            shouldRefresh = true;
-        }
+    const syncProgress = progress.sync;
+    const lastSyncProgress = lastProgress.sync || {};
+    const scanProgress = progress.scan;
+    const lastScanProgress = lastProgress.scan || {};
 
-        if (shouldRefresh) {
-            document.dispatchEvent(new CustomEvent('datachanged', { bubbles: true }));
-        }
+    let shouldRefresh = false;
 
-        lastProgress = progress;
+    // Check for sync updates: either the task just finished, or a batch was completed.
+    if (
+        (lastSyncProgress.status === 'running' && syncProgress.status !== 'running') ||
+        (syncProgress.status === 'running' && syncProgress.batches_done > (lastSyncProgress.batches_done || 0))
+    ) {
+        shouldRefresh = true;
+    }
 
-        if (progress.sync.status !== 'running' && progress.scan.status !== 'running') {
-            stopGlobalProgressPolling();
-            // Clear the message after a few seconds
-            setTimeout(() => {
-                const currentStatus = lastProgress.sync.status !== 'running' && lastProgress.scan.status !== 'running';
-                if(currentStatus) {
-                   document.getElementById('status-message').textContent = '';
-                }
-            }, 5000);
-        }
-    } catch (error) {
-        console.error("Progress polling failed:", error);
-        document.getElementById('status-message').textContent = 'Error fetching status.';
-        stopGlobalProgressPolling();
+    // Check for scan updates (final only)
+    if (lastScanProgress.status === 'running' && scanProgress.status !== 'running') {
+        shouldRefresh = true;
+    }
+
+    // An imported database replaces everything (final only)
+    const backupProgress = progress.backup || {};
+    if (lastProgress.backup?.status === 'running' && backupProgress.status === 'complete' && backupProgress.operation === 'import') {
+        shouldRefresh = true;
+    }
+
+    // Replays that just got their pp after a sync (final only)
+    const backfillProgress = progress.backfill || {};
+    if (lastProgress.backfill?.status === 'running' && backfillProgress.status !== 'running' && backfillProgress.updated > 0) {
+        shouldRefresh = true;
+    }
+
+    if (shouldRefresh) {
+        document.dispatchEvent(new CustomEvent('datachanged', { bubbles: true }));
+    }
+
+    const wasRunning = isAnyTaskRunning(lastProgress);
+    lastProgress = progress;
+
+    if (wasRunning && !isAnyTaskRunning(progress)) {
+        // Clear the message after a few seconds
+        setTimeout(() => {
+            if (!isAnyTaskRunning(lastProgress)) {
+                document.getElementById('status-message').textContent = '';
+            }
+        }, 5000);
     }
 }
 
-function startGlobalProgressPolling() {
-    if (progressInterval) return;
-    lastProgress = {}; // Reset last progress state
-    pollProgress(); // Poll immediately
-    progressInterval = setInterval(pollProgress, 1000);
+function startProgressStream() {
+    // The server pushes a snapshot on connect and then only when something changes.
+    if (progressSource) return;
+    progressSource = subscribeToProgress(handleProgress);
 }
 
 
@@ -106,6 +105,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const userSelectorContainer = document.getElementById('user-selector-container');
 
     let currentPlayer = null;
+    let knownPlayers = [];
 
     const views = {
         scores: createScoresView(),
@@ -121,9 +121,9 @@ document.addEventListener('DOMContentLoaded', () => {
         mainContent.appendChild(views[key]);
     }
     
-    mainContent.addEventListener('taskstarted', startGlobalProgressPolling);
 
     function populatePlayerSelector(players, selectedPlayer) {
+        knownPlayers = players;
         try {
             userSelectorContainer.innerHTML = ''; // Clear the container first
 
@@ -259,13 +259,29 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
-    async function initializeApp() {
-        // Check for running tasks on startup
-        const initialProgress = await getProgressStatus();
-        if(initialProgress.sync.status === 'running' || initialProgress.scan.status === 'running') {
-            startGlobalProgressPolling();
+    // The watcher pushes new replays together with the updated player stats,
+    // so the active view is patched in place instead of being reloaded.
+    document.addEventListener('replaysadded', (e) => {
+        const delta = e.detail;
+
+        const newPlayers = Object.keys(delta.players).filter(player => !knownPlayers.includes(player));
+        if (newPlayers.length > 0) {
+            if (!currentPlayer) currentPlayer = newPlayers[0];
+            populatePlayerSelector([...knownPlayers, ...newPlayers].sort(), currentPlayer);
         }
 
+        const activeView = mainContent.querySelector('.view[style*="display: block"]');
+        const viewName = activeView?.dataset.viewName;
+        if (viewName === 'scores') applyScoresDelta(views.scores, delta);
+        else if (viewName === 'profile') applyProfileDelta(views.profile, delta);
+    });
+
+    async function initializeApp() {
+        // Follow task progress for the lifetime of the page
+        startProgressStream();
+        // A headless server sends new replays over /api/events instead of through the window
+        subscribeToServerEvents(['replaysadded']);
+
         const players = await getPlayers();
         const config = await getConfig();
         
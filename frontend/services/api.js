@@ -65,8 +65,12 @@ export const scanReplays = async () => {
     return response.json();
 };
 
-export const syncBeatmaps = async () => {
-    const response = await fetch(`${API_BASE_URL}/sync-beatmaps`, { method: 'POST' });
+export const syncBeatmaps = async ({ profile = false } = {}) => {
+    const response = await fetch(`${API_BASE_URL}/sync-beatmaps`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ profile }),
+    });
      if (response.status !== 202 && !response.ok) {
         const errorData = await response.json();
         throw new Error(errorData.error || 'Failed to start beatmap sync.');
@@ -74,8 +78,21 @@ export const syncBeatmaps = async () => {
     return response.json();
 };
 
+export const cancelTask = async (taskType) => {
+    const response = await fetch(`${API_BASE_URL}/jobs/cancel`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ type: taskType })
+    });
+    if (!response.ok) {
+        const errorData = await response.json();
+        throw new Error(errorData.error || `Failed to cancel ${taskType}.`);
+    }
+    return response.json();
+};
+
 export const getProgressStatus = async () => {
-    // This one is polled constantly, so cache-busting isn't strictly necessary but is good practice.
+    // One-off snapshot; live updates come from subscribeToProgress.
     const response = await fetch(addCacheBust(`${API_BASE_URL}/progress-status`));
     if (!response.ok) {
         throw new Error('Failed to fetch progress status.');
@@ -83,11 +100,86 @@ export const getProgressStatus = async () => {
     return response.json();
 };
 
+// Wait before reopening an event stream the server refused (e.g. too many open streams).
+const STREAM_RETRY_MS = 5000;
+
+/**
+ * Opens an EventSource and keeps it open. EventSource reconnects on its own
+ * when a stream ends, but gives up after an error response, so it is then
+ * reopened after STREAM_RETRY_MS.
+ * @param {() => string} getUrl Returns the URL to connect to.
+ * @param {(source: EventSource) => void} attach Adds the listeners to each new EventSource.
+ * @returns {{close: () => void}} Call close() to unsubscribe.
+ */
+const openEventStream = (getUrl, attach) => {
+    let source = null;
+    let retryTimer = null;
+    let closed = false;
+    const connect = () => {
+        source = new EventSource(getUrl());
+        attach(source);
+        source.addEventListener('error', () => {
+            if (!closed && source.readyState === EventSource.CLOSED) {
+                retryTimer = setTimeout(connect, STREAM_RETRY_MS);
+            }
+        });
+    };
+    connect();
+    return {
+        close: () => {
+            closed = true;
+            clearTimeout(retryTimer);
+            source.close();
+        },
+    };
+};
+
+/**
+ * Subscribes to the server-sent progress stream.
+ * @param {function(object): void} onProgress Called with a snapshot of every task whenever progress changes.
+ * @returns {{close: () => void}} Call close() to unsubscribe.
+ */
+export const subscribeToProgress = (onProgress) => openEventStream(
+    () => `${API_BASE_URL}/progress-stream`,
+    (source) => {
+        source.onmessage = (event) => onProgress(JSON.parse(event.data));
+        source.onerror = () => console.warn('Progress stream interrupted, reconnecting...');
+    }
+);
+
+/**
+ * Subscribes to watcher events pushed by a headless server and re-fires them
+ * as DOM events (e.g. 'replaysadded'), the way the desktop window receives them.
+ * @param {string[]} eventNames The server-sent event types to forward.
+ * @returns {{close: () => void}} Call close() to unsubscribe.
+ */
+export const subscribeToServerEvents = (eventNames) => {
+    let lastEventId = null;
+    return openEventStream(
+        () => `${API_BASE_URL}/events${lastEventId ? `?last_event_id=${lastEventId}` : ''}`,
+        (source) => {
+            source.addEventListener('streamstart', (event) => { lastEventId = event.lastEventId; });
+            eventNames.forEach(eventName => source.addEventListener(eventName, (event) => {
+                lastEventId = event.lastEventId;
+                document.dispatchEvent(new CustomEvent(eventName, { detail: JSON.parse(event.data) }));
+            }));
+        }
+    );
+};
+
 export const getSongFileUrl = (folderName, fileName) => {
     if (!folderName || !fileName) return '';
     return `${API_BASE_URL}/songs/${encodeURIComponent(folderName)}/${encodeURIComponent(fileName)}`;
 };
 
+/**
+ * URL of a card-sized thumbnail of a beatmap background (the backend falls back to the original image).
+ */
+export const getThumbnailUrl = (folderName, fileName) => {
+    if (!folderName || !fileName) return '';
+    return `${API_BASE_URL}/thumbnails/${encodeURIComponent(folderName)}/${encodeURIComponent(fileName)}`;
+};
+
 export const getBeatmaps = async (page = 1, limit = 50, searchTerm = null) => {
     let url = `${API_BASE_URL}/beatmaps?page=${page}&limit=${limit}`;
     if (searchTerm) {
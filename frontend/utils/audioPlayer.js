@@ -17,6 +17,9 @@ function stopCurrent(shouldTriggerEnd = true) {
         currentlyPlaying.audio.onended = null;
         
         currentlyPlaying.audio.pause();
+        // Dropping the source aborts any download still in progress.
+        currentlyPlaying.audio.removeAttribute('src');
+        currentlyPlaying.audio.load();
 
         if (shouldTriggerEnd && currentlyPlaying.onEnd) {
             currentlyPlaying.onEnd();
@@ -31,8 +34,11 @@ function stopCurrent(shouldTriggerEnd = true) {
  * @param {string} audioUrl - The URL of the song to play.
  * @param {function} onPlayCallback - Function to call when playback starts.
  * @param {function} onEndCallback - Function to call when playback stops or is paused.
+ * @param {object} [options]
+ * @param {number} [options.startAt=0] - Position in seconds to start from, e.g. the beatmap's preview point.
+ *   The server answers Range requests, so only the audio from there on is downloaded.
  */
-export function playAudio(audioUrl, onPlayCallback, onEndCallback) {
+export function playAudio(audioUrl, onPlayCallback, onEndCallback, { startAt = 0 } = {}) {
     const isSameSong = currentlyPlaying.url === audioUrl;
 
     if (isSameSong) {
@@ -46,7 +52,10 @@ export function playAudio(audioUrl, onPlayCallback, onEndCallback) {
         // If it's a new song, stop the old one.
         stopCurrent(); 
 
-        const audio = new Audio(audioUrl);
+        const audio = new Audio();
+        audio.preload = 'metadata';
+        // A media fragment makes the browser seek before it starts buffering.
+        audio.src = startAt > 0 ? `${audioUrl}#t=${startAt}` : audioUrl;
         // Store the new audio and its callbacks in our state.
         currentlyPlaying = { url: audioUrl, audio, onPlay: onPlayCallback, onEnd: onEndCallback };
         
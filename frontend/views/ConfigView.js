@@ -1,8 +1,23 @@
-import { syncBeatmaps, scanReplays, getProgressStatus, getConfig, saveConfig, getPlayers, exportData, importData } from '../services/api.js';
+import { syncBeatmaps, scanReplays, cancelTask, getProgressStatus, getConfig, saveConfig, getPlayers, exportData, importData } from '../services/api.js';
 
 let viewElement = null;
 let isViewActive = false;
 
+function formatDuration(seconds) {
+    if (seconds < 60) return `${Math.ceil(seconds)}s`;
+    const minutes = Math.floor(seconds / 60);
+    if (minutes < 60) return `${minutes}m ${Math.round(seconds % 60)}s`;
+    return `${Math.floor(minutes / 60)}h ${minutes % 60}m`;
+}
+
+function formatProgressText(data) {
+    const details = [];
+    if (data.throughput > 0) details.push(`${data.throughput.toLocaleString()}/s`);
+    if (data.eta !== null && data.eta !== undefined) details.push(`ETA ${formatDuration(data.eta)}`);
+    if (data.errors > 0) details.push(`${data.errors} error${data.errors === 1 ? '' : 's'}`);
+    return details.length > 0 ? `${data.message} (${details.join(', ')})` : data.message;
+}
+
 function handleProgressUpdate(progress) {
     if (!viewElement || !isViewActive) return;
 
@@ -16,13 +31,14 @@ function handleProgressUpdate(progress) {
 
     const syncData = progress.sync;
     const scanData = progress.scan;
+    const backupData = progress.backup;
 
     // Update Sync Progress UI
     if (syncData.status === 'running') {
         syncProgressContainer.style.display = 'block';
         syncProgressBar.value = syncData.current;
         syncProgressBar.max = syncData.total || 100;
-        syncProgressText.textContent = syncData.message;
+        syncProgressText.textContent = formatProgressText(syncData);
     } else {
         syncProgressContainer.style.display = 'none';
     }
@@ -32,10 +48,21 @@ function handleProgressUpdate(progress) {
         scanProgressContainer.style.display = 'block';
         scanProgressBar.value = scanData.current;
         scanProgressBar.max = scanData.total || 100;
-        scanProgressText.textContent = scanData.message;
+        scanProgressText.textContent = formatProgressText(scanData);
     } else {
         scanProgressContainer.style.display = 'none';
     }
+
+    // Update Export/Import Progress UI
+    const backupProgressContainer = viewElement.querySelector('#backup-progress-container');
+    if (backupData && backupData.status === 'running') {
+        backupProgressContainer.style.display = 'block';
+        viewElement.querySelector('#backup-progress').value = backupData.current;
+        viewElement.querySelector('#backup-progress').max = backupData.total || 100;
+        viewElement.querySelector('#backup-progress-text').textContent = backupData.message;
+    } else {
+        backupProgressContainer.style.display = 'none';
+    }
 }
 
 async function loadConfigData(view) {
@@ -90,10 +117,14 @@ export function createConfigView() {
         <div class="config-action-card">
             <h3>Sync Beatmap Database</h3>
             <p>Parses your osu!.db and all .osu files to build a local database of your beatmaps. This is required for map details and backgrounds to appear correctly. Run this once after adding new maps. This may take some time.</p>
-            <button id="sync-beatmaps-button">Start Sync</button>
+            <div class="data-actions">
+                <button id="sync-beatmaps-button">Start Sync</button>
+                <button id="profile-sync-button" title="Runs a sync and saves a performance profile next to the database">Profile Sync</button>
+            </div>
             <div class="progress-container" id="sync-progress-container">
                 <progress id="sync-progress" class="progress-bar" value="0" max="100"></progress>
                 <span id="sync-progress-text" class="progress-text"></span>
+                <button id="sync-cancel-button">Cancel</button>
             </div>
         </div>
 
@@ -104,28 +135,45 @@ export function createConfigView() {
             <div class="progress-container" id="scan-progress-container">
                 <progress id="scan-progress" class="progress-bar" value="0" max="100"></progress>
                 <span id="scan-progress-text" class="progress-text"></span>
+                <button id="scan-cancel-button">Cancel</button>
             </div>
         </div>
 
         <div class="config-action-card">
             <h3>Data Management</h3>
-            <p>Export your score database for backup, or import a database from another installation. Importing will replace your current data and requires an application restart.</p>
+            <p>Export your score database for backup, or import a database from another installation. Importing will replace your current data. Both run in the background while you keep using the app.</p>
             <div class="data-actions">
                 <button id="export-data-button">Export Data</button>
                 <button id="import-data-button">Import Data</button>
             </div>
+            <div class="progress-container" id="backup-progress-container">
+                <progress id="backup-progress" class="progress-bar" value="0" max="100"></progress>
+                <span id="backup-progress-text" class="progress-text"></span>
+            </div>
         </div>
     `;
 
+    let lastBackupStatus = null;
+
     document.addEventListener('progressupdated', (e) => {
         handleProgressUpdate(e.detail);
         
         // Also update button states based on global progress
-        const { sync, scan } = e.detail;
-        const isTaskRunning = sync.status === 'running' || scan.status === 'running';
+        const { sync, scan, backup } = e.detail;
+        const isBackupRunning = backup?.status === 'running';
+        const isTaskRunning = sync.status === 'running' || scan.status === 'running' || isBackupRunning;
         view.querySelector('#sync-beatmaps-button').disabled = isTaskRunning;
+        view.querySelector('#profile-sync-button').disabled = isTaskRunning;
         view.querySelector('#scan-replays-button-config').disabled = isTaskRunning;
         view.querySelector('#save-config-button').disabled = isTaskRunning;
+        view.querySelector('#export-data-button').disabled = isBackupRunning;
+        view.querySelector('#import-data-button').disabled = isBackupRunning;
+
+        // Report the outcome of an export or import once it has finished
+        if (backup && lastBackupStatus === 'running' && backup.status !== 'running') {
+            setStatus(backup.message, backup.status === 'complete' ? 'success' : 'error');
+        }
+        lastBackupStatus = backup?.status;
     });
 
     view.addEventListener('viewactivated', async () => {
@@ -194,6 +242,16 @@ export function createConfigView() {
         }
     });
 
+    view.querySelector('#profile-sync-button').addEventListener('click', async () => {
+        try {
+            await syncBeatmaps({ profile: true });
+            setStatus('Profiling this sync. The profile is saved in the "profiles" folder next to the database when it finishes.', 'success');
+            view.dispatchEvent(new CustomEvent('taskstarted', { bubbles: true }));
+        } catch (error) {
+            setStatus(`Error starting sync: ${error.message}`, 'error');
+        }
+    });
+
     scanButton.addEventListener('click', async () => {
         statusMessage.style.display = 'none';
         try {
@@ -204,6 +262,23 @@ export function createConfigView() {
         }
     });
 
+    // Cancelled tasks keep everything they saved before stopping.
+    view.querySelector('#sync-cancel-button').addEventListener('click', async () => {
+        try {
+            await cancelTask('sync');
+        } catch (error) {
+            setStatus(`Error cancelling sync: ${error.message}`, 'error');
+        }
+    });
+
+    view.querySelector('#scan-cancel-button').addEventListener('click', async () => {
+        try {
+            await cancelTask('scan');
+        } catch (error) {
+            setStatus(`Error cancelling scan: ${error.message}`, 'error');
+        }
+    });
+
     const exportButton = view.querySelector('#export-data-button');
     const importButton = view.querySelector('#import-data-button');
 
@@ -218,20 +293,11 @@ export function createConfigView() {
     });
 
     importButton.addEventListener('click', async () => {
-        const allButtons = view.querySelectorAll('button');
-        const allInputs = view.querySelectorAll('input, select');
-        
         setStatus('Opening import dialog...', 'info');
 
         try {
             const result = await importData();
             setStatus(result.message, result.status);
-
-            // If import was successful, disable controls to encourage a restart.
-            if (result.status === 'success') {
-                allButtons.forEach(b => b.disabled = true);
-                allInputs.forEach(i => i.disabled = true);
-            }
         } catch (error) {
             setStatus(`Import failed: ${error.message}`, 'error');
         }
@@ -3,6 +3,7 @@ import { createReplayCard } from '../components/ReplayCard.js';
 import { getModsFromInt } from '../utils/mods.js';
 
 let allScores = [];
+let loadedPlayer = null;
 let viewInitialized = false;
 let profileChart = null;
 const activeModFilters = new Set();
@@ -267,6 +268,33 @@ function applyFiltersAndRender(viewElement) {
     document.getElementById('status-message').textContent = `Displaying ${filteredScores.length} scores.`;
 }
 
+function renderStats(statsContainer, stats) {
+    statsContainer.innerHTML = `
+        <div class="stat-item"><span class="stat-label">Total PP</span><span class="stat-value">${stats.total_pp.toLocaleString()}</span></div>
+        <div class="stat-item"><span class="stat-label">Play Count</span><span class="stat-value">${stats.play_count.toLocaleString()}</span></div>
+        <div class="stat-item"><span class="stat-label">Top Play</span><span class="stat-value">${stats.top_play_pp.toLocaleString()}pp</span></div>
+    `;
+}
+
+function renderModButtons(viewElement) {
+    const modContainer = viewElement.querySelector('#mod-filter-container');
+    const shownMods = new Set([...modContainer.querySelectorAll('.mod-button')].map(button => button.dataset.mod));
+    const uniqueMods = [...new Set(allScores.flatMap(r => getModsFromInt(r.mods_used)))].sort();
+    uniqueMods.filter(mod => !shownMods.has(mod)).forEach(mod => {
+        const button = document.createElement('button');
+        button.className = 'mod-button';
+        button.textContent = mod;
+        button.dataset.mod = mod;
+        button.addEventListener('click', () => {
+            button.classList.toggle('active');
+            if (activeModFilters.has(mod)) activeModFilters.delete(mod);
+            else activeModFilters.add(mod);
+            applyFiltersAndRender(viewElement);
+        });
+        modContainer.appendChild(button);
+    });
+}
+
 export function createProfileView() {
     const view = document.createElement('div');
     view.id = 'profile-view';
@@ -332,6 +360,7 @@ export async function loadProfile(viewElement, playerName) {
     if (!playerName) {
         viewElement.innerHTML = '<h2>Select a player to view their profile.</h2>';
         viewInitialized = false;
+        loadedPlayer = null;
         return;
     }
 
@@ -344,6 +373,7 @@ export async function loadProfile(viewElement, playerName) {
     statsContainer.innerHTML = 'Loading stats...';
     modContainer.innerHTML = ''; 
     activeModFilters.clear(); 
+    loadedPlayer = null;
     statusMessage.textContent = `Loading ${playerName}'s profile...`;
     
     if (!viewInitialized) {
@@ -360,28 +390,11 @@ export async function loadProfile(viewElement, playerName) {
             getReplays(playerName, 1, 100000)
         ]);
 
-        statsContainer.innerHTML = `
-            <div class="stat-item"><span class="stat-label">Total PP</span><span class="stat-value">${stats.total_pp.toLocaleString()}</span></div>
-            <div class="stat-item"><span class="stat-label">Play Count</span><span class="stat-value">${stats.play_count.toLocaleString()}</span></div>
-            <div class="stat-item"><span class="stat-label">Top Play</span><span class="stat-value">${stats.top_play_pp.toLocaleString()}pp</span></div>
-        `;
+        renderStats(statsContainer, stats);
         
         allScores = replaysData.replays;
-        
-        const uniqueMods = [...new Set(allScores.flatMap(r => getModsFromInt(r.mods_used)))].sort();
-        uniqueMods.forEach(mod => {
-            const button = document.createElement('button');
-            button.className = 'mod-button';
-            button.textContent = mod;
-            button.dataset.mod = mod;
-            button.addEventListener('click', () => {
-                button.classList.toggle('active');
-                if (activeModFilters.has(mod)) activeModFilters.delete(mod);
-                else activeModFilters.add(mod);
-                applyFiltersAndRender(viewElement);
-            });
-            modContainer.appendChild(button);
-        });
+        loadedPlayer = playerName;
+        renderModButtons(viewElement);
 
         applyFiltersAndRender(viewElement);
 
@@ -390,4 +403,26 @@ export async function loadProfile(viewElement, playerName) {
         statusMessage.textContent = error.message;
         viewElement.querySelector('#profile-replays-container').innerHTML = `<p>Error loading profile data.</p>`;
     }
-}
\ No newline at end of file
+}
+
+/**
+ * Merges newly added replays and updated player stats into the loaded profile,
+ * keeping the current filters, sort order and chart selection.
+ * @param {HTMLElement} viewElement - The profile view.
+ * @param {object} delta - The 'replaysadded' payload from the backend.
+ */
+export function applyProfileDelta(viewElement, delta) {
+    if (!loadedPlayer) return;
+    const stats = delta.players[loadedPlayer];
+    if (!stats) return;
+
+    renderStats(viewElement.querySelector('#profile-stats'), stats);
+
+    const knownReplays = new Set(allScores.map(r => r.replay_md5));
+    const newScores = delta.replays.filter(r => r.player_name === loadedPlayer && !knownReplays.has(r.replay_md5));
+    if (newScores.length === 0) return;
+
+    allScores = [...newScores, ...allScores];
+    renderModButtons(viewElement);
+    applyFiltersAndRender(viewElement);
+}
@@ -470,13 +470,7 @@ export function createRecommenderView() {
 
     skipButton.addEventListener('click', () => handleSessionProgress(false, "Map skipped."));
 
-    const checkForNewPlay = async () => {
-        const playerName = document.getElementById('player-selector')?.value;
-        if (!playerName) return;
-
-        statusMessage.textContent = 'New data detected. Checking latest play...';
-        const latestReplay = await getLatestReplay(playerName);
-        
+    const evaluateLatestPlay = (latestReplay) => {
         if (latestReplay && latestReplay.beatmap_md5 === currentRecommendation.md5_hash) {
             const coreRecMods = currentRecommendation.mods & (MODS.Easy | MODS.HardRock | MODS.DoubleTime | MODS.HalfTime);
             const corePlayMods = latestReplay.mods_used & (MODS.Easy | MODS.HardRock | MODS.DoubleTime | MODS.HalfTime);
@@ -516,17 +510,35 @@ export function createRecommenderView() {
                 statusMessage.textContent = `Play detected, but mods don't match recommendation.`;
             }
         } else {
-            // A datachanged event happened, but not for the map we care about.
+            // New data arrived, but not for the map we care about.
             statusMessage.textContent = 'Map found! Play it and your score will be detected automatically.';
         }
     };
 
+    const checkForNewPlay = async () => {
+        const playerName = document.getElementById('player-selector')?.value;
+        if (!playerName) return;
+
+        statusMessage.textContent = 'New data detected. Checking latest play...';
+        evaluateLatestPlay(await getLatestReplay(playerName));
+    };
+
     document.addEventListener('datachanged', () => {
         if (isSessionActive && currentRecommendation) {
             checkForNewPlay();
         }
     });
 
+    // Live plays arrive with the replay row attached, so no refetch is needed.
+    document.addEventListener('replaysadded', (e) => {
+        if (!isSessionActive || !currentRecommendation) return;
+        const playerName = document.getElementById('player-selector')?.value;
+        const latestReplay = e.detail.replays.find(replay => replay.player_name === playerName);
+        if (latestReplay) {
+            evaluateLatestPlay(latestReplay);
+        }
+    });
+
     // Wire up planner buttons
     addStepButton.addEventListener('click', addStepToQueue);
     startSessionButton.addEventListener('click', startSession);
@@ -2,8 +2,35 @@ import { getReplays } from '../services/api.js';
 import { createReplayCard } from '../components/ReplayCard.js';
 import { renderPagination } from '../components/Pagination.js';
 
+const PAGE_SIZE = 50;
+
 let searchTimeout;
 let currentSearchTerm = '';
+let currentPage = 1;
+let currentTotal = 0;
+
+function matchesSearch(replay, searchTerm) {
+    if (!searchTerm) return true;
+    const term = searchTerm.toLowerCase();
+    const beatmap = replay.beatmap || {};
+    return [beatmap.title, beatmap.artist, beatmap.creator].some(value => value && value.toLowerCase().includes(term));
+}
+
+function updateStatusAndPagination(viewElement, page, total, shownCount, searchTerm) {
+    const paginationContainer = viewElement.querySelector('#scores-pagination');
+    const statusMessage = document.getElementById('status-message');
+
+    const start = Math.min((page - 1) * PAGE_SIZE + 1, total);
+    const end = Math.min(start + shownCount - 1, total);
+    statusMessage.textContent = total > 0 ? `Displaying ${start}-${end} of ${total} scores.` : 'No replays found. Try scanning or adjusting your search.';
+
+    paginationContainer.innerHTML = '';
+    if (total > 0) {
+        renderPagination(paginationContainer, page, total, PAGE_SIZE, (newPage) => {
+            loadScores(viewElement, newPage, searchTerm);
+        });
+    }
+}
 
 export function createScoresView() {
     const view = document.createElement('div');
@@ -41,27 +68,53 @@ export async function loadScores(viewElement, page = 1, searchTerm = currentSear
     paginationContainer.innerHTML = '';
 
     try {
-        const response = await getReplays(null, page, 50, searchTerm);
+        const response = await getReplays(null, page, PAGE_SIZE, searchTerm);
         const { replays, total } = response;
-        
-        const start = Math.min((page - 1) * 50 + 1, total);
-        const end = Math.min(start + replays.length - 1, total);
+        currentPage = page;
+        currentTotal = total;
 
-        statusMessage.textContent = total > 0 ? `Displaying ${start}-${end} of ${total} scores.` : 'No replays found. Try scanning or adjusting your search.';
-        
         replays.forEach(replay => {
-            const card = createReplayCard(replay);
-            container.appendChild(card);
+            container.appendChild(createScoreCard(replay));
         });
 
-        if (total > 0) {
-            renderPagination(paginationContainer, page, total, 50, (newPage) => {
-                loadScores(viewElement, newPage, searchTerm);
-            });
-        }
+        updateStatusAndPagination(viewElement, page, total, replays.length, searchTerm);
 
     } catch (error) {
         console.error('Error fetching data:', error);
         statusMessage.textContent = error.message;
     }
-}
\ No newline at end of file
+}
+
+/**
+ * Creates a replay card that remembers its replay, so deltas can skip replays already shown.
+ * @param {object} replay - A replay row from the backend.
+ * @returns {HTMLElement}
+ */
+function createScoreCard(replay) {
+    const card = createReplayCard(replay);
+    card.dataset.replayMd5 = replay.replay_md5;
+    return card;
+}
+
+/**
+ * Patches newly added replays into the list without refetching it.
+ * New plays are the most recent ones, so only the first page changes.
+ * @param {HTMLElement} viewElement - The scores view.
+ * @param {object} delta - The 'replaysadded' payload from the backend.
+ */
+export function applyScoresDelta(viewElement, delta) {
+    const container = viewElement.querySelector('#replays-container');
+    const shownReplays = new Set([...container.children].map(card => card.dataset.replayMd5));
+    const matching = delta.replays.filter(replay =>
+        !shownReplays.has(replay.replay_md5) && matchesSearch(replay, currentSearchTerm));
+    if (matching.length === 0) return;
+
+    currentTotal += matching.length;
+    if (currentPage === 1) {
+        [...matching].reverse().forEach(replay => container.prepend(createScoreCard(replay)));
+        while (container.children.length > PAGE_SIZE) {
+            container.lastElementChild.remove();
+        }
+    }
+    updateStatusAndPagination(viewElement, currentPage, currentTotal, container.children.length, currentSearchTerm);
+}
@@ -0,0 +1,207 @@
+"""
+End-to-end benchmark of the library pipeline on synthetic osu! installs
+(see synthetic_osu.py). For every scale it times each stage, measures its
+throughput and peak memory (RSS), and optionally compares the results with a
+saved baseline:
+
+    python tools/bench_pipeline.py --scales 1000,10000 --save-baseline baseline.json
+    python tools/bench_pipeline.py --scales 1000,10000 --baseline baseline.json
+
+Stages: parse osu!.db, full sync (metadata and analysis), the background
+work a sync queues (mod cache warming, .osu index, pp backfill,
+maintenance), the replay scan and recommendation queries.
+
+Exits with status 1 when a stage fails, or when its throughput drops or its
+peak memory grows by more than --tolerance compared to the baseline.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(TOOLS_DIR, '..', 'backend')
+sys.path.insert(0, TOOLS_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from synthetic_osu import DB_VERSION_FLOAT_STARS, generate_install
+
+RECOMMEND_STARS = [2.0, 3.0, 4.0, 5.0, 6.0, 7.0]
+RECOMMEND_MODS = [0, 16, 64, 80]
+RECOMMEND_FOCUS = [None, 'speed']
+# Stages shorter than this are reported but too noisy to flag as throughput regressions.
+MIN_COMPARABLE_SECONDS = 0.1
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+def _current_rss():
+    """Resident set size of this process in bytes, or None where it cannot be read."""
+    if psutil:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class PeakMemory:
+    """Samples the process RSS in the background while the block runs and keeps the maximum."""
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+
+    def _sample(self):
+        rss = _current_rss()
+        if rss is not None:
+            self.peak = max(self.peak or 0, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+def run_stage(results, scale, name, items, func):
+    """Runs func() and records its duration, throughput (items per second) and peak RSS."""
+    with PeakMemory() as memory:
+        start = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - start
+    results[f"{scale}/{name}"] = {
+        "seconds": round(seconds, 4), "items": items,
+        "throughput": round(items / seconds, 2) if seconds > 0 else None,
+        "peak_rss_mb": round(memory.peak / 2 ** 20, 1) if memory.peak else None,
+    }
+    print(f"  {name:<16} {seconds:9.2f} s  {items:>8} items  "
+          f"{results[f'{scale}/{name}']['throughput'] or 0:>10.1f}/s  "
+          f"{results[f'{scale}/{name}']['peak_rss_mb'] or 0:>8.1f} MB")
+
+def _run_job(job_type, progress_key):
+    """Runs a job through the scheduler like the app does and fails loudly if it did not complete."""
+    import jobs
+    import tasks
+    job = jobs.scheduler.submit(job_type)
+    job.wait()
+    progress = tasks.TASK_PROGRESS[progress_key]
+    if job.status != 'complete' or progress.get('status') == 'error':
+        raise RuntimeError(f"'{job_type}' job ended as {job.status}: {job.error or progress.get('message')}")
+
+def _recommend_all(database):
+    for stars in RECOMMEND_STARS:
+        for mods in RECOMMEND_MODS:
+            for focus in RECOMMEND_FOCUS:
+                database.get_recommendation(stars, 400, mods, [], focus)
+
+def bench_scale(scale, replay_ratio, db_version, work_dir, results):
+    import database
+    import jobs
+    import parser
+    import rate_curves
+
+    osu_folder = os.path.join(work_dir, f'osu_{scale}')
+    replay_count = int(scale * replay_ratio)
+    print(f"\n{scale} beatmaps, {replay_count} replays (osu!.db v{db_version})")
+
+    summary = {}
+    run_stage(results, scale, 'generate', scale,
+              lambda: summary.update(generate_install(osu_folder, scale, replay_count, db_version)))
+
+    os.environ['OSU_FOLDER'] = osu_folder
+    database.DATABASE_FILE = os.path.join(work_dir, f'osu_tracker_{scale}.db')
+    database.init_db()
+    rate_curves.invalidate_index()
+
+    db_path = os.path.join(osu_folder, 'osu!.db')
+    run_stage(results, scale, 'parse osu!.db', summary['listed'], lambda: parser.parse_osu_db(db_path))
+    run_stage(results, scale, 'sync', summary['listed'], lambda: _run_job('sync', 'sync'))
+    run_stage(results, scale, 'sync follow-ups', summary['beatmaps'], jobs.scheduler.wait_idle)
+    run_stage(results, scale, 'scan', replay_count, lambda: _run_job('scan', 'scan'))
+    jobs.scheduler.wait_idle()
+    recommend_calls = len(RECOMMEND_STARS) * len(RECOMMEND_MODS) * len(RECOMMEND_FOCUS)
+    run_stage(results, scale, 'recommend', recommend_calls, lambda: _recommend_all(database))
+
+def compare(results, baseline, tolerance):
+    """Prints the change against the baseline per stage. Returns the names of regressed stages."""
+    regressions = []
+    print(f"\n{'stage':<28}{'throughput':>14}{'peak memory':>14}")
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        notes = []
+        throughput_change = memory_change = None
+        if current['throughput'] and previous.get('throughput'):
+            throughput_change = current['throughput'] / previous['throughput'] - 1
+            comparable = min(current['seconds'], previous['seconds']) >= MIN_COMPARABLE_SECONDS
+            if comparable and throughput_change < -tolerance:
+                notes.append('slower')
+        if current['peak_rss_mb'] and previous.get('peak_rss_mb'):
+            memory_change = current['peak_rss_mb'] / previous['peak_rss_mb'] - 1
+            if memory_change > tolerance:
+                notes.append('more memory')
+        if notes:
+            regressions.append(key)
+        throughput_text = f"{throughput_change:+.1%}" if throughput_change is not None else 'n/a'
+        memory_text = f"{memory_change:+.1%}" if memory_change is not None else 'n/a'
+        print(f"{key:<28}{throughput_text:>14}{memory_text:>14}  {'REGRESSION: ' + ', '.join(notes) if notes else ''}")
+    return regressions
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--scales', default='1000,10000', help='comma-separated beatmap counts, e.g. 1000,10000,100000')
+    arg_parser.add_argument('--replay-ratio', type=float, default=0.5, help='replays generated per beatmap')
+    arg_parser.add_argument('--db-version', type=int, default=DB_VERSION_FLOAT_STARS)
+    arg_parser.add_argument('--work-dir', help='where installs are generated (default: a new temporary directory)')
+    arg_parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    arg_parser.add_argument('--save-baseline', help='write the results of this run to this JSON file')
+    arg_parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative change before a stage counts as regressed')
+    arg_parser.add_argument('--verbose', action='store_true', help='show the application log')
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='osu_tracker_pipeline_')
+    os.makedirs(work_dir, exist_ok=True)
+    print(f"Working directory: {work_dir}")
+
+    # The job modules read OSU_FOLDER at run time, so they can be imported before the first install exists.
+    import tasks  # noqa: F401  (registers the job types)
+
+    results = {}
+    failed = False
+    for scale in (int(value) for value in args.scales.split(',')):
+        try:
+            bench_scale(scale, args.replay_ratio, args.db_version, work_dir, results)
+        except Exception as e:
+            print(f"  FAILED: {e}")
+            failed = True
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Measures the latency of the database functions behind each API endpoint,
+with and without the hot-path indexes, and verifies that the query planner
+uses those indexes for every query in maintenance.HOT_QUERIES.
+
+Runs against a synthetic database in a temporary directory:
+
+    python tools/bench_queries.py --beatmaps 100000 --replays 50000
+
+Exits with status 1 when a hot query still scans a table or sorts in a
+temporary b-tree once the indexes exist.
+"""
+import argparse
+import hashlib
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+sys.path.insert(0, BACKEND_DIR)
+
+PLAYERS = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel']
+REPLAY_MODS = [0, 0, 0, 8, 16, 64, 72, 80, 256, 1024]
+CACHED_MODS = [16, 64, 80]
+
+def _md5(text):
+    return hashlib.md5(text.encode()).hexdigest()
+
+def populate(conn, beatmap_count, replay_count, seed=1):
+    """Fills the beatmaps, beatmap_mod_cache and replays tables with random but plausible rows."""
+    rng = random.Random(seed)
+    beatmaps = []
+    for i in range(beatmap_count):
+        stars = rng.uniform(1.0, 9.0)
+        bpm = rng.uniform(90, 280)
+        beatmaps.append((
+            _md5(f'beatmap-{i}'), f'Artist {rng.randrange(5000)}', f'Title {i}', f'Mapper {rng.randrange(2000)}',
+            f'Diff {i % 6}', f'{i} Artist - Title', f'beatmap-{i}.osu',
+            0 if rng.random() < 0.9 else rng.randrange(1, 4),
+            rng.randrange(100, 1500), rng.randrange(50, 800), rng.randrange(0, 3),
+            rng.uniform(5, 10), rng.uniform(3, 6), rng.uniform(3, 8), rng.uniform(5, 10),
+            stars, stars * 0.55, stars * 0.45, rng.uniform(0.8, 1.0), bpm, bpm, bpm,
+            rng.uniform(50, 600), rng.uniform(10, 300), rng.uniform(10, 300), rng.uniform(0, 200),
+        ))
+    conn.executemany('''
+        INSERT INTO beatmaps (md5_hash, artist, title, creator, difficulty, folder_name, osu_file_name,
+            game_mode, num_hitcircles, num_sliders, num_spinners, ar, cs, hp, od,
+            stars, aim, speed, slider_factor, bpm, bpm_min, bpm_max,
+            speed_note_count, aim_difficult_strain_count, speed_difficult_strain_count, aim_difficult_slider_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', beatmaps)
+
+    standard = [row for row in beatmaps if row[7] == 0]
+    conn.executemany('''
+        INSERT INTO beatmap_mod_cache (md5_hash, mods, stars, aim, speed, slider_factor,
+            speed_note_count, aim_difficult_strain_count, speed_difficult_strain_count, aim_difficult_slider_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        (row[0], mods, row[15] * factor, row[16] * factor, row[17] * factor, row[18],
+         row[22], row[23], row[24], row[25])
+        for mods in CACHED_MODS
+        for factor in [1.4 if mods & 64 else 1.1]
+        for row in standard
+    ))
+
+    conn.executemany('''
+        INSERT INTO replays (game_mode, game_version, beatmap_md5, player_name, replay_md5,
+            num_300s, num_100s, num_50s, num_gekis, num_katus, num_misses, total_score, max_combo,
+            mods_used, pp, stars, played_at)
+        VALUES (0, 20240101, ?, ?, ?, 500, 20, 2, 50, 10, 1, 1000000, 700, ?, ?, ?, ?)
+    ''', (
+        (rng.choice(beatmaps)[0], rng.choice(PLAYERS), _md5(f'replay-{i}'), rng.choice(REPLAY_MODS),
+         rng.uniform(10, 500), rng.uniform(1, 9),
+         f'20{rng.randrange(15, 26)}-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}T'
+         f'{rng.randrange(24):02d}:{rng.randrange(60):02d}:00')
+        for i in range(replay_count)
+    ))
+    conn.commit()
+
+def endpoint_calls(database):
+    """The database calls behind each endpoint, as (name, function)."""
+    player = PLAYERS[0]
+    return [
+        ("GET /replays?player", lambda: database.get_all_replays(player_name=player)),
+        ("GET /replays", lambda: database.get_all_replays()),
+        ("GET /players/<name>/stats", lambda: database.get_player_stats(player)),
+        ("GET /players", lambda: database.get_unique_players()),
+        ("GET /beatmaps", lambda: database.get_all_beatmaps()),
+        ("mod frequencies", lambda: database.get_replay_mod_frequencies()),
+        ("mod cache coverage", lambda: database.get_mod_cache_coverage()),
+        ("recommend NoMod", lambda: database.get_recommendation(5.0, 250, 0)),
+        ("recommend DT", lambda: database.get_recommendation(6.0, 300, 64)),
+        ("stale replays", lambda: database.get_stale_replays()),
+    ]
+
+def measure(calls, repeat):
+    """Returns {name: median seconds} over repeat calls of each function."""
+    results = {}
+    for name, call in calls:
+        call()  # Warm the page cache.
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            call()
+            samples.append(time.perf_counter() - start)
+        results[name] = statistics.median(samples)
+    return results
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--beatmaps', type=int, default=100000)
+    arg_parser.add_argument('--replays', type=int, default=50000)
+    arg_parser.add_argument('--repeat', type=int, default=5, help='timed calls per endpoint')
+    args = arg_parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='osu_tracker_bench_')
+    import database
+    import maintenance
+    database.DATABASE_FILE = os.path.join(work_dir, 'osu_tracker.db')
+    database.init_db()
+    print(f"Working directory: {work_dir}")
+
+    conn = database.get_db_connection()
+    for name, _, _ in database.HOT_PATH_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    start = time.perf_counter()
+    populate(conn, args.beatmaps, args.replays)
+    conn.execute("ANALYZE")
+    conn.commit()
+    print(f"Generated {args.beatmaps} beatmaps and {args.replays} replays in {time.perf_counter() - start:.1f} s")
+
+    calls = endpoint_calls(database)
+    before = measure(calls, args.repeat)
+
+    start = time.perf_counter()
+    database._migration_007_hot_path_indexes(conn.cursor())
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+    print(f"Created {len(database.HOT_PATH_INDEXES)} indexes in {time.perf_counter() - start:.1f} s\n")
+    after = measure(calls, args.repeat)
+
+    print(f"{'endpoint':<28}{'no index':>12}{'indexed':>12}{'speedup':>10}")
+    for name, _ in calls:
+        print(f"{name:<28}{before[name] * 1000:>9.2f} ms{after[name] * 1000:>9.2f} ms"
+              f"{before[name] / max(after[name], 1e-9):>9.1f}x")
+
+    print()
+    failed = False
+    for result in maintenance.check_query_plans():
+        print(f"{'ok  ' if result['ok'] else 'FAIL'} {result['name']}: {' | '.join(result['plan'])}")
+        failed = failed or not result['ok']
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
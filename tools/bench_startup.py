@@ -0,0 +1,116 @@
+"""
+Compares the time until the frontend can be painted with the previous eager
+startup order and with the deferred one app.py uses now:
+
+    python tools/bench_startup.py --beatmaps 100000 --replays 50000
+
+Each run starts a fresh interpreter on a copy of a synthetic database that
+still needs the latest migrations, like the first start after an update.
+
+- eager: imports pywebview, watchdog and rosu-pp up front and migrates the
+  database before the server answers anything.
+- deferred: imports only what serving needs and migrates in the background
+  (startup.start_background_init); /api requests wait for it.
+
+For both it reports the time to import the app, to serve index.html (the
+window can paint) and to answer the first /api request (data is shown).
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(TOOLS_DIR, '..', 'backend')
+sys.path.insert(0, TOOLS_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+# Runs in the child interpreter; prints the phase timings in ms as JSON.
+CHILD = r'''
+import time
+start = time.perf_counter()
+import json, sys
+sys.path.insert(0, sys.argv[1])
+mode = sys.argv[2]
+ms = lambda: round((time.perf_counter() - start) * 1000, 1)
+
+if mode == 'eager':
+    import webview, watchdog.observers, rosu_pp_py
+import app, database, startup
+timings = {"import": ms()}
+client = app.app.test_client()
+if mode == 'eager':
+    database.init_db()
+else:
+    startup.start_background_init(database.init_db)
+assert client.get('/').status_code == 200
+timings["index served"] = ms()
+assert client.get('/api/replays').status_code == 200
+timings["first api response"] = ms()
+print(json.dumps(timings))
+'''
+
+MODES = ('eager', 'deferred')
+# Migrations that run on the benchmark database at startup.
+PENDING_FROM_VERSION = 6
+
+def build_database(path, beatmap_count, replay_count):
+    """A database at schema version PENDING_FROM_VERSION, so the newer migrations run at startup."""
+    import database
+    from bench_queries import populate
+
+    database.DATABASE_FILE = path
+    database.init_db()
+    conn = database.get_db_connection()
+    populate(conn, beatmap_count, replay_count)
+    for name, _, _ in database.HOT_PATH_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    conn.execute("DROP TABLE IF EXISTS task_runs")
+    conn.execute(f"PRAGMA user_version = {PENDING_FROM_VERSION}")
+    conn.commit()
+    conn.close()
+
+def run_child(mode, template, work_dir):
+    run_dir = tempfile.mkdtemp(dir=work_dir)
+    shutil.copy(template, os.path.join(run_dir, 'osu_tracker.db'))
+    # The app resolves osu_tracker.db against the working directory.
+    result = subprocess.run([sys.executable, '-c', CHILD, os.path.abspath(BACKEND_DIR), mode],
+                            cwd=run_dir, capture_output=True, text=True, env={**os.environ, 'METRICS_ENABLED': '0'})
+    shutil.rmtree(run_dir, ignore_errors=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{mode} run failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--beatmaps', type=int, default=100000)
+    arg_parser.add_argument('--replays', type=int, default=50000)
+    arg_parser.add_argument('--repeat', type=int, default=3, help='runs per mode (the median is reported)')
+    args = arg_parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='osu_tracker_startup_')
+    template = os.path.join(work_dir, 'template.db')
+    start = time.perf_counter()
+    build_database(template, args.beatmaps, args.replays)
+    with sqlite3.connect(template) as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    print(f"Working directory: {work_dir}")
+    print(f"Built a schema v{version} database with {args.beatmaps} beatmaps and {args.replays} replays "
+          f"in {time.perf_counter() - start:.1f} s\n")
+
+    results = {mode: [run_child(mode, template, work_dir) for _ in range(args.repeat)] for mode in MODES}
+    phases = list(results['eager'][0])
+    print(f"{'phase':<22}" + ''.join(f"{mode:>12}" for mode in MODES))
+    for phase in phases:
+        medians = [statistics.median(run[phase] for run in results[mode]) for mode in MODES]
+        print(f"{phase:<22}" + ''.join(f"{median:>9.0f} ms" for median in medians))
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
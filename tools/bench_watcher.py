@@ -0,0 +1,157 @@
+"""
+Measures the latency from replay file creation to database commit through
+the live watcher (watchdog observer + ingest queue).
+
+Runs against a throwaway osu! folder and database in a temporary directory:
+
+    python tools/bench_watcher.py --single 20 --burst 300
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import statistics
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+sys.path.insert(0, BACKEND_DIR)
+
+def _osu_string(value):
+    """Encodes a string in the osu! binary format."""
+    if not value:
+        return b'\x00'
+    data = value.encode('utf-8')
+    length = len(data)
+    uleb = bytearray()
+    while True:
+        byte = length & 0x7F
+        length >>= 7
+        if length:
+            uleb.append(byte | 0x80)
+        else:
+            uleb.append(byte)
+            break
+    return b'\x0b' + bytes(uleb) + data
+
+def build_replay_bytes(replay_md5, beatmap_md5='0' * 32, player_name='bench', hits=(300, 10, 0, 20, 5, 0),
+                       total_score=1000000, max_combo=400, mods=0, played_at_ticks=638000000000000000, game_mode=0):
+    """Builds a minimal but well-formed .osr file. hits is (300s, 100s, 50s, gekis, katus, misses)."""
+    return b''.join([
+        struct.pack('<BI', game_mode, 20240101),
+        _osu_string(beatmap_md5), _osu_string(player_name), _osu_string(replay_md5),
+        struct.pack('<HHHHHH', *hits),
+        struct.pack('<IHBI', total_score, max_combo, 0, mods),
+        _osu_string(''),
+        struct.pack('<Q', played_at_ticks),
+        struct.pack('<I', 0),
+        struct.pack('<q', 0),
+    ])
+
+class CommitMonitor:
+    """Polls the replays table in the background and records when each replay_md5 first appears."""
+    def __init__(self, db_path, interval=0.005):
+        self.db_path = db_path
+        self.interval = interval
+        self.committed_at = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path)
+        while not self._stop.is_set():
+            now = time.monotonic()
+            for (replay_md5,) in conn.execute("SELECT replay_md5 FROM replays"):
+                self.committed_at.setdefault(replay_md5, now)
+            time.sleep(self.interval)
+        conn.close()
+
+    def wait_for(self, created_at, timeout):
+        """Blocks until every replay in created_at is committed; returns {replay_md5: latency_seconds}."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and not created_at.keys() <= self.committed_at.keys():
+            time.sleep(0.01)
+        return {
+            replay_md5: self.committed_at[replay_md5] - start
+            for replay_md5, start in created_at.items() if replay_md5 in self.committed_at
+        }
+
+def _write_replay(replays_path, name, created_at, slow_chunks=1, chunk_delay=0.0):
+    replay_md5 = hashlib.md5(name.encode()).hexdigest()
+    created_at[replay_md5] = time.monotonic()
+    data = build_replay_bytes(replay_md5)
+    with open(os.path.join(replays_path, f'{replay_md5}.osr'), 'wb') as f:
+        step = max(1, len(data) // slow_chunks)
+        for i in range(0, len(data), step):
+            f.write(data[i:i + step])
+            f.flush()
+            if chunk_delay:
+                time.sleep(chunk_delay)
+    return replay_md5
+
+def _report(name, latencies, expected):
+    values = sorted(latencies.values())
+    if not values:
+        print(f"{name:<12} no replays committed (expected {expected})")
+        return
+    p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+    print(f"{name:<12} n={len(values)}/{expected}  p50={statistics.median(values) * 1000:7.1f} ms  "
+          f"p95={p95 * 1000:7.1f} ms  max={values[-1] * 1000:7.1f} ms")
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--single', type=int, default=20, help='replays written one at a time')
+    arg_parser.add_argument('--burst', type=int, default=300, help='replays written at once')
+    arg_parser.add_argument('--slow', type=int, default=5, help='replays written in chunks over ~0.5 s')
+    arg_parser.add_argument('--timeout', type=float, default=60.0)
+    args = arg_parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='osu_tracker_bench_')
+    osu_folder = os.path.join(work_dir, 'osu')
+    replays_path = os.path.join(osu_folder, 'Data', 'r')
+    os.makedirs(replays_path)
+    os.makedirs(os.path.join(osu_folder, 'Songs'))
+    os.environ['OSU_FOLDER'] = osu_folder
+
+    import database
+    import watcher
+    database.DATABASE_FILE = os.path.join(work_dir, 'osu_tracker.db')
+    database.init_db()
+
+    thread = threading.Thread(target=watcher.start_watching, args=(osu_folder, None), daemon=True)
+    thread.start()
+    time.sleep(0.5)  # Let the observer start.
+
+    print(f"Working directory: {work_dir}")
+    monitor = CommitMonitor(database.DATABASE_FILE)
+    monitor.start()
+
+    created_at = {}
+    for i in range(args.single):
+        _write_replay(replays_path, f'single-{i}', created_at)
+        time.sleep(0.05)
+    _report('single', monitor.wait_for(created_at, args.timeout), args.single)
+
+    created_at = {}
+    for i in range(args.burst):
+        _write_replay(replays_path, f'burst-{i}', created_at)
+    _report('burst', monitor.wait_for(created_at, args.timeout), args.burst)
+
+    created_at = {}
+    for i in range(args.slow):
+        _write_replay(replays_path, f'slow-{i}', created_at, slow_chunks=5, chunk_delay=0.1)
+    _report('slow-writer', monitor.wait_for(created_at, args.timeout), args.slow)
+    monitor.stop()
+
+if __name__ == '__main__':
+    main()
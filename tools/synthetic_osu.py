@@ -0,0 +1,277 @@
+"""
+Writes a synthetic osu! installation for benchmarks: an osu!.db in any of
+the database formats the parser supports, a Songs tree of playable .osu files
+and Data/r replays that reference them.
+
+    python tools/synthetic_osu.py /tmp/fake_osu --beatmaps 10000 --replays 5000 --db-version 20191106
+
+A small share of the beatmaps is only written to Songs and left out of
+osu!.db, the way freshly downloaded maps are, and a few replays reference
+beatmaps that exist nowhere. Output is deterministic for a given seed.
+"""
+import argparse
+import hashlib
+import os
+import random
+import struct
+import sys
+from datetime import datetime
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, TOOLS_DIR)
+
+from bench_watcher import _osu_string, build_replay_bytes
+
+# osu!.db format changes handled by parser.parse_osu_db.
+DB_VERSION_FLOAT_DIFFICULTY = 20140609  # AR/CS/HP/OD as floats, star rating tables added
+DB_VERSION_NO_ENTRY_SIZE = 20191106  # Entries are no longer prefixed with their size
+DB_VERSION_FLOAT_STARS = 20250107  # Star ratings stored as floats instead of doubles
+DB_VERSIONS = [20140508, DB_VERSION_FLOAT_DIFFICULTY, 20190906, DB_VERSION_NO_ENTRY_SIZE, DB_VERSION_FLOAT_STARS]
+
+PLAYERS = ['alpha', 'bravo', 'charlie', 'delta']
+REPLAY_MODS = [0, 0, 0, 8, 16, 64, 72, 80, 256, 1024]
+DIFFICULTY_NAMES = ['Easy', 'Normal', 'Hard', 'Insane', 'Expert', 'Extra']
+TICKS_PER_SECOND = 10_000_000
+EPOCH = datetime(1, 1, 1)
+
+def _windows_ticks(moment):
+    return int((moment - EPOCH).total_seconds() * TICKS_PER_SECOND)
+
+def build_osu_file(rng, beatmap):
+    """Returns (text, hit_object_counts, timing_points, end_time) of a playable osu!standard-style .osu file."""
+    beat_length = 60000.0 / beatmap['bpm']
+    offset = rng.randrange(0, 2000)
+    timing_points = [(beat_length, offset, True)]
+    lines = [f"{offset},{beat_length:.6f},4,2,0,60,1,0"]
+    if rng.random() < 0.2:
+        # A second BPM section late in the map.
+        second_offset = offset + int(beat_length * rng.randrange(64, 256))
+        second_length = 60000.0 / (beatmap['bpm'] * rng.choice([0.75, 1.25, 1.5]))
+        timing_points.append((second_length, second_offset, True))
+        lines.append(f"{second_offset},{second_length:.6f},4,2,0,60,1,0")
+    lines.append(f"{offset + int(beat_length * 32)},-100,4,2,0,70,0,1")
+
+    circles = sliders = spinners = 0
+    objects = []
+    time = offset
+    for _ in range(beatmap['object_count']):
+        x, y = rng.randrange(0, 512), rng.randrange(0, 384)
+        roll = rng.random()
+        if roll < 0.6:
+            objects.append(f"{x},{y},{time},1,0,0:0:0:0:")
+            circles += 1
+            time += int(beat_length / rng.choice([1, 2, 2, 4]))
+        elif roll < 0.99:
+            end_x, end_y = max(0, min(511, x + rng.randrange(-120, 120))), max(0, min(383, y + rng.randrange(-90, 90)))
+            length = rng.randrange(40, 200)
+            objects.append(f"{x},{y},{time},2,0,B|{end_x}:{end_y},1,{length}")
+            sliders += 1
+            time += int(beat_length * rng.choice([1, 2]))
+        else:
+            end_time = time + int(beat_length * 4)
+            objects.append(f"256,192,{time},12,0,{end_time},0:0:0:0:")
+            spinners += 1
+            time = end_time + int(beat_length)
+
+    text = "\n".join([
+        "osu file format v14",
+        "",
+        "[General]",
+        "AudioFilename: audio.mp3",
+        "AudioLeadIn: 0",
+        f"PreviewTime: {beatmap['preview_time']}",
+        f"Mode: {beatmap['game_mode']}",
+        "",
+        "[Metadata]",
+        f"Title:{beatmap['title']}",
+        f"TitleUnicode:{beatmap['title']}",
+        f"Artist:{beatmap['artist']}",
+        f"ArtistUnicode:{beatmap['artist']}",
+        f"Creator:{beatmap['creator']}",
+        f"Version:{beatmap['difficulty']}",
+        "Source:",
+        "Tags:synthetic benchmark",
+        f"BeatmapID:{beatmap['beatmap_id']}",
+        f"BeatmapSetID:{beatmap['set_id']}",
+        "",
+        "[Difficulty]",
+        f"HPDrainRate:{beatmap['hp']}",
+        f"CircleSize:{beatmap['cs']}",
+        f"OverallDifficulty:{beatmap['od']}",
+        f"ApproachRate:{beatmap['ar']}",
+        "SliderMultiplier:1.4",
+        "SliderTickRate:1",
+        "",
+        "[Events]",
+        '0,0,"bg.jpg",0,0',
+        "",
+        "[TimingPoints]",
+        *lines,
+        "",
+        "[HitObjects]",
+        *objects,
+        "",
+    ])
+    return text, (circles, sliders, spinners), timing_points, time
+
+def _difficulty_bytes(beatmap, db_version):
+    values = (beatmap['ar'], beatmap['cs'], beatmap['hp'], beatmap['od'])
+    if db_version < DB_VERSION_FLOAT_DIFFICULTY:
+        return struct.pack('<BBBB', *(int(value) for value in values))
+    return struct.pack('<ffff', *values)
+
+def _star_rating_bytes(beatmap, db_version):
+    """Four star rating tables (one per mode); only the beatmap's own mode has entries."""
+    if db_version < DB_VERSION_FLOAT_DIFFICULTY:
+        return b''
+    tables = []
+    for mode in range(4):
+        pairs = [(0, beatmap['stars']), (64, beatmap['stars'] * 1.4), (16, beatmap['stars'] * 1.1)] \
+            if mode == beatmap['game_mode'] else []
+        table = struct.pack('<I', len(pairs))
+        for mods, stars in pairs:
+            if db_version >= DB_VERSION_FLOAT_STARS:
+                table += struct.pack('<BIBf', 0x08, mods, 0x0c, stars)
+            else:
+                table += struct.pack('<BIBd', 0x08, mods, 0x0d, stars)
+        tables.append(table)
+    return b''.join(tables)
+
+def build_osu_db_entry(beatmap, db_version):
+    """Serializes one beatmap the way osu! writes it in the given osu!.db version."""
+    timing = b''.join(struct.pack('<ddB', length, offset, uninherited)
+                      for length, offset, uninherited in beatmap['timing_points'])
+    body = b''.join([
+        _osu_string(beatmap['artist']), _osu_string(beatmap['artist']),
+        _osu_string(beatmap['title']), _osu_string(beatmap['title']),
+        _osu_string(beatmap['creator']), _osu_string(beatmap['difficulty']),
+        _osu_string('audio.mp3'), _osu_string(beatmap['md5']), _osu_string(beatmap['osu_file_name']),
+        struct.pack('<BHHHQ', 4, *beatmap['object_counts'], beatmap['modified_ticks']),
+        _difficulty_bytes(beatmap, db_version),
+        struct.pack('<d', 1.4),
+        _star_rating_bytes(beatmap, db_version),
+        struct.pack('<III', beatmap['drain_time'], beatmap['total_time'], beatmap['preview_time']),
+        struct.pack('<I', len(beatmap['timing_points'])), timing,
+        struct.pack('<III', beatmap['beatmap_id'], beatmap['set_id'], 0),
+        struct.pack('<BBBB', *beatmap['grades']),
+        struct.pack('<hfB', 0, 0.7, beatmap['game_mode']),
+        _osu_string(''), _osu_string('synthetic benchmark'),
+        struct.pack('<h', 0), _osu_string(''),
+        struct.pack('<BQB', beatmap['last_played_ticks'] == 0, beatmap['last_played_ticks'], 0),
+        _osu_string(beatmap['folder_name']),
+        struct.pack('<Q', beatmap['modified_ticks']),
+        struct.pack('<BBBBB', 0, 0, 0, 0, 0),
+        struct.pack('<H', 0) if db_version < DB_VERSION_FLOAT_DIFFICULTY else b'',
+        struct.pack('<IB', 0, 0),
+    ])
+    if db_version < DB_VERSION_NO_ENTRY_SIZE:
+        return struct.pack('<I', len(body)) + body
+    return body
+
+def write_osu_db(path, beatmaps, db_version, player_name='alpha'):
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<IIBQ', db_version, len({b['folder_name'] for b in beatmaps}), 1, 0))
+        f.write(_osu_string(player_name))
+        f.write(struct.pack('<I', len(beatmaps)))
+        for beatmap in beatmaps:
+            f.write(build_osu_db_entry(beatmap, db_version))
+        f.write(struct.pack('<I', 0))  # user permissions
+
+def _write_replays(replays_path, rng, beatmaps, count, missing_ratio):
+    first_played = datetime(2015, 1, 1)
+    span_seconds = int((datetime(2025, 12, 31) - first_played).total_seconds())
+    for i in range(count):
+        if rng.random() < missing_ratio:
+            beatmap_md5, total_objects = hashlib.md5(f'missing-{i}'.encode()).hexdigest(), 500
+        else:
+            beatmap = rng.choice(beatmaps)
+            beatmap_md5, total_objects = beatmap['md5'], sum(beatmap['object_counts'])
+        misses = rng.randrange(0, max(1, total_objects // 50))
+        num_100s = rng.randrange(0, max(1, total_objects // 10))
+        num_50s = rng.randrange(0, max(1, total_objects // 40))
+        num_300s = max(0, total_objects - misses - num_100s - num_50s)
+        played_at = _windows_ticks(first_played) + rng.randrange(span_seconds) * TICKS_PER_SECOND
+        replay_md5 = hashlib.md5(f'replay-{i}'.encode()).hexdigest()
+        data = build_replay_bytes(
+            replay_md5, beatmap_md5, rng.choice(PLAYERS),
+            hits=(num_300s, num_100s, num_50s, 0, 0, misses),
+            total_score=rng.randrange(100000, 10000000), max_combo=rng.randrange(1, total_objects + 1),
+            mods=rng.choice(REPLAY_MODS), played_at_ticks=played_at,
+        )
+        with open(os.path.join(replays_path, f'{replay_md5}.osr'), 'wb') as f:
+            f.write(data)
+
+def generate_install(osu_folder, beatmaps=1000, replays=500, db_version=DB_VERSION_FLOAT_STARS, seed=1,
+                     unlisted_ratio=0.01, missing_ratio=0.01, min_objects=100, max_objects=600):
+    """
+    Writes osu!.db, Songs and Data/r under osu_folder. Returns a summary dict:
+    {"beatmaps", "listed", "replays", "db_version", "bytes"}.
+    """
+    rng = random.Random(seed)
+    songs_path = os.path.join(osu_folder, 'Songs')
+    replays_path = os.path.join(osu_folder, 'Data', 'r')
+    os.makedirs(songs_path, exist_ok=True)
+    os.makedirs(replays_path, exist_ok=True)
+
+    written = []
+    total_bytes = 0
+    set_id = 0
+    while len(written) < beatmaps:
+        set_id += 1
+        artist, title = f"Artist {rng.randrange(5000)}", f"Song {set_id}"
+        creator = f"Mapper {rng.randrange(2000)}"
+        folder_name = f"{100000 + set_id} {artist} - {title}"
+        os.makedirs(os.path.join(songs_path, folder_name), exist_ok=True)
+        bpm = rng.choice([120, 140, 150, 160, 170, 180, 200, 220, 240]) + rng.random() * 5
+        game_mode = 0 if rng.random() < 0.9 else rng.randrange(1, 4)
+        difficulty_count = min(rng.randrange(1, len(DIFFICULTY_NAMES) + 1), beatmaps - len(written))
+
+        for level in range(difficulty_count):
+            beatmap = {
+                'artist': artist, 'title': title, 'creator': creator, 'folder_name': folder_name,
+                'difficulty': DIFFICULTY_NAMES[level], 'game_mode': game_mode, 'bpm': bpm,
+                'set_id': set_id, 'beatmap_id': set_id * 10 + level,
+                'ar': round(min(10.0, 4 + level + rng.random()), 1), 'od': round(min(10.0, 3 + level + rng.random()), 1),
+                'cs': round(3 + rng.random() * 2, 1), 'hp': round(3 + rng.random() * 4, 1),
+                'object_count': rng.randrange(min_objects, max_objects) * (level + 2) // 4,
+                'preview_time': rng.randrange(10000, 60000),
+            }
+            text, counts, timing_points, end_time = build_osu_file(rng, beatmap)
+            data = text.encode('utf-8')
+            beatmap.update({
+                'md5': hashlib.md5(data).hexdigest(),
+                'osu_file_name': f"{artist} - {title} ({creator}) [{beatmap['difficulty']}].osu",
+                'object_counts': counts, 'timing_points': timing_points,
+                'drain_time': end_time // 1000, 'total_time': end_time,
+                'stars': 1.5 + level * 1.2 + rng.random(),
+                'grades': (rng.choice([0, 1, 2, 3, 4, 9]), 9, 9, 9),
+                'modified_ticks': _windows_ticks(datetime(2020, 1, 1)),
+                'last_played_ticks': 0 if rng.random() < 0.5 else _windows_ticks(datetime(2024, 6, 1)),
+            })
+            with open(os.path.join(songs_path, folder_name, beatmap['osu_file_name']), 'wb') as f:
+                f.write(data)
+            total_bytes += len(data)
+            written.append(beatmap)
+
+    listed = [beatmap for beatmap in written if rng.random() >= unlisted_ratio]
+    write_osu_db(os.path.join(osu_folder, 'osu!.db'), listed, db_version)
+    _write_replays(replays_path, rng, written, replays, missing_ratio)
+    return {"beatmaps": len(written), "listed": len(listed), "replays": replays,
+            "db_version": db_version, "bytes": total_bytes}
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('osu_folder')
+    arg_parser.add_argument('--beatmaps', type=int, default=1000)
+    arg_parser.add_argument('--replays', type=int, default=500)
+    arg_parser.add_argument('--db-version', type=int, default=DB_VERSION_FLOAT_STARS,
+                            help=f"osu!.db version, e.g. {', '.join(map(str, DB_VERSIONS))}")
+    arg_parser.add_argument('--seed', type=int, default=1)
+    args = arg_parser.parse_args()
+
+    summary = generate_install(args.osu_folder, args.beatmaps, args.replays, args.db_version, args.seed)
+    print(f"Wrote {summary['beatmaps']} beatmaps ({summary['listed']} in osu!.db v{summary['db_version']}, "
+          f"{summary['bytes'] / 1e6:.1f} MB of .osu files) and {summary['replays']} replays to {args.osu_folder}")
+
+if __name__ == '__main__':
+    main()